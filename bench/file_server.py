@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+'''
+Throughput of the asyncio file server against the old Flask server
+(send_from_directory on the threaded dev server).
+
+    python bench/file_server.py --size 256 --clients 1 8 32
+
+Each server runs in its own process on a temporary file; the client side opens
+`clients` connections that each download the whole file `--rounds` times.
+The Flask run is skipped if flask isn't installed.
+'''
+
+SECRET = "bench"
+
+def serve_asyncio(root, port):
+    from modules.webserver import server
+    server.SECRET = SECRET.encode()
+    async def main():
+        srv = await server.FileServer(root).start("127.0.0.1", port)
+        async with srv:
+            await srv.serve_forever()
+    asyncio.run(main())
+
+def serve_flask(root, port):
+    import logging
+    from flask import Flask, send_from_directory
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    app = Flask(__name__)
+
+    @app.route('/<path:filename>')
+    def serve_file(filename):
+        return send_from_directory(root, filename)
+
+    app.run(host="127.0.0.1", port=port, threaded=True)
+
+async def fetch(port, path, rounds):
+    received = 0
+    for _ in range(rounds):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        await reader.readuntil(b"\r\n\r\n")
+        while True:
+            chunk = await reader.read(1024 * 1024)
+            if not chunk:
+                break
+            received += len(chunk)
+        writer.close()
+    return received
+
+async def wait_for_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return True
+        except OSError:
+            await asyncio.sleep(0.1)
+    return False
+
+async def run(kind, root, name, port, clients, rounds):
+    if await wait_for_port(port, timeout=0.1):
+        print(f"{kind}: port {port} is already in use, pick another with --port")
+        return
+    process = subprocess.Popen([sys.executable, __file__, "--serve", kind, "--root", root, "--port", str(port)])
+    try:
+        if not await wait_for_port(port):
+            print(f"{kind}: server did not start")
+            return
+        if kind == "asyncio":
+            from modules.webserver import server
+            server.SECRET = SECRET.encode()
+            expires = int(time.time() + 3600)
+            path = f"/{name}?exp={expires}&sig={server.sign(name, expires)}"
+        else:
+            path = f"/{name}"
+        for count in clients:
+            started = time.perf_counter()
+            total = sum(await asyncio.gather(*(fetch(port, path, rounds) for _ in range(count))))
+            elapsed = time.perf_counter() - started
+            print(f"{kind:8} clients={count:<4} {total / elapsed / 1024 ** 2:10.1f} MB/s  ({elapsed:.2f}s)")
+    finally:
+        process.terminate()
+        process.wait()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=256, help="test file size in MB")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--port", type=int, default=18765)
+    parser.add_argument("--serve", choices=["asyncio", "flask"], help=argparse.SUPPRESS)
+    parser.add_argument("--root", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve == "asyncio":
+        return serve_asyncio(args.root, args.port)
+    if args.serve == "flask":
+        return serve_flask(args.root, args.port)
+
+    with tempfile.TemporaryDirectory() as root:
+        name = "bench.bin"
+        with open(os.path.join(root, name), "wb") as f:
+            f.write(os.urandom(1024 * 1024) * args.size)
+
+        asyncio.run(run("asyncio", root, name, args.port, args.clients, args.rounds))
+        try:
+            import flask  # noqa: F401
+        except ImportError:
+            print("flask is not installed, skipping the Flask baseline")
+            return
+        asyncio.run(run("flask", root, name, args.port + 1, args.clients, args.rounds))
+
+if __name__ == "__main__":
+    main()
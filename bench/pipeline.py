@@ -0,0 +1,426 @@
+import os
+import sys
+import json
+import time
+import types
+import asyncio
+import argparse
+import resource
+import tempfile
+import itertools
+import subprocess
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT)
+
+'''
+Offline end-to-end benchmark of the download pipeline.
+
+    python bench/pipeline.py --users 1 10 50 200 --size 4
+    python bench/pipeline.py --save baseline.json
+    python bench/pipeline.py --compare baseline.json
+
+Every job goes through main.download_video() -> route() -> the general provider ->
+yt-dlp's generic extractor, against a local HTTP server (own process) serving a
+generated MP4 under a different URL per job, so nothing is deduplicated or cached.
+The URLs use MEDIA_HOST, which passes the bot's URL check but doesn't resolve; the
+level processes reach it by using the media server as their HTTP proxy.
+Telegram is replaced by FakeTelegram/FakeMessage, which record edits and "upload"
+files by reading them in parts with a simulated per-call API latency.
+
+Each concurrency level runs in a fresh process (peak RSS is per process) with its
+own config module and working directory; the bot's config.py is never read.
+Streaming uploads talk to Telegram's raw API and are disabled here.
+
+Reported per level: jobs/min, end-to-end latency p50/p95, p50/p95 per stage (from
+the metrics module), event-loop lag and peak RSS.
+'''
+
+MEDIA_HOST = "media.bench.localhost"
+PART_SIZE = 512 * 1024
+LAG_INTERVAL = 0.05
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+# Media server
+
+def make_media(path, size_mb):
+    """Something yt-dlp's generic extractor takes for an MP4: ftyp box, then filler."""
+    ftyp = b"\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom"
+    with open(path, "wb") as f:
+        f.write(ftyp)
+        block = os.urandom(1024 * 1024)
+        for _ in range(size_mb):
+            f.write(block)
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    media_path = None
+    rate = None  # bytes/s per connection, None for unthrottled
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.serve(body=False)
+
+    def do_GET(self):
+        self.serve(body=True)
+
+    def serve(self, body):
+        # Proxied requests carry the absolute URL
+        if not urlsplit(self.path).path.startswith("/v/"):
+            self.send_error(404)
+            return
+        size = os.path.getsize(self.media_path)
+        start, end = 0, size - 1
+        header = self.headers.get("Range")
+        if header and header.startswith("bytes="):
+            first, _, last = header[6:].partition("-")
+            start = int(first or 0)
+            end = min(int(last), size - 1) if last else size - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        if not body:
+            return
+        with open(self.media_path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(PART_SIZE, remaining))
+                if not chunk:
+                    break
+                try:
+                    self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                remaining -= len(chunk)
+                if self.rate:
+                    time.sleep(len(chunk) / self.rate)
+
+class MediaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The generic extractor drops its probe connection without reading the body
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+def serve_media(path, port, rate):
+    MediaHandler.media_path = path
+    MediaHandler.rate = rate
+    MediaServer(("127.0.0.1", port), MediaHandler).serve_forever()
+
+# Fake Telegram
+
+class FakeTelegram:
+    """Stands in for the pyrogram Client, every API call costs `latency` seconds."""
+    def __init__(self, latency, upload_rate):
+        self.latency = latency
+        self.upload_rate = upload_rate
+        self.ids = itertools.count(1)
+        self.calls = 0
+        self.edits = 0
+        self.uploads = 0
+        self.uploaded_bytes = 0
+
+    async def call(self):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+
+    def message(self, chat_id, text=None, **media):
+        return FakeMessage(self, chat_id, text, **media)
+
+    async def upload(self, path, progress):
+        """Reads the file in parts on the loop, like pyrogram's save_file."""
+        total = os.path.getsize(path)
+        current = 0
+        with open(path, "rb") as f:
+            while True:
+                part = f.read(PART_SIZE)
+                if not part:
+                    break
+                current += len(part)
+                await self.call()
+                if self.upload_rate:
+                    await asyncio.sleep(len(part) / self.upload_rate)
+                if progress:
+                    await progress(current, total)
+        self.uploads += 1
+        self.uploaded_bytes += total
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self.call()
+        return self.message(chat_id, text)
+
+    def rnd_id(self):
+        return next(self.ids)
+
+class FakeMessage:
+    def __init__(self, telegram, chat_id, text=None, media=None, file_id=None, user_id=None):
+        self.telegram = telegram
+        self.id = next(telegram.ids)
+        self.chat = types.SimpleNamespace(id=chat_id)
+        self.from_user = types.SimpleNamespace(id=user_id or chat_id, username=f"user{chat_id}", first_name="Bench")
+        self.text = text
+        self.caption = text if media else None
+        self.media = media
+        self.reply_to_message = None
+        self.command = (text or "").split()
+        attachment = types.SimpleNamespace(file_id=file_id or f"{media}-{self.id}") if media else None
+        self.animation = attachment if media == "animation" else None
+        self.video = attachment if media == "video" else None
+        self.audio = attachment if media == "audio" else None
+
+    async def reply(self, text, **kwargs):
+        await self.telegram.call()
+        return self.telegram.message(self.chat.id, text)
+
+    async def reply_animation(self, animation, caption=None, **kwargs):
+        await self.telegram.call()
+        return self.telegram.message(self.chat.id, caption, media="animation", file_id="animation")
+
+    async def reply_video(self, video, caption=None, progress=None, **kwargs):
+        if os.path.exists(str(video)):
+            await self.telegram.upload(video, progress)
+        await self.telegram.call()
+        return self.telegram.message(self.chat.id, caption, media="video")
+
+    async def reply_audio(self, audio, caption=None, progress=None, **kwargs):
+        if os.path.exists(str(audio)):
+            await self.telegram.upload(audio, progress)
+        await self.telegram.call()
+        return self.telegram.message(self.chat.id, caption, media="audio")
+
+    async def edit_text(self, text, **kwargs):
+        self.telegram.edits += 1
+        await self.telegram.call()
+        self.text = text
+
+    async def edit_caption(self, caption, **kwargs):
+        self.telegram.edits += 1
+        await self.telegram.call()
+        self.caption = caption
+
+    async def edit(self, text, **kwargs):
+        await self.edit_text(text, **kwargs)
+
+    async def delete(self):
+        await self.telegram.call()
+
+# One concurrency level, in its own process
+
+def install_config(workdir, args):
+    config = types.ModuleType("config")
+    config.token = "0:bench"
+    config.api_id = 1
+    config.api_hash = "bench"
+    config.logs = None
+    config.adminUsernames = []
+    config.max_filesize = 2 * 1024 ** 3
+    config.output_folder = os.path.join(workdir, "out")
+    config.redis_enabled = False
+    config.stream_uploads = False
+    config.file_server_enabled = False
+    config.metrics_enabled = False
+    config.min_free_space = 0
+    config.ytdlp_process_mode = args.process_mode
+    if args.max_jobs:
+        config.max_concurrent_jobs = args.max_jobs
+    sys.modules["config"] = config
+
+async def monitor_lag(samples, stop):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        samples.append(time.perf_counter() - started - LAG_INTERVAL)
+
+async def run_level(args, workdir):
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    import main
+    from modules.utils import metrics
+
+    telegram = FakeTelegram(args.api_latency / 1000, args.upload_rate * 1024 ** 2 if args.upload_rate else None)
+    main.app = telegram
+
+    stages = {}
+    observe = metrics.stage_seconds.observe
+    def record(value, **labels):
+        stages.setdefault(labels.get("stage"), []).append(value)
+        observe(value, **labels)
+    metrics.stage_seconds.observe = record
+
+    lag = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(monitor_lag(lag, stop))
+
+    latencies = []
+    async def job(user, index):
+        url = f"http://{MEDIA_HOST}:{args.port}/v/{user}-{index}.mp4"
+        message = telegram.message(100000 + user, url)
+        started = time.perf_counter()
+        await main.download_video(message, url)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(job(user, index) for user in range(args.level) for index in range(args.jobs_per_user)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await lag_task
+
+    outcomes = {}
+    for (provider, outcome), count in metrics.jobs.values.items():
+        outcomes[outcome] = outcomes.get(outcome, 0) + count
+    return {
+        "users": args.level,
+        "jobs": len(latencies),
+        "outcomes": outcomes,
+        "uploads": telegram.uploads,
+        "edits": telegram.edits,
+        "api_calls": telegram.calls,
+        "elapsed": elapsed,
+        "jobs_per_min": telegram.uploads / elapsed * 60,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "stages": {stage: {"p50": percentile(v, 50), "p95": percentile(v, 95), "n": len(v)} for stage, v in stages.items()},
+        "lag_p50": percentile(lag, 50),
+        "lag_p99": percentile(lag, 99),
+        "lag_max": max(lag) if lag else None,
+        "rss_start_mb": rss_start / 1024,
+        "rss_peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+def level_process(args):
+    workdir = tempfile.mkdtemp(prefix="ytdl-bench-")
+    # data/ (user store, logs, media cache) is relative to the working directory
+    os.chdir(workdir)
+    install_config(workdir, args)
+    result = asyncio.run(run_level(args, workdir))
+    with open(args.out, "w") as f:
+        json.dump(result, f)
+
+# Driver
+
+def ms(value):
+    return f"{value * 1000:8.1f}" if value is not None else "       -"
+
+def report(result, baseline=None):
+    print(f"\n== {result['users']} users, {result['jobs']} jobs  {result['outcomes']}")
+    def line(name, key, fmt, unit=""):
+        value = result.get(key)
+        text = f"  {name:<22}{fmt(value)}{unit}"
+        old = (baseline or {}).get(key)
+        if old and value is not None:
+            text += f"   ({(value - old) / old * 100:+.1f}% vs baseline)"
+        print(text)
+    line("jobs/min", "jobs_per_min", lambda v: f"{v:8.1f}")
+    line("latency p50", "latency_p50", ms, " ms")
+    line("latency p95", "latency_p95", ms, " ms")
+    line("loop lag p50", "lag_p50", ms, " ms")
+    line("loop lag p99", "lag_p99", ms, " ms")
+    line("loop lag max", "lag_max", ms, " ms")
+    line("peak RSS", "rss_peak_mb", lambda v: f"{v:8.1f}", " MB")
+    print(f"  {'api calls / edits':<22}{result['api_calls']:8} / {result['edits']}")
+    for stage, values in sorted(result["stages"].items()):
+        print(f"  stage {stage:<16}{ms(values['p50'])} p50 {ms(values['p95'])} p95 ms  (n={values['n']})")
+
+async def wait_for_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return True
+        except OSError:
+            await asyncio.sleep(0.1)
+    return False
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 10, 50, 200], help="concurrency levels")
+    parser.add_argument("--jobs-per-user", type=int, default=1)
+    parser.add_argument("--size", type=int, default=4, help="media file size in MB")
+    parser.add_argument("--net-rate", type=float, default=None, help="download speed per connection in MB/s")
+    parser.add_argument("--upload-rate", type=float, default=None, help="fake upload speed per file in MB/s")
+    parser.add_argument("--api-latency", type=float, default=20, help="ms per fake Telegram API call")
+    parser.add_argument("--max-jobs", type=int, default=None, help="override max_concurrent_jobs")
+    parser.add_argument("--process-mode", action="store_true", help="run yt-dlp in worker processes")
+    parser.add_argument("--port", type=int, default=18780)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --save")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's and yt-dlp's output")
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--level", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve_media(args.serve, args.port, args.net_rate * 1024 ** 2 if args.net_rate else None)
+    if args.level:
+        return level_process(args)
+
+    if asyncio.run(wait_for_port(args.port, timeout=0.1)):
+        print(f"Port {args.port} is already in use, pick another with --port")
+        return
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {r["users"]: r for r in json.load(f)}
+
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        media = os.path.join(root, "media.mp4")
+        make_media(media, args.size)
+        server_args = [sys.executable, __file__, "--serve", media, "--port", str(args.port)]
+        if args.net_rate:
+            server_args += ["--net-rate", str(args.net_rate)]
+        server = subprocess.Popen(server_args)
+        try:
+            if not asyncio.run(wait_for_port(args.port)):
+                print("Media server did not start")
+                return
+            output = None if args.verbose else subprocess.DEVNULL
+            for users in args.users:
+                out = os.path.join(root, f"level-{users}.json")
+                level_args = [sys.executable, __file__, "--level", str(users), "--out", out, "--port", str(args.port),
+                              "--jobs-per-user", str(args.jobs_per_user), "--api-latency", str(args.api_latency)]
+                if args.upload_rate:
+                    level_args += ["--upload-rate", str(args.upload_rate)]
+                if args.max_jobs:
+                    level_args += ["--max-jobs", str(args.max_jobs)]
+                if args.process_mode:
+                    level_args.append("--process-mode")
+                proxy = f"http://127.0.0.1:{args.port}"
+                env = {**os.environ, "http_proxy": proxy, "HTTP_PROXY": proxy, "no_proxy": "", "NO_PROXY": ""}
+                code = subprocess.call(level_args, stdout=output, stderr=output, env=env)
+                if code != 0 or not os.path.exists(out):
+                    print(f"\n== {users} users: run failed (exit code {code}), rerun with --verbose")
+                    continue
+                with open(out) as f:
+                    result = json.load(f)
+                results.append(result)
+                report(result, baseline.get(users))
+        finally:
+            server.terminate()
+            server.wait()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved to {args.save}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import types
+import shutil
+import asyncio
+import tempfile
+import threading
+import subprocess
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+'''
+Checks that subtitles go into the video+audio merge, with a single ffmpeg run.
+
+    python bench/subtitle_merge.py
+
+Makes a video-only and an audio-only format and a WebVTT file with ffmpeg, serves
+them locally and downloads "v+a" through ytdlp_runner with a subtitle manifest,
+the way run_download does. Fails if ffmpeg ran more than once, or if the merge
+didn't take the subtitles (embed_subtitles would rewrite the whole file again).
+Needs ffmpeg on PATH, brings its own config (no config.py needed).
+'''
+
+VTT = "WEBVTT\n\n00:00:00.000 --> 00:00:01.000\nbench\n"
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+def install_config():
+    config = types.ModuleType("config")
+    config.ytdlp_process_mode = False
+    sys.modules["config"] = config
+
+def make_inputs(root):
+    ffmpeg = ["ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi"]
+    subprocess.run(ffmpeg + ["-i", "testsrc=duration=2:size=160x120:rate=10", "-c:v", "libx264", os.path.join(root, "video.mp4")], check=True)
+    subprocess.run(ffmpeg + ["-i", "sine=duration=2", "-c:a", "aac", os.path.join(root, "audio.m4a")], check=True)
+    with open(os.path.join(root, "en.vtt"), "w") as f:
+        f.write(VTT)
+
+def main():
+    if not shutil.which("ffmpeg"):
+        print("ffmpeg not found on PATH")
+        return 1
+
+    install_config()
+    from yt_dlp.postprocessor.ffmpeg import FFmpegPostProcessor
+    from modules.utils import ytdlp_runner
+    from modules.utils.subtitles import SubtitleFetch
+
+    runs = []
+    real_run_ffmpeg = FFmpegPostProcessor.real_run_ffmpeg
+    def counting_run_ffmpeg(self, *args, **kwargs):
+        runs.append(type(self).__name__)
+        return real_run_ffmpeg(self, *args, **kwargs)
+    FFmpegPostProcessor.real_run_ffmpeg = counting_run_ffmpeg
+
+    with tempfile.TemporaryDirectory() as root:
+        media = os.path.join(root, "media")
+        os.makedirs(media)
+        make_inputs(media)
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=media))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+
+        fetch = SubtitleFetch([{'url': f"{base}/en.vtt", 'lang': "English"}], os.path.join(root, "subs"))
+        os.makedirs(fetch.folder)
+        # What SubtitleFetch writes once the subtitles are on disk
+        with open(fetch.manifest_path, "w") as f:
+            json.dump([{'path': os.path.join(media, "en.vtt"), 'lang': "English"}], f)
+
+        info = {
+            'id': "bench",
+            'title': "bench",
+            'extractor': "generic",
+            'extractor_key': "Generic",
+            'webpage_url': f"{base}/",
+            'formats': [
+                {'format_id': "v", 'url': f"{base}/video.mp4", 'ext': "mp4", 'vcodec': "avc1", 'acodec': "none", 'protocol': "http"},
+                {'format_id': "a", 'url': f"{base}/audio.m4a", 'ext': "m4a", 'vcodec': "none", 'acodec': "mp4a.40.2", 'protocol': "http"},
+            ],
+        }
+        ydl_opts = {
+            'format': "v+a",
+            'outtmpl': os.path.join(root, "out.%(ext)s"),
+            'merge_output_format': "mp4",
+            'subtitle_manifest': fetch.manifest_path,
+            'quiet': True,
+            'noprogress': True,
+        }
+        asyncio.run(ytdlp_runner.extract(info['webpage_url'], ydl_opts, info=info))
+        server.shutdown()
+
+        ok = len(runs) == 1 and fetch.merged()
+        print(f"ffmpeg runs: {len(runs)} {runs}, subtitles merged: {fetch.merged()}")
+        print("OK" if ok else "FAIL")
+        return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,16 @@
+import sys
+# Has to run before the other imports to time them
+if "--profile-startup" in sys.argv:
+    from modules.utils import startup
+    startup.install()
+
 import os
 import re
 import time
+import socket
 import datetime
 import asyncio
 import uuid
-import shutil
 import json
 from urllib.parse import urlparse
 
@@ -14,29 +20,64 @@ try:
 except RuntimeError:
     asyncio.set_event_loop(asyncio.new_event_loop())
 
-import yt_dlp
 from pyrogram import Client, filters, idle
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, InputMediaAudio, InputMediaVideo
 from pyrogram.errors import MessageNotModified
 
 import config
 import modules.utils.log as logger
+from modules.utils import startup
 from modules.utils.users import UserManager
-from modules.router import route
-from modules.utils.subtitles import embed_subtitles
-from modules.utils.exceptions import DownloadCancelled
-
-# Try to import Redis client
+from modules.router import route, get_provider, resolve
+from modules.providers.general import is_playlist_link
+from modules.utils.validator import playlist_selection
+from modules.utils.subtitles import SubtitleFetch, embed_subtitles
+from modules.utils.exceptions import DownloadCancelled, QueueFull, NotEnoughSpace, SentWithoutMessage
+from modules.utils.media_cache import media_cache
+from modules.utils.inflight import inflight
+from modules.utils.scheduler import scheduler
+from modules.utils.stream_upload import StreamingUpload, can_stream
+from modules.utils.edit_scheduler import edits
+from modules.utils.progress import ProgressPublisher
+from modules.utils.partial import find_source, prepare_partial
+from modules.utils.workdir import JobDir, ensure_space, janitor, dir_size, JOBS_DIR
+from modules.utils.journal import journal
+from modules.utils import metrics
+from modules.utils.ytdlp_runner import download_error
+from modules.webserver.server import file_server, publish_file, LINK_TTL, can_live, register_live, finish_live
+from modules.connectors.job_queue import JobQueue, RemoteMessage, RemoteStatus, StatusRef, load_markup, VISIBILITY_TIMEOUT, MAX_DELIVERIES
+
+# Redis connects in the background once the bot is up, see main()
 try:
     from modules.connectors.redis_client import r as redis_client
-    REDIS_AVAILABLE = redis_client.redis_enabled
-    if REDIS_AVAILABLE:
-        print("✅ Redis client loaded successfully.")
 except Exception as e:
-    REDIS_AVAILABLE = False
     redis_client = None
     print(f"⚠️ Redis client could not be loaded: {e}")
 
+def redis_available():
+    return bool(redis_client and redis_client.ready)
+
+def cli_option(name, default=None):
+    """Value given after name on the command line, e.g. `--role worker`."""
+    args = sys.argv[1:]
+    if name in args[:-1]:
+        return args[args.index(name) + 1]
+    return default
+
+# "all" runs everything here, "frontend" and "worker" split the bot over a Redis job queue (modules/connectors/job_queue.py)
+ROLE = cli_option("--role", getattr(config, "role", "all"))
+if ROLE not in ("all", "frontend", "worker"):
+    raise SystemExit(f"Unknown role {ROLE}, use all, frontend or worker")
+WORKER_NAME = cli_option("--name", getattr(config, "worker_name", None)) or f"{socket.gethostname()}-{os.getpid()}"
+job_queue = JobQueue(redis_client)
+
+# Fills in the gauges that live elsewhere, runs on every metrics scrape
+async def collect_metrics():
+    metrics.active_jobs.set(scheduler.running)
+    metrics.queued_jobs.set(scheduler.queued)
+    metrics.floodwait_pause.set(max(0, edits.paused_until - time.time()))
+    metrics.disk_usage.set(await asyncio.to_thread(dir_size, JOBS_DIR))
+
 # Initialize the Pyrogram Client
 app = Client(
     "yt_dlp_bot",
@@ -44,14 +85,27 @@ app = Client(
     api_hash=config.api_hash,
     bot_token=config.token,
     workers=50, # Allow more concurrent update handlers
-    max_concurrent_transmissions=10 # Allow multiple files to be uploaded simultaneously
+    max_concurrent_transmissions=10, # Allow multiple files to be uploaded simultaneously
+    # Workers only send, updates go to the frontend; several can share a host without sharing a session file
+    no_updates=ROLE == "worker",
+    in_memory=ROLE == "worker"
 )
 
 user_manager = UserManager()
 
 STOP_REQUESTED = False
-MESSAGE_UPDATE_INTERVAL = 5
-last_edited = {}
+TIP_TEXT = "__Hol'up while we cook!__\n\nVisit /settings to update the quality setting."
+STATUS_ANIMATION = getattr(config, "status_animation", "https://media.tenor.com/akRQReAe9JoAAAAM/walter-white-let-him-cook.gif")
+STREAM_UPLOADS = getattr(config, "stream_uploads", True)
+PROGRESS_PUSH_INTERVAL = float(getattr(config, "progress_push_interval", 1))
+FILE_SERVER_ENABLED = getattr(config, "file_server_enabled", False)
+# Post a link to watch progressive downloads while they are still running (needs the file server)
+LIVE_STREAMS = getattr(config, "live_streams", True)
+# Larger files are sent as a file server link
+UPLOAD_LIMIT = int(getattr(config, "telegram_upload_limit", 2000 * 1024 * 1024))
+# Interrupted jobs resume after a restart (modules/utils/journal.py), workers get theirs redelivered by the queue instead
+JOURNAL_ENABLED = ROLE == "all" and getattr(config, "job_journal", True)
+status_animation_id = None
 active_downloads = {}
 download_progress = {}
 youtube_selection_cache = {}
@@ -73,21 +127,69 @@ def format_time(seconds):
     if not seconds: return "0s"
     return str(datetime.timedelta(seconds=int(seconds)))
 
+def render_progress(prog):
+    title = prog.get('title', 'Video')
+    ext = prog.get('ext', 'mp4')
+
+    if prog.get('status') == 'merging':
+        return f"🔄 Merging video and audio: `{title}.{ext}`"
+    if prog.get('status') == 'postprocessing':
+        return f"⚙️ Processing: `{title}.{ext}`"
+    total = prog.get('total', 0)
+    downloaded = prog.get('downloaded', 0)
+    speed = prog.get('speed', 0)
+    eta = prog.get('eta', 0)
+
+    if total:
+        percentage = downloaded * 100 / total
+        progress_str = f"{percentage:.1f}%"
+        total_str = format_bytes(total)
+    else:
+        progress_str = "N/A"
+        total_str = "N/A"
+
+    downloaded_str = format_bytes(downloaded)
+    speed_str = f"{format_bytes(speed)}/s" if speed else "N/A"
+    eta_str = format_time(eta) if eta else "N/A"
+
+    return (
+        f"Downloading: `{title}.{ext}`\n\n"
+        f"💾 Size: {downloaded_str} / {total_str}\n"
+        f"📊 Progress: {progress_str}\n"
+        f"🚀 Speed: {speed_str}\n"
+        f"⏳ ETA: {eta_str}"
+    )
+
+async def send_status_message(message: Message, text, reply_markup=None):
+    global status_animation_id
+    if not STATUS_ANIMATION:
+        return await message.reply(text, reply_markup=reply_markup)
+    if status_animation_id:
+        try:
+            return await message.reply_animation(status_animation_id, caption=text, reply_markup=reply_markup)
+        except Exception:
+            status_animation_id = None
+    # First send goes by URL, after that Telegram's file_id is reused
+    msg = await message.reply_animation(STATUS_ANIMATION, caption=text, reply_markup=reply_markup)
+    if msg.animation:
+        status_animation_id = msg.animation.file_id
+    return msg
+
 @app.on_message(filters.command(['start', 'help']))
 async def start_command(client: Client, message: Message):
-    print(f"Start command received. Args: {message.command}, Redis Available: {REDIS_AVAILABLE}")
+    print(f"Start command received. Args: {message.command}, Redis Available: {redis_available()}")
     # Check for arguments (Redis short code)
-    if len(message.command) > 1 and REDIS_AVAILABLE:
+    if len(message.command) > 1 and redis_available():
         token = message.command[1]
         key = f"dl:{token}"
         # print(f"Checking Redis for key: {key}")
 
         try:
-            raw = redis_client.get(key)
+            # One-time use, GETDEL makes sure only one click redeems it
+            raw = await redis_client.getdel(key)
             print(f"Redis result: {raw}")
             if raw:
                 data = json.loads(raw)
-                redis_client.delete(key) # One-time use
 
                 url = data.get('url')
                 title = data.get('title')
@@ -118,11 +220,149 @@ async def get_id(client: Client, message: Message):
 
 # show_youtube_selection moved to modules/providers/general/general_provider.py
 
-async def download_video(message: Message, url, audio=False, format_id="bestvideo+bestaudio/best", custom_title=None, subtitles=None):
-        # Use UUID for unique filenames to prevent collisions between users
-        video_id = str(uuid.uuid4())
-        active_downloads[video_id] = {'action': None, 'last_info': None}
+def get_flight_key(message: Message, link, audio, format_id, subtitles, playlist=None):
+    # Subtitled jobs produce a different file, never share them, invalid links fail right away
+    if subtitles or link is None:
+        return None
+    # A playlist isn't one file to share, its entries hit the media cache instead
+    if playlist is not None or is_playlist_link(link):
+        return None
+    pref = ""
+    if format_id == "bestvideo+bestaudio/best" and not audio:
+        # The provider resolves the default format from the user's quality preference
+        user_id = message.from_user.id if message.from_user else 0
+        pref = user_manager.get_quality(user_id)
+    mode = "audio" if audio else "video"
+    return f"{link.key}|{mode}|{format_id}|{pref}"
+
+def describe_job(message: Message, job_id, url, audio, format_id, custom_title, subtitles, use_cache, playlist, status):
+    """The job as plain data, enough to run it away from its Message: on a worker or after a restart."""
+    user = message.from_user
+    return {
+        "id": job_id,
+        "url": url,
+        "audio": audio,
+        "format_id": format_id,
+        "custom_title": custom_title,
+        "subtitles": subtitles,
+        "use_cache": use_cache,
+        "playlist": playlist,
+        "chat_id": message.chat.id,
+        "chat_title": message.chat.title,
+        "message_id": message.id,
+        "text": message.text or message.caption,
+        "user_id": user.id if user else None,
+        "username": user.username if user else None,
+        "first_name": user.first_name if user else None,
+        "status_id": status.id,
+        "status_media": bool(status.media),
+    }
+
+async def download_video(message: Message, url, audio=False, format_id="bestvideo+bestaudio/best", custom_title=None, subtitles=None, use_cache=True, playlist=None, video_id=None, status=None):
+    """
+    Download url for message and send the result. Jobs from the queue (--role worker) and
+    jobs resumed after a restart bring their id as video_id and their existing status message as status.
+    Returns True if the shutdown interrupted the job before it was done.
+    """
+    if ROLE == "frontend":
+        await enqueue_download(message, url, audio, format_id, custom_title, subtitles, use_cache, playlist)
+        return
+
+    # Parsed once here, route() and the provider reuse it
+    link = resolve(url)
+    key = get_flight_key(message, link, audio, format_id, subtitles, playlist)
+    provider = get_provider(link)
+    flight = inflight.get(key)
+    if flight:
+        metrics.jobs.inc(provider=provider, outcome="joined")
+        await journal.remove(video_id)
+        if status:
+            await status.delete()
+        await follow_download(message, flight, url, audio, format_id, custom_title, subtitles)
+        return
+
+    user_id = message.from_user.id if message.from_user else message.chat.id
+    try:
+        ensure_space()
+        ticket = scheduler.submit(user_id, provider)
+    except (QueueFull, NotEnoughSpace) as e:
+        metrics.jobs.inc(provider=provider, outcome="rejected")
+        await journal.remove(video_id)
+        if status:
+            await edits.edit_now(status, f"⏳ {e}")
+        else:
+            await message.reply(f"⏳ {e}")
+        return
+
+    flight = inflight.start(key)
+    # run_download sets stages.outcome on the paths that don't end in an error
+    stages = metrics.StageTimer(provider)
+    # Use UUID for unique filenames to prevent collisions between users
+    video_id = video_id or str(uuid.uuid4())
+    interrupted = False
+    try:
+        interrupted = await run_download(message, url, audio, format_id, custom_title, subtitles, use_cache, flight, ticket, stages, link, playlist, video_id, status)
+    finally:
+        stages.close()
+        scheduler.release(ticket)
+        inflight.finish(flight)
+        # A job the shutdown interrupted stays in the journal and resumes after the restart
+        if not interrupted:
+            await journal.remove(video_id)
+    return interrupted
+
+async def follow_download(message: Message, flight, url, audio, format_id, custom_title, subtitles):
+    status = await message.reply("🔗 This link is already being downloaded for another request, joining it...")
+    flight.watchers.append(status)
+    try:
+        shared, error = await flight.wait()
+    finally:
+        flight.watchers.remove(status)
+        edits.forget(status)
+
+    if error:
+        await status.edit(error)
+        return
+    if not shared:
+        # Leader was cancelled or had nothing shareable, run our own job
+        try:
+            await status.delete()
+        except Exception:
+            pass
+        await download_video(message, url, audio, format_id, custom_title, subtitles)
+        return
+
+    try:
+        if shared.get('link'):
+            await message.reply(shared['text'], disable_web_page_preview=True, quote=True)
+        elif shared['type'] == "audio":
+            await message.reply_audio(
+                audio=shared['file_id'],
+                caption=shared['caption'],
+                title=shared['title'],
+                performer=shared.get('performer'),
+                duration=shared.get('duration', 0),
+                quote=True
+            )
+        else:
+            await message.reply_video(
+                video=shared['file_id'],
+                caption=shared['caption'],
+                supports_streaming=True,
+                quote=True
+            )
+        await status.delete()
+        await logger.log(app, message, f"Sent from shared download: {shared['title']}", level="SUCCESS")
+    except Exception as e:
+        print(f"Shared send error: {e}")
+        await status.edit(f"Couldn't send file. Error: {e}")
+
+async def run_download(message: Message, url, audio, format_id, custom_title, subtitles, use_cache, flight, ticket, stages, link, playlist=None, video_id=None, status=None):
+        """Returns True when the shutdown interrupted the download, its files stay for the restart."""
+        active_downloads[video_id] = {'action': None, 'last_info': None, 'ticket': ticket}
         download_progress[video_id] = {'status': 'starting', 'downloaded': 0, 'total': 0, 'speed': 0, 'eta': 0, 'title': 'Video', 'ext': 'mp4'}
+        # Everything this job writes goes into its own directory
+        job_dir = JobDir(video_id).create()
 
         await logger.log(app, message, f"Starting download: {url} (ID: {video_id})", level="DOWNLOAD")
 
@@ -131,88 +371,142 @@ async def download_video(message: Message, url, audio=False, format_id="bestvide
         send_btn = InlineKeyboardButton("📤 Send Partial", callback_data=f"cancel|send|{video_id}")
         keyboard = InlineKeyboardMarkup([[cancel_btn, send_btn]])
 
-        # Send GIF
-        gif_msg = await message.reply_animation("https://media.tenor.com/akRQReAe9JoAAAAM/walter-white-let-him-cook.gif")
+        # Status message: the animation with the tip as its caption, progress edits go through the edit scheduler
+        msg = status or await send_status_message(message, TIP_TEXT)
+        if journal.is_open():
+            await journal.add(describe_job(message, video_id, url, audio, format_id, custom_title, subtitles, use_cache, playlist, msg))
+        journal_part = None
 
-        # Send Tip/Status Message
-        tip_text = f"__Hol'up while we cook!__\n\nVisit /settings to update the quality setting."
+        loop = asyncio.get_running_loop()
 
-        msg = await message.reply(tip_text)
+        # Runs on the loop whenever the hook publishes something
+        def on_progress(status, fields):
+            prog = download_progress.get(video_id)
+            if not prog or prog['status'] == 'finished':
+                return
+            prog.update(fields, status=status)
+            stages.enter({'merging': 'merge', 'postprocessing': 'postprocess'}.get(status, 'download'))
+            if 'downloaded' in fields:
+                downloaded.update(fields['downloaded'] or 0)
 
-        loop = asyncio.get_running_loop()
-        gif_deleted = False
+            # Also update active_downloads for partial send logic
+            if 'info_dict' in fields and video_id in active_downloads:
+                active_downloads[video_id]['last_info'] = fields['info_dict']
 
-        # Start progress update task
-        async def update_progress_message():
-            last_update_time = 0
-            while video_id in active_downloads and not STOP_REQUESTED:
-                try:
-                    # Check if cancellation is requested
-                    if active_downloads.get(video_id, {}).get('action'):
-                        break
-
-                    now = time.time()
-                    if now - last_update_time < MESSAGE_UPDATE_INTERVAL:
-                        await asyncio.sleep(1)
-                        continue
-
-                    prog = download_progress.get(video_id)
-                    if not prog or prog['status'] != 'downloading':
-                        await asyncio.sleep(1)
-                        continue
-
-                    # Delete GIF if needed
-                    nonlocal gif_deleted
-                    if not gif_deleted:
-                        try:
-                            await gif_msg.delete()
-                            gif_deleted = True
-                        except Exception:
-                            pass
-
-                    last_update_time = now
-
-                    title = prog.get('title', 'Video')
-                    ext = prog.get('ext', 'mp4')
-                    total = prog.get('total', 0)
-                    downloaded = prog.get('downloaded', 0)
-                    speed = prog.get('speed', 0)
-                    eta = prog.get('eta', 0)
-
-                    if total:
-                        percentage = downloaded * 100 / total
-                        progress_str = f"{percentage:.1f}%"
-                        total_str = format_bytes(total)
-                    else:
-                        progress_str = "N/A"
-                        total_str = "N/A"
-
-                    downloaded_str = format_bytes(downloaded)
-                    speed_str = f"{format_bytes(speed)}/s" if speed else "N/A"
-                    eta_str = format_time(eta) if eta else "N/A"
-
-                    text = (
-                        f"Downloading: `{title}.{ext}`\n\n"
-                        f"💾 Size: {downloaded_str} / {total_str}\n"
-                        f"📊 Progress: {progress_str}\n"
-                        f"🚀 Speed: {speed_str}\n"
-                        f"⏳ ETA: {eta_str}"
-                    )
+            if active_downloads.get(video_id, {}).get('action'):
+                return
+            text = render_progress(prog)
+            # Status changes show up right away, byte counts follow the usual spacing
+            edits.update(msg, text, keyboard, urgent=status != 'downloading')
+            flight.broadcast(text)
 
-                    try:
-                        await msg.edit(text, reply_markup=keyboard)
-                    except Exception:
-                        pass
+        publisher = ProgressPublisher(loop, on_progress, PROGRESS_PUSH_INTERVAL)
+        downloaded = metrics.TransferCounter("down")
 
-                except Exception as e:
-                    print(f"Error in update loop: {e}")
+        def stop_progress():
+            # Late updates must not overwrite the upload status
+            if video_id in download_progress:
+                download_progress[video_id]['status'] = 'finished'
+            stages.enter(None)
+            # Open live streams send what's left and end
+            finish_live(video_id)
 
-                await asyncio.sleep(1)
+        # Shown while waiting for a free slot in the scheduler
+        def show_queue_position(position, eta):
+            text = f"⏳ Queued, position **{position}**\nEstimated start: ~{format_time(eta)}"
+
+            edits.update(msg, text, InlineKeyboardMarkup([[cancel_btn]]))
+
+        # Upload to Telegram while yt-dlp is still writing, for single-file progressive downloads
+        streamer = None
+        stream_requested = False
 
-        progress_task = asyncio.create_task(update_progress_message())
+        def start_streaming(d):
+            nonlocal streamer
+            if video_id not in active_downloads or active_downloads[video_id].get('action'):
+                return
+            try:
+                streamer = StreamingUpload(app, d['tmpfilename'], d['total_bytes'])
+                streamer.start()
+            except Exception as e:
+                print(f"Could not start streaming upload: {e}")
+                streamer = None
+
+        def stop_streaming():
+            if streamer:
+                streamer.abort()
+
+        # Link to watch the file while yt-dlp is still writing it
+        live_requested = False
+        live_msg = None
+        job_ended = False
+
+        def start_live(d):
+            if download_progress.get(video_id, {}).get('status') in (None, 'finished') or active_downloads.get(video_id, {}).get('action'):
+                return
+            try:
+                link = register_live(video_id, d['tmpfilename'], d.get('total_bytes'), d['info_dict'].get('ext', 'mp4'))
+            except OSError as e:
+                print(f"Could not start live stream: {e}")
+                return
+            asyncio.create_task(post_live_link(link))
+
+        async def post_live_link(link):
+            nonlocal live_msg
+            try:
+                sent = await message.reply(
+                    f"▶️ [Watch while it downloads]({link})\n\n__The video is sent here as usual once it's done.__",
+                    disable_web_page_preview=True,
+                    quote=True
+                )
+            except Exception as e:
+                print(f"Could not send live link: {e}")
+                return
+            if job_ended:
+                await sent.delete()
+            else:
+                live_msg = sent
+
+        # Subtitles download alongside the video and get muxed in during the merge
+        sub_fetch = None
+        if subtitles:
+            sub_fetch = SubtitleFetch(subtitles, job_dir.path_for("subs"))
+            sub_fetch.start()
+
+        # Jobs that end without an upload drop their files right away
+        def discard_job():
+            nonlocal job_ended, live_msg
+            job_ended = True
+            if live_msg:
+                asyncio.create_task(live_msg.delete())
+                live_msg = None
+            if sub_fetch:
+                sub_fetch.cleanup()
+            job_dir.cleanup()
+
+        # A shutdown keeps the job directory, yt-dlp continues the .part file (or the fragments) after the restart
+        async def interrupt_job():
+            nonlocal job_ended
+            job_ended = True
+            stop_progress()
+            stop_streaming()
+            if sub_fetch:
+                sub_fetch.cleanup()
+            active_downloads.pop(video_id, None)
+            download_progress.pop(video_id, None)
+            await edits.edit_now(msg, "⏸ The bot is restarting, this download picks up where it left off once it's back.")
+            edits.forget(msg)
+            await logger.log(app, message, f"Download interrupted by shutdown: {video_id}", level="WARNING")
+            return True
 
         # Progress hook for yt-dlp (runs in a thread)
         def progress(d):
+            # The journal learns every file yt-dlp starts, also on the update a shutdown stops
+            nonlocal journal_part
+            if d.get('tmpfilename') and d['tmpfilename'] != journal_part:
+                journal_part = d['tmpfilename']
+                loop.call_soon_threadsafe(asyncio.create_task, journal.set_part(video_id, journal_part))
+
             if STOP_REQUESTED:
                 raise Exception("Bot shutting down")
 
@@ -220,51 +514,132 @@ async def download_video(message: Message, url, audio=False, format_id="bestvide
             if active_downloads.get(video_id, {}).get('action'):
                 action = active_downloads[video_id]['action']
                 if action == 'send':
-                    # Try to preserve the file
-                    try:
-                        current_file = d.get('filename')
-                        # Sometimes the file on disk has a .part extension
-                        if current_file and not os.path.exists(current_file):
-                            if os.path.exists(current_file + ".part"):
-                                current_file += ".part"
-
-                        if current_file and os.path.exists(current_file):
-                            # Copy to a safe partial name
-                            partial_path = f'{config.output_folder}/{video_id}_partial.mp4'
-                            shutil.copy2(current_file, partial_path)
-                        else:
-                            print(f"Could not find file to copy: {d.get('filename')}")
-                    except Exception as e:
-                        print(f"Failed to copy partial file: {e}")
+                    # Only remember the file, it's snapshotted and remuxed off this thread
+                    active_downloads[video_id]['partial_source'] = find_source(d)
                 raise DownloadCancelled(action)
 
-            if d['status'] == 'downloading':
+            # Postprocessor hooks share this function
+            if 'postprocessor' in d:
+                if d['status'] == 'started':
+                    publisher.publish('merging' if d['postprocessor'] == 'Merger' else 'postprocessing')
+                return
+
+            # Runs for every chunk, only build an update when one is due
+            if d['status'] == 'downloading' and publisher.due('downloading'):
                 try:
-                    # Update shared state
-                    if video_id in download_progress:
-                        download_progress[video_id].update({
-                            'status': 'downloading',
-                            'title': d.get('info_dict', {}).get('title', 'Video'),
-                            'ext': d.get('info_dict', {}).get('ext', 'mp4'),
-                            'total': d.get('total_bytes') or d.get('total_bytes_estimate'),
-                            'downloaded': d.get('downloaded_bytes', 0),
-                            'speed': d.get('speed'),
-                            'eta': d.get('eta'),
-                            'info_dict': d.get('info_dict') # Store for partial send
-                        })
-
-                        # Also update active_downloads for partial send logic
-                        if active_downloads.get(video_id):
-                            active_downloads[video_id]['last_info'] = d.get('info_dict')
+                    info_dict = d.get('info_dict') or {}
+                    publisher.push('downloading', {
+                        'title': info_dict.get('title', 'Video'),
+                        'ext': info_dict.get('ext', 'mp4'),
+                        'total': d.get('total_bytes') or d.get('total_bytes_estimate'),
+                        'downloaded': d.get('downloaded_bytes', 0),
+                        'speed': d.get('speed'),
+                        'eta': d.get('eta'),
+                        'info_dict': info_dict # Store for partial send
+                    })
+
+                    nonlocal stream_requested
+                    if STREAM_UPLOADS and not stream_requested and not audio and not subtitles and can_stream(d):
+                        stream_requested = True
+                        loop.call_soon_threadsafe(start_streaming, d)
+
+                    nonlocal live_requested
+                    if FILE_SERVER_ENABLED and LIVE_STREAMS and not live_requested and not audio and can_live(d):
+                        live_requested = True
+                        loop.call_soon_threadsafe(start_live, d)
 
                 except Exception as e:
                     print(f"Error in progress hook: {e}")
 
+        # Albums and playlists: every track is sent as soon as it's downloaded
+        async def send_track(path, track):
+            title = track.get('name') or os.path.splitext(os.path.basename(path))[0]
+            caption = (
+                f"🎵 **{title}**\n\n"
+                f"💾 **Size:** {format_bytes(os.path.getsize(path))}\n\n"
+                f"🔗 [Original Link]({track.get('url', url)})"
+            )
+            await message.reply_audio(
+                audio=path,
+                caption=caption,
+                title=title,
+                performer=", ".join(track.get('artists') or []) or 'Unknown',
+                duration=int(track.get('duration') or 0),
+                quote=True
+            )
+
+        # Playlists: finished entries arrive in playlist order, up to 10 at a time, and go out as one album
+        async def send_batch(items):
+            media = []
+            oversized = []
+            for item in items:
+                cached = item.get('cached')
+                source = cached['file_id'] if cached else item['filepath']
+                size = cached.get('size', 0) if cached else os.path.getsize(item['filepath'])
+                item['size'] = size
+                title = item.get('title') or 'Untitled'
+                if not cached and size > UPLOAD_LIMIT:
+                    oversized.append(item)
+                    continue
+                caption = (
+                    f"{'🎵' if item['type'] == 'audio' else '📹'} **{title}**\n\n"
+                    f"💾 **Size:** {format_bytes(size)}\n"
+                    f"🔗 [Original Link]({item.get('original_url')})"
+                )
+                duration = int(item.get('duration') or 0)
+                if item['type'] == "audio":
+                    media.append(InputMediaAudio(source, caption=caption, duration=duration, title=title))
+                else:
+                    media.append(InputMediaVideo(source, caption=caption, duration=duration, supports_streaming=True))
+
+            if oversized:
+                lines = []
+                for item in oversized:
+                    if FILE_SERVER_ENABLED:
+                        file_link = await asyncio.to_thread(publish_file, item["filepath"])
+                        lines.append(f"📦 [{item.get('title') or 'Untitled'}]({file_link}) ({format_bytes(item['size'])})")
+                    else:
+                        lines.append(f"⚠️ {item.get('title') or 'Untitled'} is {format_bytes(item['size'])}, too big for Telegram.")
+                if FILE_SERVER_ENABLED:
+                    lines.append(f"\n⏳ The links work for {format_time(LINK_TTL)}.")
+                await message.reply("\n".join(lines), disable_web_page_preview=True, quote=True)
+                items = [item for item in items if item not in oversized]
+            if not media:
+                return
+
+            try:
+                if len(media) == 1:
+                    # An album needs at least two items
+                    if items[0]['type'] == "audio":
+                        sent = [await message.reply_audio(media[0].media, caption=media[0].caption, duration=media[0].duration, title=media[0].title, quote=True)]
+                    else:
+                        sent = [await message.reply_video(media[0].media, caption=media[0].caption, duration=media[0].duration, supports_streaming=True, quote=True)]
+                else:
+                    sent = await app.send_media_group(message.chat.id, media, reply_to_message_id=message.id)
+            except Exception:
+                # A stale file_id fails the whole album, the next request downloads those again
+                for item in items:
+                    if item.get('cached'):
+                        media_cache.delete(item.get('cache_key'))
+                raise
+
+            for item, sent_message in zip(items, sent):
+                sent_media = sent_message.audio or sent_message.video
+                if sent_media and item.get('cache_key') and not item.get('cached'):
+                    media_cache.set(item['cache_key'], sent_media.file_id, item['type'], size=item['size'], ext=item.get('ext'))
+
         filepath = None
         info = None
+        result = {}
+        is_partial = False
 
         try:
             print(f"Received message: {message.text}")
+            if not ticket.granted:
+                stages.enter('queue')
+                await scheduler.wait(ticket, on_position=show_queue_position)
+                stages.enter(None)
+
             # Call router
             result = await route(
                 url=url,
@@ -276,19 +651,27 @@ async def download_video(message: Message, url, audio=False, format_id="bestvide
                 audio=audio,
                 format_id=format_id,
                 custom_title=custom_title,
-                youtube_selection_cache=youtube_selection_cache
+                youtube_selection_cache=youtube_selection_cache,
+                # Subtitles get muxed into the file, so a cached upload would lack them
+                use_cache=use_cache and not subtitles,
+                on_file=send_track,
+                on_batch=send_batch,
+                playlist=playlist,
+                work_dir=job_dir.path,
+                subtitle_manifest=sub_fetch.manifest_path if sub_fetch else None,
+                link=link
             )
 
             if result.get("status") == "interaction_required":
-                # Stop progress task as we are waiting for user interaction
-                if not progress_task.done():
-                    progress_task.cancel()
+                stages.outcome = "interaction"
                 # Clean up active download
                 if video_id in active_downloads:
                     del active_downloads[video_id]
                 if video_id in download_progress:
                     del download_progress[video_id]
+                discard_job()
                 # Delete the "Initializing" message since the provider sent a new one or edited it
+                edits.forget(msg)
                 try:
                     await msg.delete()
                 except:
@@ -298,110 +681,127 @@ async def download_video(message: Message, url, audio=False, format_id="bestvide
             if result.get("status") == "error":
                 raise Exception(result.get("message"))
 
+            if result.get("status") == "completed":
+                # The provider already sent everything through send_track or send_batch
+                stop_progress()
+                text = f"✅ Sent {result.get('sent', 0)} {result.get('unit', 'tracks')} from `{result.get('title')}`."
+                if result.get('failed'):
+                    text += f"\n⚠️ {result['failed']} could not be downloaded."
+                if result.get('more'):
+                    text += f"\nℹ️ Only the first {result['limit']} were downloaded, get the next ones with `/playlist {url} {result['more']}`."
+                await edits.edit_now(msg, text)
+                edits.forget(msg)
+                stages.outcome = "success"
+                active_downloads.pop(video_id, None)
+                download_progress.pop(video_id, None)
+                discard_job()
+                await logger.log(app, message, f"Sent {result.get('sent', 0)} {result.get('unit', 'tracks')}: {result.get('title')}", level="SUCCESS")
+                return
+
+            # Spotify always returns audio, send it as such
+            if result.get('type') == "audio":
+                audio = True
+
             if custom_title:
                 result['title'] = custom_title
 
-            # Stop progress task
-            if not progress_task.done():
-                progress_task.cancel()
-                try:
-                    await progress_task
-                except asyncio.CancelledError:
-                    pass
+            stop_progress()
 
             # Find the downloaded file
 
-            if result.get('isUrl') == True:
+            if result.get('cached'):
+                # Already uploaded before, resend by file_id
+                filepath = result['cached']['file_id']
+                result['isUrl'] = True
+            elif result.get('isUrl') == True:
                 filepath = result.get('url')
             elif result.get("filepath") is not None:
                 filepath = result.get("filepath")
             else:
                 # Fallback: look for file starting with video_id
-                for file in os.listdir(config.output_folder):
-                    if file.startswith(video_id):
-                        filepath = os.path.join(config.output_folder, file)
-                        break
+                filepath = job_dir.find(video_id)
 
         except DownloadCancelled as e:
-            # Stop progress task
-            if not progress_task.done():
-                progress_task.cancel()
-                try:
-                    await progress_task
-                except asyncio.CancelledError:
-                    pass
+            stop_progress()
+
+            stop_streaming()
 
             if e.action == 'del':
-                await msg.edit("❌ Download cancelled.")
+                stages.outcome = "cancelled"
+                discard_job()
+                await edits.edit_now(msg, "❌ Download cancelled.")
                 await logger.log(app, message, f"Download cancelled by user: {video_id}", level="WARNING")
                 return
             elif e.action == 'send':
-                await msg.edit("📤 Processing partial download...")
+                await edits.edit_now(msg, "📤 Processing partial download...")
                 await logger.log(app, message, f"Partial download requested: {video_id}", level="INFO")
-                filepath = f'{config.output_folder}/{video_id}_partial.mp4'
+                filepath = await prepare_partial(active_downloads.get(video_id, {}).get('partial_source'), job_dir.path, video_id)
+                is_partial = True
                 info = active_downloads.get(video_id, {}).get('last_info', {})
                 if not info:
                     info = {'title': 'Partial Download', 'ext': 'mp4'}
 
-        except yt_dlp.utils.DownloadError as e:
-            # Stop progress task
-            if not progress_task.done():
-                progress_task.cancel()
-                try:
-                    await progress_task
-                except asyncio.CancelledError:
-                    pass
+        except download_error() as e:
+            if STOP_REQUESTED:
+                return await interrupt_job()
+            stop_progress()
 
-            await msg.edit('Invalid URL or download error.')
+            stop_streaming()
+            discard_job()
+            flight.error = 'Invalid URL or download error.'
+            await edits.edit_now(msg, 'Invalid URL or download error.')
             await logger.log(app, message, f"Download error: {e}", level="ERROR")
             return
         except Exception as e:
-            # Stop progress task
-            if not progress_task.done():
-                progress_task.cancel()
-                try:
-                    await progress_task
-                except asyncio.CancelledError:
-                    pass
+            if STOP_REQUESTED:
+                return await interrupt_job()
+            stop_progress()
 
+            stop_streaming()
+            discard_job()
             print(f"General error: {e}")
-            await msg.edit(f"Error: {e}")
+            # Followers would only run into the same error
+            flight.error = f"Error: {e}"
+            await edits.edit_now(msg, f"Error: {e}")
             await logger.log(app, message, f"General error: {e}", level="ERROR")
             return
 
         if not filepath or (not result.get('isUrl') and not os.path.exists(filepath)):
-            await msg.edit("Could not find downloaded file.")
+            stop_streaming()
+            discard_job()
+            flight.error = "Could not find downloaded file."
+            await edits.edit_now(msg, "Could not find downloaded file.")
             await logger.log(app, message, f"File not found after download: {video_id}", level="ERROR")
             return
 
-        # Embed subtitles if provided and file exists locally
-        if subtitles and filepath and os.path.exists(filepath) and not result.get('isUrl'):
-             await msg.edit("Embedding subtitles...")
-             filepath = await embed_subtitles(filepath, subtitles)
+        # Embed subtitles if they didn't go in with the merge and the file exists locally
+        if sub_fetch and not sub_fetch.merged() and filepath and os.path.exists(filepath) and not result.get('isUrl'):
+             await edits.edit_now(msg, "Embedding subtitles...")
+             stages.enter('subtitles')
+             filepath = await embed_subtitles(filepath, sub_fetch)
+             stages.enter(None)
 
-        await msg.edit('Sending file to Telegram...')
+        if not result.get('isUrl'):
+            job_dir.add(filepath)
+
+        await edits.edit_now(msg, 'Sending file to Telegram...')
+        flight.broadcast('Sending file to Telegram...')
         await logger.log(app, message, f"Download complete, uploading: {filepath}", level="INFO")
 
         # Upload progress
+        uploaded = metrics.TransferCounter("up")
         async def upload_progress(current, total):
-            try:
-                now = time.time()
-                key = f"{message.chat.id}-{msg.id}-upload"
-
-                if key in last_edited:
-                    if now - last_edited[key] < MESSAGE_UPDATE_INTERVAL:
-                        return
-
-                last_edited[key] = now
-
-                perc = round(current * 100 / total)
-                await msg.edit(f"Uploading to Telegram...\n\n{perc}%")
-            except Exception:
-                pass        # Generate caption
+            uploaded.update(current)
+            perc = round(current * 100 / total)
+            edits.update(msg, f"Uploading to Telegram...\n\n{perc}%")        # Generate caption
         title = result.get('title', 'Unknown')
         original_url = result.get('webpage_url', url)
 
-        if result.get('isUrl'):
+        if result.get('cached'):
+            file_size = result['cached'].get('size', 0)
+            size_str = format_bytes(file_size) if file_size else "Unknown"
+            result['ext'] = result['cached'].get('ext', result.get('ext'))
+        elif result.get('isUrl'):
             file_size = 0 # Unknown size for URL
             size_str = "Unknown"
         else:
@@ -421,7 +821,7 @@ async def download_video(message: Message, url, audio=False, format_id="bestvide
                     ext = os.path.splitext(filepath)[1]
                     # Ensure extension matches the actual file type if possible, or trust the file
                     new_filename = f"{safe_title}{ext}"
-                    new_filepath = os.path.join(config.output_folder, new_filename)
+                    new_filepath = job_dir.path_for(new_filename)
                     if os.path.exists(new_filepath):
                         os.remove(new_filepath)
                     os.rename(filepath, new_filepath)
@@ -448,11 +848,28 @@ async def download_video(message: Message, url, audio=False, format_id="bestvide
                 f"🔗 [Original Link]({original_url})"
             )
 
+        stages.enter('upload')
         try:
+            # Too big for Telegram, hand out a signed link from the file server instead
+            if FILE_SERVER_ENABLED and not result.get('isUrl') and file_size > UPLOAD_LIMIT:
+                link = await asyncio.to_thread(publish_file, filepath)
+                text = (
+                    f"📦 **{title}.{result.get('ext', 'mp4')}** is {size_str}, too big for Telegram.\n\n"
+                    f"🔗 [Download]({link})\n"
+                    f"⏳ The link works for {format_time(LINK_TTL)}."
+                )
+                await message.reply(text, disable_web_page_preview=True, quote=True)
+                await msg.delete()
+                # Followers get the same link instead of downloading the file again
+                flight.result = {'link': link, 'text': text, 'title': title}
+                stages.outcome = "link"
+                await logger.log(app, message, f"Sent as link: {title} ({size_str})", level="SUCCESS")
+                return
+
             if audio:
                 performer = result.get('artist') or result.get('uploader') or result.get('creator') or 'Unknown'
                 duration = int(result.get('duration') or 0)
-                await message.reply_audio(
+                sent = await message.reply_audio(
                     audio=filepath,
                     caption=caption,
                     progress=upload_progress,
@@ -466,63 +883,220 @@ async def download_video(message: Message, url, audio=False, format_id="bestvide
                 height = int(result.get('height') or 0)
                 duration = int(result.get('duration') or 0)
 
-                await message.reply_video(
-                    video=filepath,
-                    caption=caption,
-                    width=width,
-                    height=height,
-                    duration=duration,
-                    progress=upload_progress,
-                    supports_streaming=True,
-                    quote=True
-                )
+                sent = None
+                streamed = False
+                if streamer:
+                    streamer.finish()
+                    if streamer.matches(filepath):
+                        try:
+                            sent = await streamer.send_video(message, caption, os.path.basename(filepath), width, height, duration)
+                        except SentWithoutMessage as e:
+                            # The video is in the chat, only its file_id is unknown
+                            print(f"Streaming upload: {e}")
+                            streamed = True
+                        except Exception as e:
+                            print(f"Streaming upload failed, uploading normally: {e}")
+                    else:
+                        # A fixup rewrote the file after download, the streamed parts are stale
+                        streamer.abort()
+
+                if not sent and not streamed:
+                    sent = await message.reply_video(
+                        video=filepath,
+                        caption=caption,
+                        width=width,
+                        height=height,
+                        duration=duration,
+                        progress=upload_progress,
+                        supports_streaming=True,
+                        quote=True
+                    )
 
             await msg.delete()
-            await logger.log(app, message, f"Upload completed successfully: {title}", level="SUCCESS")
+            stages.outcome = "partial" if is_partial else "cached" if result.get('cached') else "success"
+
+            # Hand the uploaded file to requests that attached to this one
+            media = (sent.audio if audio else sent.video) if sent else None
+            if media and not is_partial:
+                flight.result = {
+                    'file_id': media.file_id,
+                    'type': "audio" if audio else "video",
+                    'caption': caption,
+                    'title': title,
+                    'performer': performer if audio else None,
+                    'duration': duration,
+                }
+
+            if result.get('cached'):
+                await logger.log(app, message, f"Sent from cache: {title}", level="SUCCESS")
+            else:
+                # Remember the file_id so the next request for this media skips download and upload
+                if media and result.get('cache_key') and not subtitles and not is_partial:
+                    media_cache.set(result['cache_key'], media.file_id, "audio" if audio else "video", size=file_size, ext=result.get('ext'))
+                await logger.log(app, message, f"Upload completed successfully: {title}", level="SUCCESS")
         except Exception as e:
+            if result.get('cached'):
+                # Stale file_id, drop it and fall back to a fresh download
+                print(f"Cached send failed, re-downloading: {e}")
+                media_cache.delete(result.get('cache_key'))
+                try:
+                    await msg.delete()
+                except Exception:
+                    pass
+                asyncio.create_task(download_video(message, url, audio, format_id, custom_title, subtitles, use_cache=False))
+                return
             print(f"Upload error: {e}")
-            await msg.edit(f"Couldn't send file. Error: {e}")
+            flight.error = f"Couldn't send file. Error: {e}"
+            await edits.edit_now(msg, f"Couldn't send file. Error: {e}")
             await logger.log(app, message, f"Upload failed: {e}", level="ERROR")
         finally:
             # Cleanup
-            if not gif_deleted:
-                try:
-                    await gif_msg.delete()
-                except Exception:
-                    pass
+            stop_streaming()
+            edits.forget(msg)
 
             if video_id in active_downloads:
                 del active_downloads[video_id]
             if video_id in download_progress:
                 del download_progress[video_id]
 
-            # Remove main file (renamed or original)
-            if filepath and os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                except Exception:
-                    pass
+            # Remove the job directory and whatever its manifest lists
+            discard_job()
+
+# --role frontend: jobs go to the Redis queue, workers report status edits back
+async def enqueue_download(message: Message, url, audio, format_id, custom_title, subtitles, use_cache, playlist):
+    if resolve(url) is None:
+        await message.reply("Error: Invalid URL")
+        return
 
-            # Remove main file (if not renamed)
-            for file in os.listdir(config.output_folder):
-                if file.startswith(video_id):
-                    try:
-                        os.remove(os.path.join(config.output_folder, file))
-                    except Exception:
-                        pass
-
-            # Remove partial file if it exists
-            partial_path = f'{config.output_folder}/{video_id}_partial.mp4'
-            if os.path.exists(partial_path):
+    job_id = str(uuid.uuid4())
+    keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancel", callback_data=f"cancel|del|{job_id}")]])
+    msg = await send_status_message(message, TIP_TEXT, keyboard)
+    try:
+        await job_queue.enqueue(describe_job(message, job_id, url, audio, format_id, custom_title, subtitles, use_cache, playlist, msg))
+    except Exception as e:
+        print(f"Enqueue error: {e}")
+        await edits.edit_now(msg, f"Error: could not queue the download ({e})")
+        return
+    await logger.log(app, message, f"Queued for a worker: {url} (ID: {job_id})", level="DOWNLOAD")
+
+async def apply_status_events():
+    last_id = "$"
+    while True:
+        try:
+            events = await job_queue.read_events(last_id)
+        except Exception as e:
+            print(f"Reading job events failed: {e}")
+            await asyncio.sleep(1)
+            continue
+        for last_id, event in events:
+            msg = StatusRef(app, event["chat_id"], event["id"], event.get("media"))
+            if event["op"] == "delete":
+                edits.forget(msg)
                 try:
-                    os.remove(partial_path)
+                    await msg.delete()
                 except Exception:
                     pass
+            else:
+                # The worker already spaced its edits, only the chat and global limits apply here
+                edits.update(msg, event["text"], load_markup(event.get("markup")), urgent=True)
+
+# --role worker: claim jobs while there are free slots, leave the ones a shutdown interrupts for other workers
+async def run_job(entry_id, job, deliveries):
+    message = RemoteMessage(app, job)
+    status = RemoteStatus(job_queue, job)
+    interrupted = False
+    try:
+        if deliveries > MAX_DELIVERIES:
+            await edits.edit_now(status, "❌ This download failed on several workers, giving up.")
+        elif await job_queue.cancel_requests([job["id"]]):
+            await edits.edit_now(status, "❌ Download cancelled.")
+        else:
+            interrupted = await download_video(
+                message, job["url"], job["audio"], job["format_id"], job["custom_title"], job["subtitles"],
+                job["use_cache"], job["playlist"], video_id=job["id"], status=status
+            )
+    except Exception as e:
+        print(f"Job {job['id']} failed: {e}")
+    except asyncio.CancelledError:
+        interrupted = True
+        raise
+    finally:
+        edits.forget(status)
+        # Jobs the shutdown cut off stay pending for another worker, the ones that ended during the drain are done
+        if not interrupted:
+            try:
+                await job_queue.finish(entry_id, job["id"])
+            except Exception as e:
+                print(f"Could not finish job {job['id']}, it will run again: {e}")
 
-            # Cleanup last_edited keys
-            keys_to_remove = [k for k in last_edited.keys() if str(msg.id) in k]
-            for k in keys_to_remove:
-                last_edited.pop(k, None)
+async def worker_heartbeat(running):
+    """Keeps the claimed entries this worker's and hands cancel buttons pressed on the frontend to the jobs."""
+    last_touch = 0
+    while True:
+        await asyncio.sleep(1)
+        try:
+            if time.monotonic() - last_touch >= VISIBILITY_TIMEOUT / 3:
+                await job_queue.touch(WORKER_NAME, list(running))
+                last_touch = time.monotonic()
+            for job_id, action in (await job_queue.cancel_requests(job_id for job_id, _ in running.values())).items():
+                cancel_job(job_id, action)
+        except Exception as e:
+            print(f"Worker heartbeat failed: {e}")
+
+async def worker_loop():
+    await job_queue.setup()
+    running = {}  # stream entry id -> (job id, task)
+    heartbeat = asyncio.create_task(worker_heartbeat(running))
+    print(f"Worker {WORKER_NAME} waiting for jobs...")
+    try:
+        while not STOP_REQUESTED:
+            free = scheduler.max_global - len(running)
+            if free <= 0:
+                await asyncio.wait([task for _, task in running.values()], return_when=asyncio.FIRST_COMPLETED)
+                continue
+            try:
+                claimed = await job_queue.claim(WORKER_NAME, free)
+            except Exception as e:
+                print(f"Claiming jobs failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            for entry_id, job, deliveries in claimed:
+                task = asyncio.create_task(run_job(entry_id, job, deliveries))
+                running[entry_id] = (job["id"], task)
+                task.add_done_callback(lambda _, entry_id=entry_id: running.pop(entry_id, None))
+    finally:
+        heartbeat.cancel()
+
+# Jobs the last run left in the journal, they continue in their job directories and report to their old status messages
+async def resume_jobs():
+    jobs, dropped = await journal.interrupted()
+    for job in dropped:
+        await asyncio.to_thread(JobDir(job["id"]).cleanup)
+        if job["reason"] == "expired":
+            text = "❌ This download was interrupted too long ago, send the link again."
+        else:
+            text = "❌ This download was interrupted too often, send the link again."
+        try:
+            await edits.edit_now(StatusRef(app, job["chat_id"], job["status_id"], job.get("status_media")), text)
+        except Exception as e:
+            print(f"Could not update status of dropped job {job['id']}: {e}")
+    for job in jobs:
+        message = RemoteMessage(app, job)
+        status = StatusRef(app, job["chat_id"], job["status_id"], job.get("status_media"))
+        part = job.get("part_path")
+        done = os.path.getsize(part) if part and os.path.exists(part) else 0
+        text = "🔄 Resuming after a restart"
+        if done:
+            text += f", {format_bytes(done)} already downloaded"
+        try:
+            await edits.edit_now(status, text + "...")
+        except Exception as e:
+            print(f"Could not update status of job {job['id']}: {e}")
+        print(f"Resuming job {job['id']}: {job['url']}")
+        asyncio.create_task(download_video(
+            message, job["url"], job["audio"], job["format_id"], job["custom_title"], job["subtitles"],
+            job["use_cache"], job["playlist"], video_id=job["id"], status=status
+        ))
 
 def get_text(message: Message):
     if not message:
@@ -560,6 +1134,22 @@ async def download_audio_command(client, message):
     await logger.log(app, message, f"Audio command received: {text}", level="INFO")
     asyncio.create_task(download_video(message, text, True))
 
+@app.on_message(filters.command(['playlist']))
+async def playlist_command(client, message):
+    text = get_text(message)
+    if not text:
+        await message.reply('Invalid usage, use `/playlist url [items]`\n\nItems: `10` for the first 10, or ranges like `5-20`, `1,3,7-9`, `-5:`')
+        return
+
+    url, _, items = text.partition(' ')
+    selection = playlist_selection(items) if items.strip() else ""
+    if selection is None:
+        await message.reply(f'Invalid items `{items.strip()}`, use `10` for the first 10, or ranges like `5-20`, `1,3,7-9`, `-5:`')
+        return
+
+    await logger.log(app, message, f"Playlist command received: {text}", level="DOWNLOAD")
+    asyncio.create_task(download_video(message, url, playlist=selection))
+
 @app.on_message(filters.command(['sendVideo']))
 async def send_video_command(client, message):
     text = get_text(message)
@@ -605,16 +1195,30 @@ async def set_quality_callback(client, call: CallbackQuery):
     await call.answer(f"Preference saved: {quality}")
     await call.message.edit(f"✅ **Settings Updated**\n\nDefault Quality: `{quality}`")
 
+def cancel_job(vid, action):
+    """Flag a job running in this process for cancel (del) or partial send (send), False if it isn't here."""
+    if vid not in active_downloads:
+        return False
+    if active_downloads[vid]['action'] != action:
+        active_downloads[vid]['action'] = action
+        # Still waiting in the queue, drop it right away
+        ticket = active_downloads[vid].get('ticket')
+        if ticket and not ticket.granted:
+            scheduler.cancel(ticket)
+    return True
+
 @app.on_callback_query(filters.regex(r"^cancel\|"))
 async def cancel_download(client, call: CallbackQuery):
     data = call.data.split("|")
     action = data[1]
     vid = data[2]
 
-    if vid in active_downloads:
-        active_downloads[vid]['action'] = action
+    if cancel_job(vid, action) or ROLE == "frontend":
+        if ROLE == "frontend":
+            # The worker running it (or the next one to pick it up) sees this within a second
+            await job_queue.request_cancel(vid, action)
         await call.answer("Cancelling...")
-        await call.message.edit("Cancelling...")
+        await edits.edit_now(call.message, "Cancelling...")
     else:
         await call.answer("Download not active or already finished.")
 
@@ -658,7 +1262,7 @@ async def yt_callback(client, call: CallbackQuery):
 @app.on_message(filters.private & filters.command(['c']))
 async def command_handler(client, message):
     print(f"Command received from {message.from_user.username}/{message.from_user.id}: {message.text}")
-    await logger.log(f"Command received from {message.from_user.username}/{message.from_user.id}: {message.text}", level="INFO")
+    await logger.log(app, message, f"Command received from {message.from_user.username}/{message.from_user.id}: {message.text}", level="INFO")
     if message.from_user.username.lower() not in [admin.lower() for admin in config.adminUsernames]:
         await message.reply("You are not authorized to use this command.")
         return
@@ -708,7 +1312,7 @@ async def callback(client, call: CallbackQuery):
     else:
         await call.answer("You didn't send the request", show_alert=True)
 
-@app.on_message(filters.private & ~filters.command(['start', 'help', 'download', 'audio', 'custom', 'sendVideo']))
+@app.on_message(filters.private & ~filters.command(['start', 'help', 'download', 'audio', 'playlist', 'custom', 'sendVideo']))
 async def handle_private_messages(client, message):
     text = message.text or message.caption
     if not text:
@@ -717,17 +1321,93 @@ async def handle_private_messages(client, message):
     await logger.log(app, message, f"Private message received: {text}", level="DOWNLOAD")
     asyncio.create_task(download_video(message, text))
 
+# --profile-startup: report when the first update arrives, ahead of every other handler
+if startup.enabled:
+    @app.on_message(group=-1)
+    async def first_update(client, message):
+        startup.first_update()
+
 if __name__ == "__main__":
+    # A Redis user store has to wait for the connection, the SQLite one loads before updates arrive
+    REDIS_USER_STORE = getattr(config, "user_store", "sqlite") == "redis"
+
+    async def connect_redis():
+        if redis_client and redis_client.redis_enabled:
+            await redis_client.connect()
+            startup.mark("redis connected")
+        if REDIS_USER_STORE:
+            await user_manager.start()
+
+    async def resume_jobs_when_ready(redis_task):
+        if redis_task:
+            await redis_task
+        try:
+            await resume_jobs()
+        except Exception as e:
+            print(f"Resuming interrupted jobs failed: {e}")
+
     async def main():
+        startup.mark("imports done")
+        if ROLE != "all":
+            # Nothing works without the job queue, connect before anything else
+            if not (redis_client and await redis_client.connect()):
+                print(f"❌ --role {ROLE} needs Redis, set redis_enabled and redis_host in config.py")
+                return
+            await job_queue.setup()
+            if not REDIS_USER_STORE:
+                print("⚠️ Quality preferences set on the frontend only reach workers with user_store = \"redis\"")
+        if not REDIS_USER_STORE or ROLE != "all":
+            await user_manager.start()
+        if JOURNAL_ENABLED:
+            await journal.open()
+        # Only directories of jobs that aren't running or waiting to resume get reclaimed
+        janitor.start(lambda: active_downloads.keys() | journal.ids())
+        if metrics.METRICS_ENABLED:
+            metrics.registry.add_collector(collect_metrics)
+            await metrics.metrics_server.start()
+        # The frontend never has files to serve
+        if FILE_SERVER_ENABLED and ROLE != "frontend":
+            await file_server.start()
         await app.start()
+        startup.mark("app started")
+        # Nothing below delays the first reply
+        redis_task = asyncio.create_task(connect_redis()) if ROLE == "all" else None
+        asyncio.create_task(media_cache.preload())
+        if JOURNAL_ENABLED:
+            # Quality preferences from a Redis user store are needed first
+            asyncio.create_task(resume_jobs_when_ready(redis_task if REDIS_USER_STORE else None))
+        role_task = None
+        if ROLE == "worker":
+            role_task = asyncio.create_task(worker_loop())
+        elif ROLE == "frontend":
+            role_task = asyncio.create_task(apply_status_events())
         await logger.log(app, None, "Bot started", level="SUCCESS")
-        print("Bot started...")
+        print(f"Bot started ({ROLE})...")
+        startup.report()
         await idle()
         print("\nStopping bot...")
         await logger.log(app, None, "Bot stopping", level="WARNING")
         global STOP_REQUESTED
         STOP_REQUESTED = True
+        janitor.stop()
+        # Downloads stop at their next progress update and keep their files for the restart
+        for _ in range(50):
+            if not active_downloads:
+                break
+            await asyncio.sleep(0.1)
+        await file_server.stop()
+        await metrics.metrics_server.stop()
+        for task in (redis_task, role_task):
+            if task and not task.done():
+                task.cancel()
+        await user_manager.close()
+        await media_cache.close()
+        await logger.close()
         await app.stop()
+        if redis_client:
+            await redis_client.close()
+        # Last, so uploads that finish during the steps above still leave the journal
+        journal.close()
 
     try:
         loop = asyncio.get_event_loop()
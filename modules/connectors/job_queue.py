@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+from types import SimpleNamespace
+
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+# Add parent directory to path to import config
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+import config
+
+'''
+Redis job queue for running the bot split over processes:
+`python main.py --role frontend` once, `python main.py --role worker` as often as needed,
+on any host that reaches the same Redis (a local one, or fakeredis' TcpFakeServer).
+
+The frontend receives updates, posts the status message and adds each download to
+the `jobs` stream. Workers read the stream through the `workers` consumer group, run
+the job with their own Pyrogram client (which receives no updates) and upload from
+where the file is. Status edits travel back on the `jobs:events` stream and the
+frontend applies them, so every status edit still goes through one edit scheduler.
+Cancel buttons are pressed on the frontend and reach the worker as `jobs:cancel:<id>`.
+
+A worker keeps resetting the idle time of the entries it runs. An entry idle for
+longer than `job_visibility_timeout` belongs to a worker that died, and the next worker
+with a free slot claims it with XAUTOCLAIM. Entries delivered more than
+`job_max_deliveries` times are given up.
+'''
+
+STREAM = "jobs"
+GROUP = "workers"
+EVENTS = "jobs:events"
+CANCEL_PREFIX = "jobs:cancel:"
+VISIBILITY_TIMEOUT = float(getattr(config, "job_visibility_timeout", 60))
+MAX_DELIVERIES = int(getattr(config, "job_max_deliveries", 3))
+# Events are only read live, old ones are trimmed away
+EVENTS_MAXLEN = 10000
+
+def dump_markup(markup):
+    if not markup:
+        return None
+    return [[[button.text, button.callback_data] for button in row] for row in markup.inline_keyboard]
+
+def load_markup(rows):
+    if not rows:
+        return None
+    return InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=data) for text, data in row] for row in rows])
+
+class JobQueue:
+    """Stream operations on a connected RedisClient."""
+    def __init__(self, redis_client):
+        self.redis = redis_client
+
+    @property
+    def client(self):
+        return self.redis.client
+
+    async def setup(self):
+        if await self.client.exists(STREAM):
+            if any(group["name"] == GROUP for group in await self.client.xinfo_groups(STREAM)):
+                return
+        await self.client.xgroup_create(STREAM, GROUP, id="0", mkstream=True)
+
+    async def enqueue(self, job):
+        return await self.client.xadd(STREAM, {"job": json.dumps(job)})
+
+    async def claim(self, consumer, count, block=2.0):
+        """
+        Up to count (entry id, job, deliveries): entries left behind by dead workers
+        first, then new ones, waiting up to block seconds for those.
+        """
+        claimed = []
+        _, entries, *_ = await self.client.xautoclaim(
+            STREAM, GROUP, consumer, int(VISIBILITY_TIMEOUT * 1000), "0-0", count=count
+        )
+        for entry_id, fields in entries:
+            # Entries deleted meanwhile come back without fields
+            if not fields:
+                await self.client.xack(STREAM, GROUP, entry_id)
+                continue
+            pending = await self.client.xpending_range(STREAM, GROUP, min=entry_id, max=entry_id, count=1)
+            deliveries = pending[0]["times_delivered"] if pending else 1
+            claimed.append((entry_id, json.loads(fields["job"]), deliveries))
+
+        if len(claimed) < count:
+            result = await self.client.xreadgroup(
+                GROUP, consumer, {STREAM: ">"}, count=count - len(claimed), block=int(block * 1000)
+            )
+            for _, entries in result or []:
+                for entry_id, fields in entries:
+                    claimed.append((entry_id, json.loads(fields["job"]), 1))
+        return claimed
+
+    async def touch(self, consumer, entry_ids):
+        """Reset the idle time of entries this worker still runs, so nobody else claims them."""
+        if entry_ids:
+            await self.client.xclaim(STREAM, GROUP, consumer, 0, list(entry_ids), justid=True)
+
+    async def finish(self, entry_id, job_id):
+        async with self.client.pipeline(transaction=True) as pipe:
+            await pipe.xack(STREAM, GROUP, entry_id).xdel(STREAM, entry_id).delete(CANCEL_PREFIX + job_id).execute()
+
+    async def publish(self, event):
+        await self.client.xadd(EVENTS, {"event": json.dumps(event)}, maxlen=EVENTS_MAXLEN, approximate=True)
+
+    async def read_events(self, last_id="$", block=5.0):
+        """[(event id, event)] published after last_id, waiting up to block seconds for one."""
+        result = await self.client.xread({EVENTS: last_id}, count=100, block=int(block * 1000))
+        return [(event_id, json.loads(fields["event"])) for _, entries in result or [] for event_id, fields in entries]
+
+    async def request_cancel(self, job_id, action):
+        await self.client.set(CANCEL_PREFIX + job_id, action, ex=86400)
+
+    async def cancel_requests(self, job_ids):
+        """{job id: action} for the jobs someone pressed a cancel button on."""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return {}
+        actions = await self.client.mget([CANCEL_PREFIX + job_id for job_id in job_ids])
+        return {job_id: action for job_id, action in zip(job_ids, actions) if action}
+
+class RemoteMessage:
+    """
+    The user's message as seen from a worker, or from a job resumed after a restart. Has what
+    download_video and the providers read (id, chat, from_user, text) and sends replies through client.
+    """
+    def __init__(self, client, job):
+        self._client = client
+        self.id = job["message_id"]
+        self.text = job.get("text")
+        self.caption = None
+        self.reply_to_message = None
+        self.chat = SimpleNamespace(id=job["chat_id"], title=job.get("chat_title"), first_name=job.get("first_name"))
+        self.from_user = None
+        if job.get("user_id"):
+            self.from_user = SimpleNamespace(
+                id=job["user_id"],
+                username=job.get("username"),
+                first_name=job.get("first_name"),
+                mention=f"[{job.get('first_name') or job['user_id']}](tg://user?id={job['user_id']})"
+            )
+
+    async def _reply(self, method, *args, quote=True, **kwargs):
+        return await getattr(self._client, method)(self.chat.id, *args, reply_to_message_id=self.id if quote else None, **kwargs)
+
+    async def reply(self, text, **kwargs):
+        return await self._reply("send_message", text, **kwargs)
+
+    async def reply_animation(self, animation, **kwargs):
+        return await self._reply("send_animation", animation, **kwargs)
+
+    async def reply_audio(self, audio, **kwargs):
+        return await self._reply("send_audio", audio, **kwargs)
+
+    async def reply_video(self, video, **kwargs):
+        return await self._reply("send_video", video, **kwargs)
+
+class RemoteStatus:
+    """The job's status message as seen from a worker, edits are forwarded to the frontend."""
+    def __init__(self, queue, job):
+        self.queue = queue
+        self.id = job["status_id"]
+        self.chat = SimpleNamespace(id=job["chat_id"])
+        # The edit scheduler edits the caption of the animation
+        self.media = job.get("status_media")
+
+    async def edit_text(self, text, reply_markup=None):
+        await self.queue.publish({
+            "op": "edit", "chat_id": self.chat.id, "id": self.id, "media": bool(self.media),
+            "text": text, "markup": dump_markup(reply_markup),
+        })
+
+    edit_caption = edit_text
+
+    async def delete(self):
+        await self.queue.publish({"op": "delete", "chat_id": self.chat.id, "id": self.id})
+
+class StatusRef:
+    """A message the frontend only knows by chat and id, enough for the edit scheduler."""
+    def __init__(self, client, chat_id, message_id, media=False):
+        self.client = client
+        self.id = message_id
+        self.chat = SimpleNamespace(id=chat_id)
+        self.media = media
+
+    async def edit_text(self, text, reply_markup=None):
+        return await self.client.edit_message_text(self.chat.id, self.id, text, reply_markup=reply_markup)
+
+    async def edit_caption(self, caption, reply_markup=None):
+        return await self.client.edit_message_caption(self.chat.id, self.id, caption, reply_markup=reply_markup)
+
+    async def delete(self):
+        return await self.client.delete_messages(self.chat.id, self.id)
@@ -1,4 +1,3 @@
-import redis
 import os
 import sys
 import secrets
@@ -8,43 +7,102 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(
 import config
 
 class RedisClient:
-    def __init__(self):
-        self.redis_enabled = config.redis_enabled
-        self.client = None
+    """
+    Async Redis connector on a shared connection pool.
+    Neither the redis package nor the network is touched until `connect()`, which
+    builds the pool, pings once and disables the client if Redis can't be reached.
+    Until then, and after a failed connect, every method quietly returns None.
+    A ready client (a local Redis, fakeredis.aioredis.FakeRedis, ...) can be passed in for tests.
+    """
+    def __init__(self, client=None):
+        self.redis_enabled = client is not None or config.redis_enabled
+        self.client = client
+        self.ready = False
+        self.has_getdel = True  # cleared if the server predates GETDEL (Redis < 6.2)
+        self.host = getattr(config, "redis_host", "localhost")
+        self.port = int(getattr(config, "redis_port", 6379))
+        self.db = int(getattr(config, "redis_db", 0))
 
-        if self.redis_enabled:
-            try:
-                self.host = getattr(config, "redis_host", "localhost")
-                self.port = int(getattr(config, "redis_port", 6379))
-                self.db = int(getattr(config, "redis_db", 0))
-
-                self.client = redis.Redis(
+    async def connect(self):
+        if not self.redis_enabled:
+            return False
+        try:
+            if self.client is None:
+                import redis.asyncio as aioredis
+                self.pool = aioredis.ConnectionPool(
                     host=self.host,
                     port=self.port,
                     db=self.db,
+                    max_connections=int(getattr(config, "redis_max_connections", 20)),
                     decode_responses=True
                 )
-                # Test connection
-                self.client.ping()
-                print("✅ Redis connection established.")
-            except Exception as e:
-                print(f"⚠️ Redis connection failed: {e}")
-                self.client = None
-                self.redis_enabled = False
-
-    def get(self, key):
+                self.client = aioredis.Redis(connection_pool=self.pool)
+            # Test connection
+            await self.client.ping()
+            self.ready = True
+            print("✅ Redis connection established.")
+            return True
+        except Exception as e:
+            print(f"⚠️ Redis connection failed: {e}")
+            await self.close()
+            self.client = None
+            self.redis_enabled = False
+            return False
+
+    async def close(self):
+        self.ready = False
+        if self.client:
+            try:
+                await self.client.aclose()
+            except Exception:
+                pass
+
+    async def get(self, key):
         if self.client:
-            return self.client.get(key)
+            return await self.client.get(key)
         return None
 
-    def set(self, key, value, ex=None):
+    async def set(self, key, value, ex=None):
         if self.client:
-            return self.client.set(key, value, ex=ex)
+            return await self.client.set(key, value, ex=ex)
         return None
 
-    def delete(self, key):
+    async def delete(self, key):
         if self.client:
-            return self.client.delete(key)
+            return await self.client.delete(key)
+        return None
+
+    async def getdel(self, key):
+        """Read and delete a key atomically, so a one-time value can only be redeemed once."""
+        if not self.client:
+            return None
+        if self.has_getdel:
+            from redis.exceptions import ResponseError
+            try:
+                return await self.client.getdel(key)
+            except ResponseError as e:
+                if "unknown command" not in str(e).lower():
+                    raise
+                self.has_getdel = False
+        # MULTI/EXEC runs both commands with nothing in between
+        async with self.client.pipeline(transaction=True) as pipe:
+            value, _ = await pipe.get(key).delete(key).execute()
+        return value
+
+    def pipeline(self, transaction=True):
+        """Batch several commands into one round-trip: `async with r.pipeline() as pipe: ...`"""
+        if self.client:
+            return self.client.pipeline(transaction=transaction)
+        return None
+
+    async def hgetall(self, key):
+        if self.client:
+            return await self.client.hgetall(key)
+        return {}
+
+    async def hset(self, key, mapping):
+        if self.client and mapping:
+            return await self.client.hset(key, mapping=mapping)
         return None
 
     @staticmethod
@@ -0,0 +1,29 @@
+import re
+from urllib.parse import urlsplit
+
+from modules.providers import registry
+
+# Sites this provider knows by name, everything unregistered lands here too
+SITES = {
+    "youtube.com": "youtube",
+    "youtu.be": "youtube",
+    "music.youtube.com": "youtube_music",
+    "soundcloud.com": "soundcloud",
+    "mixcloud.com": "mixcloud",
+    "bandcamp.com": "bandcamp",
+}
+
+# Paths that are always a list of media, they download in playlist mode
+PLAYLIST_PATHS = {
+    "youtube": re.compile(r'^/(playlist$|@[^/]+|channel/|c/|user/)'),
+    "youtube_music": re.compile(r'^/(playlist$|browse/|channel/)'),
+    "soundcloud": re.compile(r'^/[^/]+/sets/'),
+    "bandcamp": re.compile(r'^/album/'),
+}
+
+def is_playlist_link(link):
+    """Whether a resolved Link points at a playlist, channel or album rather than one item."""
+    pattern = PLAYLIST_PATHS.get(link.site) if link else None
+    return bool(pattern and pattern.match(urlsplit(link.url).path))
+
+registry.register("general", "modules.providers.general.general_provider:download", SITES, is_default=True)
@@ -1,26 +1,68 @@
 import os
+import re
 import sys
+import time
+import shutil
 import asyncio
-import yt_dlp
-from urllib.parse import urlparse
+import threading
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 # Add parent directory to path to import config
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
 import config
-from modules.utils.validator import UrlValidator
-from modules.utils.exceptions import DownloadCancelled
+from modules.utils.validator import normalize_url
+from modules.utils.exceptions import DownloadCancelled, NotEnoughSpace
+from modules.utils.media_cache import media_cache
+from modules.utils import ytdlp_runner
+from modules.utils.cache import TTLCache
+from modules.utils.workdir import ensure_space
+from modules.utils import metrics
+from modules.providers.general import is_playlist_link
 
-async def show_youtube_selection(client, message, url, cache_dict):
-    msg = await message.reply("Fetching available formats...")
-    cache_dict[msg.id] = url
+'''
+Everything yt-dlp can download that no other provider claims.
+Playlists, channels and albums (see is_playlist_link, or any link sent with /playlist)
+are extracted once without resolving their entries, then the entries download
+`playlist_parallel_downloads` at a time and are handed to `on_batch` in playlist order,
+up to 10 at a time so they go out as one Telegram album.
+'''
+
+# Music platforms (site tags from the registry), downloaded as audio
+AUDIO_SITES = {"soundcloud", "mixcloud", "bandcamp"}
+
+# Extraction results from the quality menu, reused when the user picks a format
+info_cache = TTLCache(
+    ttl=int(getattr(config, "info_cache_ttl", 1800)),
+    max_entries=int(getattr(config, "info_cache_max_entries", 200))
+)
+
+PLAYLIST_PARALLEL = int(getattr(config, "playlist_parallel_downloads", 3))
+PLAYLIST_MAX_ITEMS = int(getattr(config, "playlist_max_items", 50))
+# Telegram's limit for one album
+MEDIA_GROUP_SIZE = 10
+
+DEFAULT_FORMAT = "bestvideo+bestaudio/best"
 
-    def get_info():
-        with yt_dlp.YoutubeDL() as ydl:
-            return ydl.extract_info(url, download=False)
+# Signed stream URLs (googlevideo etc.) carry their expiry as expire=<unix time>
+EXPIRE_PATTERN = re.compile(r'[?&/]expire[=/](\d+)')
+
+def cache_info(key, info):
+    ttl = info_cache.ttl
+    for f in info.get('formats') or []:
+        match = EXPIRE_PATTERN.search(f.get('url') or '')
+        if match:
+            # Leave a margin so a download doesn't start on URLs about to die
+            ttl = min(ttl, int(match.group(1)) - time.time() - 60)
+    info_cache.set(key, info, ttl)
+
+async def show_youtube_selection(client, message, link, cache_dict):
+    msg = await message.reply("Fetching available formats...")
+    cache_dict[msg.id] = link.url
 
     try:
-        info = await asyncio.to_thread(get_info)
+        with metrics.stage_seconds.time(stage="extract", provider="general"):
+            info, _ = await ytdlp_runner.extract(link.url, {}, download=False)
+        cache_info(link.key, info)
 
         buttons = []
         # Filter formats
@@ -60,58 +102,65 @@ async def show_youtube_selection(client, message, url, cache_dict):
         await msg.edit(f"Error fetching formats: {e}")
         return {"status": "error", "message": str(e)}
 
-async def download(url: str, client, message, progress_callback, user_manager, video_id, audio=False, format_id="bestvideo+bestaudio/best", custom_title=None, youtube_selection_cache=None):
-    output_folder = config.output_folder
+def quality_format(pref):
+    """yt-dlp format for a quality preference, H.264/AAC first for compatibility."""
+    if pref == "best":
+        return "bestvideo[vcodec^=avc1]+bestaudio[acodec^=mp4a]/bestvideo+bestaudio/best"
+    # e.g. 720p -> bestvideo[height<=720][vcodec^=avc1]+...
+    try:
+        res = int(pref.replace("p", ""))
+        return f"bestvideo[height<={res}][vcodec^=avc1]+bestaudio[acodec^=mp4a]/bestvideo[height<={res}]+bestaudio/best[height<={res}]"
+    except ValueError:
+        return "bestvideo[vcodec^=avc1]+bestaudio[acodec^=mp4a]/bestvideo+bestaudio/best"
+
+async def download(link, client, message, progress_callback, user_manager, video_id, audio=False, format_id=DEFAULT_FORMAT, custom_title=None, youtube_selection_cache=None, use_cache=True, subtitle_manifest=None, work_dir=None, playlist=None, on_batch=None, **_):
+    """
+    link is a registry Link, its site tag replaces re-parsing the URL here.
+    playlist is a /playlist selector (yt-dlp playlist_items, "" for all) and forces
+    playlist mode, None leaves it to the link.
+    """
+    output_folder = work_dir or config.output_folder
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    url_info = urlparse(url)
+    playlist_mode = on_batch is not None and (playlist is not None or is_playlist_link(link))
 
     # Auto-detect audio mode for music platforms
-    if not audio:
-        domain = url_info.netloc.lower()
-        if any(x in domain for x in ['soundcloud.com', 'mixcloud.com', 'bandcamp.com']):
+    if not audio and link.site in AUDIO_SITES:
+        audio = True
+
+    # Show quality selection for YouTube if default format
+    if link.site == "youtube" and format_id == DEFAULT_FORMAT and not audio:
+        # Check user preference
+        user_id = message.from_user.id if message.from_user else 0
+        pref = user_manager.get_quality(user_id)
+
+        if pref == "ask" and not playlist_mode:
+            if youtube_selection_cache is None:
+                 return {"status": "error", "message": "Internal Error: Cache not provided"}
+            return await show_youtube_selection(client, message, link, youtube_selection_cache)
+        elif pref == "audio":
             audio = True
+            # Fall through to download
+        else:
+            # A playlist doesn't stop to ask, "ask" gets the best quality
+            format_id = quality_format(pref)
+
+    if playlist_mode:
+        result = await download_playlist(link, playlist, video_id, audio, format_id, progress_callback, on_batch, use_cache, output_folder)
+        # None: the link turned out to be a single item
+        if result is not None:
+            return result
+
+    return await download_real(link.url, video_id, audio, format_id, progress_callback, use_cache, subtitle_manifest, output_folder, link.key)
 
-    if url_info.scheme:
-        if url_info.netloc in ['www.youtube.com', 'youtu.be', 'youtube.com', 'youtu.be']:
-            if not UrlValidator(url).isYouTube():
-                return {"status": "error", "message": "Invalid URL"}
-
-            # Show quality selection for YouTube if default format
-            if format_id == "bestvideo+bestaudio/best" and not audio:
-                # Check user preference
-                user_id = message.from_user.id if message.from_user else 0
-                pref = user_manager.get_quality(user_id)
-
-                if pref == "ask":
-                    if youtube_selection_cache is None:
-                         return {"status": "error", "message": "Internal Error: Cache not provided"}
-                    return await show_youtube_selection(client, message, url, youtube_selection_cache)
-                elif pref == "audio":
-                    audio = True
-                    # Fall through to download
-                else:
-                    # Set specific quality (Prioritize H.264/AAC for compatibility)
-                    if pref == "best":
-                        format_id = "bestvideo[vcodec^=avc1]+bestaudio[acodec^=mp4a]/bestvideo+bestaudio/best"
-                    else:
-                        # e.g. 720p -> bestvideo[height<=720][vcodec^=avc1]+...
-                        try:
-                            res = int(pref.replace("p", ""))
-                            format_id = f"bestvideo[height<={res}][vcodec^=avc1]+bestaudio[acodec^=mp4a]/bestvideo[height<={res}]+bestaudio/best[height<={res}]"
-                        except ValueError:
-                            format_id = "bestvideo[vcodec^=avc1]+bestaudio[acodec^=mp4a]/bestvideo+bestaudio/best"
-
-    return await download_real(url, video_id, audio, format_id, progress_callback)
-
-async def download_real(url, video_id, audio, format_id, progress_callback):
-    output_path = f'{config.output_folder}/{video_id}.%(ext)s'
+async def download_real(url, video_id, audio, format_id, progress_callback, use_cache=True, subtitle_manifest=None, output_folder=None, info_key=None):
+    output_folder = output_folder or config.output_folder
+    output_path = f'{output_folder}/{video_id}.%(ext)s'
 
     ydl_opts = {
         'format': format_id,
         'outtmpl': output_path,
-        'progress_hooks': [progress_callback],
         'max_filesize': config.max_filesize,
         'http_chunk_size': 10485760, # 10MB
         'remote_components': {'ejs:github'},
@@ -121,8 +170,12 @@ async def download_real(url, video_id, audio, format_id, progress_callback):
         'retries': 3,
         'fragment_retries': 3,
         'socket_timeout': 10,
+        # Read by SubtitleMergerPP, the subtitles go into the video+audio merge
+        'subtitle_manifest': subtitle_manifest,
         'buffersize': 1024 * 1024 * 10,
         'noplaylist': True,
+        # A job resumed after a restart writes to the same name, carry on from its .part file and fragments
+        'continuedl': True,
     }
 
     if audio:
@@ -140,22 +193,53 @@ async def download_real(url, video_id, audio, format_id, progress_callback):
     else:
         ydl_opts['merge_output_format'] = 'mp4'
 
-    def run_yt_dlp():
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            return ydl.extract_info(url, download=True)
+    cache_key = None
+    # Extraction ends when check_cache runs, which may be on yt-dlp's thread
+    extract_started = time.monotonic()
+    extracted_at = None
+
+    # Runs once the format is resolved, a file we already sent skips the download
+    def check_cache(info):
+        nonlocal cache_key, extracted_at
+        extracted_at = extracted_at or time.monotonic()
+        cache_key = media_cache.make_key(info, audio)
+        hit = media_cache.get(cache_key) if use_cache else None
+        if not hit:
+            # Refuse before downloading anything if the file can't fit
+            ensure_space(info.get('filesize') or info.get('filesize_approx'))
+        return hit
+
+    info_key = info_key or normalize_url(url)
+    cached_info = info_cache.get(info_key)
 
     try:
-        info = await asyncio.to_thread(run_yt_dlp)
+        try:
+            info, cached = await ytdlp_runner.extract(url, ydl_opts, True, progress_callback, check_cache, info=cached_info)
+        except (DownloadCancelled, NotEnoughSpace):
+            raise
+        except Exception as e:
+            if cached_info is None or "Bot shutting down" in str(e):
+                raise
+            # Stream URLs from the menu extraction went stale, start over
+            print(f"Download from cached info failed, re-extracting: {e}")
+            info_cache.pop(info_key)
+            info, cached = await ytdlp_runner.extract(url, ydl_opts, True, progress_callback, check_cache)
+
+        if extracted_at:
+            metrics.stage_seconds.observe(extracted_at - extract_started, stage="extract", provider="general")
 
         # Determine filepath
         filepath = None
-        if 'requested_downloads' in info:
+        if cached:
+            # Already on Telegram, main.py resends the file_id
+            pass
+        elif 'requested_downloads' in info:
             filepath = info['requested_downloads'][0]['filepath']
         else:
-             # Fallback
-            for file in os.listdir(config.output_folder):
+            # Fallback, the job folder only holds this job's files
+            for file in os.listdir(output_folder):
                 if file.startswith(video_id):
-                    filepath = os.path.join(config.output_folder, file)
+                    filepath = os.path.join(output_folder, file)
                     break
 
         return {
@@ -174,7 +258,9 @@ async def download_real(url, video_id, audio, format_id, progress_callback):
             "ext": info.get('ext', 'mp3' if audio else 'mp4'),
             "size": info.get('filesize_approx') or info.get('filesize') or 0,
             # "info": info,
-            "type": "audio" if audio else "video"
+            "type": "audio" if audio else "video",
+            "cache_key": cache_key,
+            "cached": cached,
         }
 
     except Exception as e:
@@ -182,3 +268,163 @@ async def download_real(url, video_id, audio, format_id, progress_callback):
         if isinstance(e, DownloadCancelled) or "Bot shutting down" in str(e):
             raise e
         return {"status": "error", "message": str(e)}
+
+def entry_url(entry):
+    return entry.get('url') or entry.get('webpage_url')
+
+def selection_of(positions):
+    """playlist_items for the given playlist positions, runs of consecutive ones as ranges: 51-60,72."""
+    ranges = []
+    for position in positions:
+        if ranges and position == ranges[-1][1] + 1:
+            ranges[-1][1] = position
+        else:
+            ranges.append([position, position])
+    return ",".join(f"{first}-{last}" if last != first else str(first) for first, last in ranges)
+
+async def download_playlist(link, items, video_id, audio, format_id, progress_callback, on_batch, use_cache, output_folder):
+    """
+    Download the entries of a playlist and hand them to on_batch(results) in order,
+    MEDIA_GROUP_SIZE at a time. Returns None if link isn't a playlist after all.
+    """
+    opts = {'extract_flat': 'in_playlist', 'noplaylist': False, 'quiet': True}
+    if items:
+        opts['playlist_items'] = items
+    else:
+        # One more than the limit tells whether there are more
+        opts['playlistend'] = PLAYLIST_MAX_ITEMS + 1
+
+    with metrics.stage_seconds.time(stage="extract", provider="general"):
+        info, _ = await ytdlp_runner.extract(link.url, opts, download=False)
+    if 'entries' not in info:
+        return None
+
+    # Playlist positions of the entries, yt-dlp leaves them out when it's the whole playlist
+    positions = info.get('requested_entries') or range(1, len(info['entries']) + 1)
+    entries = [(position, entry) for position, entry in zip(positions, info['entries']) if entry and entry_url(entry)]
+    if not entries:
+        return {"status": "error", "message": "The playlist is empty"}
+    # What to ask for next when the selection went over the limit
+    more = None
+    if len(entries) > PLAYLIST_MAX_ITEMS:
+        more = selection_of([position for position, _ in entries[PLAYLIST_MAX_ITEMS:]]) if items else f"{PLAYLIST_MAX_ITEMS + 1}-{2 * PLAYLIST_MAX_ITEMS}"
+    entries = [entry for _, entry in entries[:PLAYLIST_MAX_ITEMS]]
+
+    name = info.get('title') or 'Playlist'
+    # One slot per entry: None while it runs, then its download_real result
+    results = [None] * len(entries)
+    next_index = 0
+    sent = 0
+    failed = 0
+    started = time.time()
+
+    # (entry, file) -> (downloaded, total), written from yt-dlp's threads
+    transferred = {}
+    lock = threading.Lock()
+
+    def report():
+        if not progress_callback:
+            return
+        with lock:
+            downloaded_bytes = sum(done for done, _ in transferred.values())
+            known_total = sum(total for _, total in transferred.values())
+            seen = len({index for index, _ in transferred})
+        elapsed = max(time.time() - started, 0.001)
+        speed = downloaded_bytes / elapsed if downloaded_bytes else None
+        # Entries are assumed to be about the size of the ones seen so far
+        total = known_total * len(entries) / seen if seen else None
+        finished = sum(result is not None for result in results)
+        # Raises DownloadCancelled when the user cancels, on whichever thread reports
+        progress_callback({
+            'status': 'downloading',
+            'downloaded_bytes': downloaded_bytes,
+            'total_bytes_estimate': total,
+            'speed': speed,
+            'eta': (total - downloaded_bytes) / speed if speed and total else None,
+            'info_dict': {'title': f"{name} ({finished}/{len(entries)})", 'ext': 'mp3' if audio else 'mp4'},
+        })
+
+    def entry_progress(index):
+        def hook(d):
+            if 'postprocessor' not in d and 'downloaded_bytes' in d:
+                with lock:
+                    transferred[(index, d.get('filename'))] = (d['downloaded_bytes'] or 0, d.get('total_bytes') or d.get('total_bytes_estimate') or 0)
+            report()
+        return hook
+
+    async def flush(final=False):
+        """Send every complete album at the front of the playlist, and the rest once it's done."""
+        nonlocal next_index, sent, failed
+        while True:
+            batch = []
+            end = next_index
+            # final skips entries that never finished
+            while end < len(results) and (results[end] is not None or final) and len(batch) < MEDIA_GROUP_SIZE:
+                if results[end] and results[end].get('status') == 'success':
+                    batch.append(results[end])
+                end += 1
+            if end == next_index or (len(batch) < MEDIA_GROUP_SIZE and end < len(results) and not final):
+                return
+            next_index = end
+            if not batch:
+                continue
+            try:
+                await on_batch(batch)
+                sent += len(batch)
+            except Exception as e:
+                print(f"Sending playlist items failed: {e}")
+                failed += len(batch)
+            finally:
+                for result in batch:
+                    shutil.rmtree(result['entry_dir'], ignore_errors=True)
+
+    semaphore = asyncio.Semaphore(PLAYLIST_PARALLEL)
+
+    async def fetch(index, entry):
+        nonlocal failed
+        entry_dir = os.path.join(output_folder, str(index))
+        async with semaphore:
+            report()
+            result = await download_real(entry_url(entry), f"{video_id}-{index}", audio, format_id, entry_progress(index), use_cache, None, entry_dir)
+        if result.get('status') != 'success' or not (result.get('filepath') or result.get('cached')):
+            print(f"Playlist entry {index + 1} ({entry_url(entry)}) failed: {result.get('message')}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            result = {'status': 'error'}
+            failed += 1
+        result['entry_dir'] = entry_dir
+        results[index] = result
+        report()
+
+    tasks = [asyncio.create_task(fetch(i, entry)) for i, entry in enumerate(entries)]
+    try:
+        # Sending happens here, between downloads finishing, so a cancel never cuts an album short
+        pending = tasks
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                # The first exception (a cancel raised by progress_callback) stops everything
+                task.result()
+            await flush()
+    except DownloadCancelled as e:
+        if e.action != 'send':
+            raise
+        # "Send Partial" on a playlist sends the entries finished so far
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    await flush(final=True)
+
+    if not sent:
+        return {"status": "error", "message": "Nothing from the playlist could be downloaded"}
+
+    return {
+        "status": "completed",
+        "title": name,
+        "type": "audio" if audio else "video",
+        "unit": "tracks" if audio else "videos",
+        "sent": sent,
+        "failed": failed,
+        "more": more,
+        "limit": PLAYLIST_MAX_ITEMS,
+    }
@@ -0,0 +1,3 @@
+from modules.providers import registry
+
+registry.register("instagram", "modules.providers.instagram.instagram_provider:handle", {"instagram.com": "instagram"})
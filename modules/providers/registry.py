@@ -0,0 +1,59 @@
+import importlib
+
+from modules.utils.validator import parse_link
+
+'''
+Provider registry.
+Providers register themselves at import with the host suffixes they handle, each
+mapped to a site tag (`youtube`, `soundcloud`, ...). resolve() parses a link once
+and looks its host up suffix by suffix (music.youtube.com, then youtube.com, ...),
+so the cost depends on the number of labels in the host, not on how many sites
+are registered. Hosts nobody registered go to the default provider.
+
+Registration happens in each provider package's __init__.py and names the handler
+as "module:function", so the provider module itself (and whatever it imports) is
+only loaded when its first link comes in. Handlers are called as
+handler(link, **job) with the keyword arguments of route(), and take the ones they need.
+'''
+
+class Provider:
+    def __init__(self, name, handler):
+        self.name = name
+        self._handler = handler  # a callable, or "module:function" imported on first use
+
+    @property
+    def handler(self):
+        if isinstance(self._handler, str):
+            module, _, function = self._handler.partition(":")
+            self._handler = getattr(importlib.import_module(module), function)
+        return self._handler
+
+providers = {}
+hosts = {}  # host suffix -> (Provider, site tag)
+default = None
+
+def register(name, handler, sites=None, is_default=False):
+    """sites maps host suffixes to site tags, e.g. {"youtu.be": "youtube"}."""
+    global default
+    provider = providers[name] = Provider(name, handler)
+    for suffix, site in (sites or {}).items():
+        hosts[suffix.lower()] = (provider, site)
+    if is_default:
+        default = provider
+    return provider
+
+def lookup(host):
+    """(Provider, site tag) for host, the longest registered suffix wins."""
+    labels = host.split(".")
+    for i in range(len(labels) - 1):
+        entry = hosts.get(".".join(labels[i:]))
+        if entry:
+            return entry
+    return default, None
+
+def resolve(text):
+    """Parsed Link with its provider and site, or None if text isn't a URL."""
+    link = parse_link(text)
+    if link is not None:
+        link.provider, link.site = lookup(link.host)
+    return link
@@ -0,0 +1,3 @@
+from modules.providers import registry
+
+registry.register("spotify", "modules.providers.spotify.spotify_provider:handle", {"spotify.com": "spotify"})
@@ -1,22 +1,90 @@
 import os
 import sys
-import subprocess
+import json
+import time
 import uuid
 import glob
+import shutil
+import signal
+import asyncio
 
 # Add parent directory to path to import config
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
 import config
+from modules.utils.exceptions import DownloadCancelled
+from modules.utils import metrics
 
-def check_spotdl_installed():
+'''
+Spotify downloads through spotdl, run as asyncio subprocesses so the bot keeps serving
+other users meanwhile.
+A track link downloads one file. Albums, playlists and artists are listed with
+`spotdl save` first, then their tracks download in parallel and are handed to
+`on_file` as each one finishes, so the first songs arrive while the rest still download.
+Progress goes through the same yt-dlp style `progress_callback` as the general provider.
+'''
+
+OUTPUT_TEMPLATE = "{artist} - {title}.{output-ext}"
+# Seconds between cancel checks while spotdl runs
+POLL_INTERVAL = 0.5
+PARALLEL_TRACKS = int(getattr(config, "spotify_parallel_tracks", 4))
+
+spotdl_installed = None
+probe_lock = asyncio.Lock()
+
+async def check_spotdl_installed():
+    """Probe for spotdl once, later calls reuse the answer."""
+    global spotdl_installed
+    async with probe_lock:
+        if spotdl_installed is None:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    "spotdl", "--version",
+                    stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+                )
+                spotdl_installed = await process.wait() == 0
+            except FileNotFoundError:
+                spotdl_installed = False
+    return spotdl_installed
+
+async def run_spotdl(args, cwd, poll=None):
+    """
+    Run spotdl, killing it if the job is cancelled. poll() runs every POLL_INTERVAL
+    seconds meanwhile, an exception from it stops spotdl. Returns (returncode, stderr).
+    """
+    process = await asyncio.create_subprocess_exec(
+        "spotdl", *args, cwd=cwd,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+        # Its own process group, so the ffmpeg it starts goes down with it
+        start_new_session=True
+    )
+    communicate = asyncio.ensure_future(process.communicate())
     try:
-        process = subprocess.run(["spotdl", "--version"], capture_output=True, text=True)
-        return process.returncode == 0
-    except FileNotFoundError:
-        return False
+        while not (await asyncio.wait({communicate}, timeout=POLL_INTERVAL))[0]:
+            if poll:
+                poll()
+        _, stderr = communicate.result()
+    except BaseException:
+        communicate.cancel()
+        if process.returncode is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+        raise
+    return process.returncode, stderr.decode(errors="replace")
 
-def download(url: str, options: dict = None):
-    output_folder = os.path.abspath(config.output_folder)
+def cancel_check(progress_callback):
+    """poll for run_spotdl: the hook raises once the job is cancelled, like it does from yt-dlp."""
+    if not progress_callback:
+        return None
+    return lambda: progress_callback({'status': 'heartbeat'})
+
+def is_track(url):
+    return "/track/" in url
+
+async def download(url: str, progress_callback=None, on_file=None, work_dir=None):
+    output_folder = os.path.abspath(work_dir or config.output_folder)
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
@@ -26,45 +94,143 @@ def download(url: str, options: dict = None):
     os.makedirs(temp_dir)
 
     try:
-        # Use spotdl via subprocess
-        # Assuming spotdl is in path or installed in env
-        # Run in temp_dir to avoid path issues
-        cmd = ["spotdl", url, "--output", "{artist} - {title}.{output-ext}"]
-
-        process = subprocess.run(cmd, cwd=temp_dir, capture_output=True, text=True)
-
-        if process.returncode != 0:
-            return {
-                "status": "error",
-                "message": f"SpotDL failed: {process.stderr}"
-            }
-
-        # Find the downloaded file
-        files = glob.glob(os.path.join(temp_dir, "*"))
-        if not files:
-             return {
-                "status": "error",
-                "message": "No file downloaded"
-            }
-
-        filepath = files[0]
-        filename = os.path.basename(filepath)
-
-        # Move file to main output folder
-        final_path = os.path.join(output_folder, filename)
-        os.rename(filepath, final_path)
-        os.rmdir(temp_dir)
+        if is_track(url) or on_file is None:
+            return await download_track(url, temp_dir, output_folder, progress_callback)
+        return await download_collection(url, temp_dir, progress_callback, on_file)
+    except DownloadCancelled:
+        raise
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+async def download_track(url, temp_dir, output_folder, progress_callback=None):
+    # Run in temp_dir to avoid path issues
+    with metrics.stage_seconds.time(stage="track", provider="spotify"):
+        returncode, stderr = await run_spotdl([url, "--output", OUTPUT_TEMPLATE], temp_dir, cancel_check(progress_callback))
 
+    if returncode != 0:
         return {
-            "status": "success",
-            "filepath": final_path,
-            "filename": filename,
-            "type": "audio"
+            "status": "error",
+            "message": f"SpotDL failed: {stderr}"
+        }
 
+    # Find the downloaded file
+    files = glob.glob(os.path.join(temp_dir, "*"))
+    if not files:
+        return {
+            "status": "error",
+            "message": "No file downloaded"
         }
 
-    except Exception as e:
+    filepath = files[0]
+    filename = os.path.basename(filepath)
+
+    # Move file to main output folder
+    final_path = os.path.join(output_folder, filename)
+    os.rename(filepath, final_path)
+
+    return {
+        "status": "success",
+        "filepath": final_path,
+        "filename": filename,
+        "type": "audio"
+    }
+
+async def list_tracks(url, temp_dir, progress_callback=None):
+    save_file = os.path.join(temp_dir, "tracks.spotdl")
+    with metrics.stage_seconds.time(stage="extract", provider="spotify"):
+        returncode, stderr = await run_spotdl(["save", url, "--save-file", save_file], temp_dir, cancel_check(progress_callback))
+    if returncode != 0 or not os.path.exists(save_file):
+        raise Exception(f"SpotDL failed: {stderr}")
+    with open(save_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+async def download_collection(url, temp_dir, progress_callback, on_file):
+    tracks = await list_tracks(url, temp_dir, progress_callback)
+    if not tracks:
+        return {"status": "error", "message": "No tracks found"}
+
+    name = tracks[0].get("list_name") or tracks[0].get("album_name") or "Spotify"
+    started = time.time()
+    done = 0
+    failed = 0
+    downloaded_bytes = 0
+
+    def report():
+        if not progress_callback:
+            return
+        elapsed = max(time.time() - started, 0.001)
+        speed = downloaded_bytes / elapsed if done else None
+        # Tracks are about the same size, estimate the total from the ones done so far
+        total = downloaded_bytes * len(tracks) / done if done else None
+        progress_callback({
+            'status': 'downloading',
+            'downloaded_bytes': downloaded_bytes,
+            'total_bytes_estimate': total,
+            'speed': speed,
+            'eta': (total - downloaded_bytes) / speed if speed else None,
+            'info_dict': {'title': f"{name} ({done + failed}/{len(tracks)} tracks)", 'ext': 'mp3'},
+        })
+
+    semaphore = asyncio.Semaphore(PARALLEL_TRACKS)
+
+    async def fetch(index, track):
+        nonlocal done, failed, downloaded_bytes
+        track_dir = os.path.join(temp_dir, str(index))
+        os.makedirs(track_dir)
+        async with semaphore:
+            with metrics.stage_seconds.time(stage="track", provider="spotify"):
+                returncode, stderr = await run_spotdl([track["url"], "--output", OUTPUT_TEMPLATE], track_dir, cancel_check(progress_callback))
+        files = glob.glob(os.path.join(track_dir, "*"))
+        if returncode != 0 or not files:
+            print(f"SpotDL failed for {track.get('url')}: {stderr}")
+            failed += 1
+            report()
+            return
+        size = os.path.getsize(files[0])
+        try:
+            await on_file(files[0], track)
+        except Exception as e:
+            print(f"Sending {files[0]} failed: {e}")
+            failed += 1
+        else:
+            # Only tracks that reached the chat count as sent
+            downloaded_bytes += size
+            done += 1
+        finally:
+            shutil.rmtree(track_dir, ignore_errors=True)
+        report()
+
+    report()
+    tasks = [asyncio.create_task(fetch(i, track)) for i, track in enumerate(tracks)]
+    try:
+        # The first exception (a cancel raised by progress_callback) stops everything
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    if not done:
+        return {"status": "error", "message": "No track could be downloaded and sent"}
+
+    return {
+        "status": "completed",
+        "title": name,
+        "type": "audio",
+        "sent": done,
+        "failed": failed
+    }
+
+async def handle(link, progress_callback=None, on_file=None, work_dir=None, **_):
+    if not await check_spotdl_installed():
         return {
             "status": "error",
-            "message": str(e)
+            "message": "SpotDL is not installed or not found in PATH. Please install SpotDL to use the Spotify provider."
         }
+    # Albums and playlists hand every track to on_file as soon as it's downloaded
+    return await download(link.url, progress_callback, on_file, work_dir)
@@ -1,41 +1,57 @@
 import os
 import sys
 import json
+import time
 import urllib.parse
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from modules.utils.validator import UrlValidator
-from modules.providers.spotify import spotify_provider
-from modules.providers.instagram import instagram_provider
-from modules.providers.general import general_provider
+# Importing the provider packages registers them, their modules load on first use
+from modules.providers import registry
+import modules.providers.spotify
+import modules.providers.instagram
+import modules.providers.general
+from modules.utils import metrics
 
-async def route(url: str, client, message, progress_callback, user_manager, video_id, audio=False, format_id="bestvideo+bestaudio/best", custom_title=None, youtube_selection_cache=None):
-    validator = UrlValidator(url)
-    result = None
+resolve = registry.resolve
 
-    if validator.isSpotify():
-        print("Routing to Spotify provider...")
-        # Spotify provider needs to be updated to accept these args or we adapt here
-        # Assuming spotify_provider.download is synchronous or async?
-        # The previous implementation was synchronous. Let's check if we need to wrap it.
-        # But for now, let's assume we might need to update spotify provider too.
-        # For now, passing minimal args as it was before, but we should probably update it.
-        if not spotify_provider.check_spotdl_installed():
-            return {
-                "status": "error",
-                "message": "SpotDL is not installed or not found in PATH. Please install SpotDL to use the Spotify provider."
-            }
-        result = spotify_provider.download(url)
-    elif validator.isInstagram():
-        print("Routing to Instagram provider...")
-        result = instagram_provider.extract_instagram_url(url)
+def get_provider(url) -> str:
+    """Name of the provider route() will pick for this url (or resolved Link), used for per-provider limits."""
+    link = resolve(url) if isinstance(url, str) else url
+    return (link.provider if link else registry.default).name
 
-    elif validator.isUrl():
-        print("Routing to General provider...")
-        result = await general_provider.download(url, client, message, progress_callback, user_manager, video_id, audio, format_id, custom_title, youtube_selection_cache)
-    else:
-        return {"status": "error", "message": "Invalid URL"}
-
-    return result
+async def route(url: str, client, message, progress_callback, user_manager, video_id, audio=False, format_id="bestvideo+bestaudio/best", custom_title=None, youtube_selection_cache=None, use_cache=True, on_file=None, on_batch=None, playlist=None, subtitle_manifest=None, work_dir=None, link=None):
+    # Callers that already resolved the link pass it along, it's parsed only once
+    link = link or resolve(url)
+    provider = get_provider(link)
+    started = time.monotonic()
+    status = "exception"
+    try:
+        if link is None:
+            result = {"status": "error", "message": "Invalid URL"}
+        else:
+            print(f"Routing to {link.provider.name} provider...")
+            result = await link.provider.handler(
+                link,
+                client=client,
+                message=message,
+                progress_callback=progress_callback,
+                user_manager=user_manager,
+                video_id=video_id,
+                audio=audio,
+                format_id=format_id,
+                custom_title=custom_title,
+                youtube_selection_cache=youtube_selection_cache,
+                use_cache=use_cache,
+                on_file=on_file,
+                on_batch=on_batch,
+                playlist=playlist,
+                subtitle_manifest=subtitle_manifest,
+                work_dir=work_dir,
+            )
+        status = result.get("status", "unknown")
+        return result
+    finally:
+        metrics.provider_seconds.observe(time.monotonic() - started, provider=provider)
+        metrics.provider_requests.inc(provider=provider, status=status)
@@ -0,0 +1,45 @@
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """Small in-memory cache where every entry expires after its own TTL."""
+    def __init__(self, ttl, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.data = OrderedDict()  # key -> (expires_at, value), oldest first
+
+    def get(self, key, default=None):
+        entry = self.data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self.data[key]
+            return default
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            self.data.pop(key, None)
+            return
+        self.data.pop(key, None)
+        self.data[key] = (time.time() + ttl, value)
+        self.purge()
+
+    def pop(self, key, default=None):
+        entry = self.data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def purge(self):
+        now = time.time()
+        for key in [k for k, (expires_at, _) in self.data.items() if expires_at <= now]:
+            del self.data[key]
+        while len(self.data) > self.max_entries:
+            self.data.popitem(last=False)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self.data)
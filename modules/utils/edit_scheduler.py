@@ -0,0 +1,131 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+from pyrogram.errors import FloodWait, MessageNotModified
+
+import config
+from modules.utils import metrics
+
+'''
+Single owner of all status-message edits.
+Jobs only hand over the latest text for a message; the scheduler coalesces
+updates per message, spaces edits per message and per chat, keeps a global
+edits-per-second budget and pauses everything when Telegram answers FloodWait,
+so progress updates never pile up into flood limits that stall uploads.
+'''
+
+class EditScheduler:
+    def __init__(self):
+        self.edits_per_second = float(getattr(config, "edits_per_second", 20))
+        self.message_interval = float(getattr(config, "message_edit_interval", 5))
+        self.chat_interval = float(getattr(config, "chat_edit_interval", 1))
+
+        self.pending = OrderedDict()  # (chat_id, msg_id) -> (msg, text, reply_markup, urgent)
+        self.last_text = {}
+        self.last_message_edit = {}
+        self.last_chat_edit = {}
+        self.paused_until = 0
+        self.flood_wait_seconds = 0
+        self.wakeup = None
+        self.task = None
+
+    @staticmethod
+    def _key(msg):
+        return (msg.chat.id, msg.id)
+
+    def update(self, msg, text, reply_markup=None, urgent=False):
+        """
+        Queue an edit. Only the latest text per message is ever sent.
+        Urgent edits (status changes) skip the per-message spacing, not the chat or global limits.
+        """
+        key = self._key(msg)
+        if self.last_text.get(key) == text:
+            self.pending.pop(key, None)
+            return
+        urgent = urgent or (key in self.pending and self.pending[key][3])
+        self.pending[key] = (msg, text, reply_markup, urgent)
+        self._ensure_running()
+        self.wakeup.set()
+
+    async def edit_now(self, msg, text, reply_markup=None):
+        """Edit right away (final states), superseding anything queued for this message."""
+        key = self._key(msg)
+        self.pending.pop(key, None)
+        await self._wait_flood()
+        await self._send(msg, text, reply_markup)
+
+    def forget(self, msg):
+        """Drop everything queued or remembered for a message that is gone."""
+        key = self._key(msg)
+        self.pending.pop(key, None)
+        self.last_text.pop(key, None)
+        self.last_message_edit.pop(key, None)
+
+    def _ensure_running(self):
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self._run())
+
+    async def _wait_flood(self):
+        delay = self.paused_until - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _send(self, msg, text, reply_markup):
+        key = self._key(msg)
+        chat_id = key[0]
+        now = time.time()
+        self.last_message_edit[key] = now
+        self.last_chat_edit[chat_id] = now
+        try:
+            # Status messages can be the animation with a caption
+            if getattr(msg, "media", None):
+                await msg.edit_caption(text, reply_markup=reply_markup)
+            else:
+                await msg.edit_text(text, reply_markup=reply_markup)
+            self.last_text[key] = text
+        except MessageNotModified:
+            self.last_text[key] = text
+        except FloodWait as e:
+            # Back off for everyone and retry this one later
+            wait = int(e.value)
+            self.flood_wait_seconds += wait
+            metrics.floodwait_total.inc(wait)
+            self.paused_until = max(self.paused_until, time.time() + wait)
+            print(f"FloodWait on edit, pausing edits for {wait}s")
+            self.pending.setdefault(key, (msg, text, reply_markup, True))
+            self._ensure_running()
+        except Exception as e:
+            print(f"Edit failed: {e}")
+
+    def _next_due(self, now):
+        """Oldest pending message allowed to be edited now, or how long until one is."""
+        soonest = None
+        for key, (_, _, _, urgent) in self.pending.items():
+            due = self.last_chat_edit.get(key[0], 0) + self.chat_interval
+            if not urgent:
+                due = max(due, self.last_message_edit.get(key, 0) + self.message_interval)
+            if due <= now:
+                return key, 0
+            soonest = due if soonest is None else min(soonest, due)
+        return None, (soonest - now if soonest is not None else None)
+
+    async def _run(self):
+        while True:
+            await self._wait_flood()
+            key, delay = self._next_due(time.time())
+
+            if key is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            msg, text, reply_markup, _ = self.pending.pop(key)
+            await self._send(msg, text, reply_markup)
+            await asyncio.sleep(1 / self.edits_per_second)
+
+edits = EditScheduler()
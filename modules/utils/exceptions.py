@@ -1,3 +1,13 @@
 class DownloadCancelled(Exception):
     def __init__(self, action):
         self.action = action
+
+class QueueFull(Exception):
+    pass
+
+class NotEnoughSpace(Exception):
+    pass
+
+class SentWithoutMessage(Exception):
+    """Telegram took the upload but didn't say which message it became, sending again would post it twice."""
+    pass
@@ -0,0 +1,52 @@
+import asyncio
+
+from modules.utils.edit_scheduler import edits
+
+'''
+Single-flight layer for downloads.
+When several requests resolve to the same media + format, only the first one
+(the leader) runs yt-dlp and uploads. The others attach to it as watchers,
+mirror its progress and get the uploaded file_id once it's done.
+'''
+
+class InflightJob:
+    def __init__(self, key):
+        self.key = key
+        self.watchers = []  # status messages of the attached requests
+        self.result = None  # set by the leader once the file is on Telegram
+        self.error = None   # set by the leader if the job failed for good
+        self.done = asyncio.Event()
+
+    async def wait(self):
+        await self.done.wait()
+        return self.result, self.error
+
+    def broadcast(self, text):
+        for status in self.watchers:
+            edits.update(status, text)
+
+class InflightRegistry:
+    def __init__(self):
+        self.jobs = {}
+
+    def get(self, key):
+        if not key:
+            return None
+        return self.jobs.get(key)
+
+    def start(self, key):
+        job = InflightJob(key)
+        if key:
+            self.jobs[key] = job
+        return job
+
+    def finish(self, job):
+        """
+        Release the watchers. If the leader left neither a result nor an error
+        (cancelled, partial send), they fall back to running their own job.
+        """
+        if self.jobs.get(job.key) is job:
+            del self.jobs[job.key]
+        job.done.set()
+
+inflight = InflightRegistry()
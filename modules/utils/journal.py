@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+
+import config
+
+'''
+Crash-safe journal of running jobs (data/jobs.db).
+A job is written when it starts and removed when it ends, so after a crash or a
+restart the journal holds exactly the jobs that were interrupted. Each entry is the
+same job record the Redis queue carries (url, options, chat, message and status
+message ids), plus the file yt-dlp was writing. main.py resumes them on startup in
+the same job directory, where yt-dlp continues the .part file (or the fragments)
+instead of starting over, and progress goes back to the original status message.
+
+Jobs older than `job_max_age` (the janitor removes their files anyway) and jobs
+interrupted more than `job_max_resumes` times are dropped instead of resumed.
+'''
+
+DB_FILE = "data/jobs.db"
+MAX_AGE = float(getattr(config, "job_max_age", 6 * 3600))
+MAX_RESUMES = int(getattr(config, "job_max_resumes", 2))
+
+class JobJournal:
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self.db = None
+        self.jobs = set()  # ids in the journal, the janitor leaves their directories alone
+        # Writes come from worker threads, one at a time
+        self.lock = threading.Lock()
+
+    def _open(self):
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, job TEXT NOT NULL, part_path TEXT,"
+            " resumes INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self.db.commit()
+        self.jobs = {job_id for job_id, in self.db.execute("SELECT id FROM jobs")}
+
+    def _execute(self, sql, params=()):
+        # Late writes of jobs a shutdown left behind
+        if self.db is None:
+            return []
+        with self.lock, self.db:
+            return self.db.execute(sql, params).fetchall()
+
+    async def open(self):
+        """Load the journal, before the janitor's first sweep."""
+        await asyncio.to_thread(self._open)
+
+    def is_open(self):
+        return self.db is not None
+
+    def ids(self):
+        return self.jobs
+
+    async def add(self, job):
+        self.jobs.add(job["id"])
+        now = time.time()
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO jobs (id, job, created, updated) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(id) DO UPDATE SET job = excluded.job, updated = excluded.updated",
+            (job["id"], json.dumps(job), now, now)
+        )
+
+    async def set_part(self, job_id, path):
+        if job_id in self.jobs:
+            await asyncio.to_thread(self._execute, "UPDATE jobs SET part_path = ?, updated = ? WHERE id = ?", (path, time.time(), job_id))
+
+    async def remove(self, job_id):
+        if job_id in self.jobs:
+            self.jobs.discard(job_id)
+            if self.db is None:
+                print(f"Journal already closed, job {job_id} will run again after the restart")
+                return
+            await asyncio.to_thread(self._execute, "DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    async def interrupted(self):
+        """
+        Jobs a crash or a restart interrupted, each with its `part_path`: ([to resume], [given up on]).
+        Jobs to resume count the attempt, the others leave the journal with the `reason`
+        ("expired" or "resumes") they were given up for.
+        """
+        rows = await asyncio.to_thread(self._execute, "SELECT id, job, part_path, resumes, created FROM jobs")
+        resume = []
+        dropped = []
+        for job_id, record, part_path, resumes, created in rows:
+            job = json.loads(record)
+            job["part_path"] = part_path
+            if time.time() - created > MAX_AGE or resumes >= MAX_RESUMES:
+                job["reason"] = "expired" if time.time() - created > MAX_AGE else "resumes"
+                dropped.append(job)
+                await self.remove(job_id)
+                continue
+            resume.append(job)
+            await asyncio.to_thread(self._execute, "UPDATE jobs SET resumes = resumes + 1 WHERE id = ?", (job_id,))
+        return resume, dropped
+
+    def close(self):
+        if self.db:
+            self.db.close()
+            self.db = None
+
+journal = JobJournal()
@@ -1,23 +1,52 @@
+import asyncio
 import datetime
 import config
 from pyrogram import Client, types
 from modules.utils.basic import BasicUtils
 
-BasicUtils.ensure_directory_exists("data/logs")
-LOG_FILE = "data/logs/log.txt"
+'''
+Queue-backed logging.
+`log()` only formats the entry and queues it, a background task does the I/O:
+local lines are appended to the log file in batches off the event loop, and
+Telegram entries are collected into one digest message per interval instead of
+a send_message per event (errors cut the wait short).
+'''
+
+LOG_DIR = "data/logs"
+LOG_FILE = f"{LOG_DIR}/log.txt"
+# Telegram's message length limit
+MAX_MESSAGE_LENGTH = 4096
+
+FLUSH_INTERVAL = float(getattr(config, "log_flush_interval", 1))
+DIGEST_INTERVAL = float(getattr(config, "log_digest_interval", 30))
+# None sends every level to the channel
+TELEGRAM_LEVELS = getattr(config, "log_telegram_levels", None)
+URGENT_LEVELS = {"ERROR"}
+MAX_PENDING = 1000
+
+local_queue = []
+telegram_queue = []
+telegram_dropped = 0
+telegram_urgent = False
+log_app = None
+flush_task = None
 
 async def log(app: Client, message: types.Message = None, text: str = "", level: str = "INFO"):
     """
     Central logging function.
-    Triggers local file logging and Telegram channel logging.
+    Queues the entry for local file logging and the Telegram digest, never waits on either.
 
     :param app: Pyrogram Client instance
     :param message: Pyrogram Message object (optional context)
     :param text: The log message
     :param level: Log level (INFO, ERROR, WARNING, SUCCESS)
     """
+    global log_app
+    if isinstance(app, Client):
+        log_app = app
     log_local(message, text, level)
-    await log_telegram(app, message, text, level)
+    log_telegram(message, text, level)
+    ensure_flusher()
 
 def log_local(message, text, level):
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -32,19 +61,16 @@ def log_local(message, text, level):
         except Exception:
             pass
 
-    try:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(entry + "\n")
-    except Exception as e:
-        print(f"Local log error: {e}")
+    local_queue.append(entry + "\n")
 
-async def log_telegram(app: Client, message: types.Message, text: str, level: str):
-    logs_id = getattr(config, 'logs_id', None)
-    if not logs_id:
-        # print("DEBUG: No logs_id found in config")
+def log_telegram(message: types.Message, text: str, level: str):
+    global telegram_dropped, telegram_urgent
+    if not getattr(config, 'logs_id', None):
+        return
+    if TELEGRAM_LEVELS is not None and level not in TELEGRAM_LEVELS:
         return
 
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    timestamp = datetime.datetime.now().strftime("%H:%M:%S")
 
     # Emoji for levels
     emoji = "ℹ️"
@@ -52,7 +78,7 @@ async def log_telegram(app: Client, message: types.Message, text: str, level: st
     elif level == "SUCCESS": emoji = "✅"
     elif level == "ERROR": emoji = "❌"
 
-    msg = f"{emoji} **{level}**\n`{timestamp}`\n\n{text}"
+    msg = f"{emoji} **{level}** `{timestamp}`\n{text}"
 
     if message:
         try:
@@ -60,15 +86,97 @@ async def log_telegram(app: Client, message: types.Message, text: str, level: st
             chat = message.chat
 
             if user:
-                msg += f"\n\n👤 **User:** {user.mention} (`{user.id}`)"
-            if chat:
+                msg += f"\n👤 {user.mention} (`{user.id}`)"
+            if chat and (not user or chat.id != user.id):
                 title = chat.title or chat.first_name or "Unknown"
-                msg += f"\n📢 **Chat:** {title} (`{chat.id}`)"
+                msg += f" 📢 {title} (`{chat.id}`)"
         except Exception:
             pass
 
+    telegram_queue.append(msg[:MAX_MESSAGE_LENGTH - 100])
+    if len(telegram_queue) > MAX_PENDING:
+        # The channel is only a digest, keep memory bounded if Telegram is unreachable
+        del telegram_queue[0]
+        telegram_dropped += 1
+    if level in URGENT_LEVELS:
+        telegram_urgent = True
+
+def ensure_flusher():
+    global flush_task
+    if flush_task is None or flush_task.done():
+        try:
+            flush_task = asyncio.get_running_loop().create_task(run_flusher())
+        except RuntimeError:
+            # No loop (called from a script), written on the next log() inside one
+            pass
+
+def write_lines(lines):
+    # Created on the first write rather than at import
+    BasicUtils.ensure_directory_exists(LOG_DIR)
+    with open(LOG_FILE, "a", encoding="utf-8") as f:
+        f.writelines(lines)
+
+async def flush_local():
+    if not local_queue:
+        return
+    lines = local_queue[:]
+    del local_queue[:len(lines)]
     try:
-        print(f"DEBUG: Attempting to send log to {logs_id}")
-        await app.send_message(logs_id, msg, disable_web_page_preview=True)
+        await asyncio.to_thread(write_lines, lines)
     except Exception as e:
-        print(f"Telegram log error: {e} (Chat ID: {logs_id})")
+        print(f"Local log error: {e}")
+
+def build_digests(entries, dropped=0):
+    """Pack entries into as few messages as fit the length limit."""
+    header = f"🗒 **Log digest** ({len(entries)} events)"
+    if dropped:
+        header += f", {dropped} dropped"
+    digests = []
+    current = header
+    for entry in entries:
+        if len(current) + len(entry) + 2 > MAX_MESSAGE_LENGTH:
+            digests.append(current)
+            current = entry
+        else:
+            current += "\n\n" + entry
+    digests.append(current)
+    return digests
+
+async def flush_telegram():
+    global telegram_dropped, telegram_urgent
+    logs_id = getattr(config, 'logs_id', None)
+    telegram_urgent = False
+    if not telegram_queue or not logs_id or log_app is None:
+        return
+    entries = telegram_queue[:]
+    del telegram_queue[:len(entries)]
+    dropped, telegram_dropped = telegram_dropped, 0
+
+    for digest in build_digests(entries, dropped):
+        try:
+            await log_app.send_message(logs_id, digest, disable_web_page_preview=True)
+        except Exception as e:
+            print(f"Telegram log error: {e} (Chat ID: {logs_id})")
+
+async def run_flusher():
+    last_digest = asyncio.get_running_loop().time()
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        await flush_local()
+        now = asyncio.get_running_loop().time()
+        if telegram_urgent or now - last_digest >= DIGEST_INTERVAL:
+            last_digest = now
+            await flush_telegram()
+
+async def close():
+    """Stop the background task and write out everything still queued."""
+    global flush_task
+    if flush_task:
+        flush_task.cancel()
+        try:
+            await flush_task
+        except asyncio.CancelledError:
+            pass
+        flush_task = None
+    await flush_local()
+    await flush_telegram()
@@ -0,0 +1,119 @@
+import json
+import os
+import time
+import asyncio
+
+import config
+
+DATA_FILE = "data/media_cache.json"
+
+class MediaCache:
+    """
+    Persistent map of already-sent media to the Telegram file_id it was uploaded as.
+    Keys look like `extractor:id:format:mode`, so the same video in another
+    quality or as audio is cached separately. Changes are written out in batches,
+    at most every `media_cache_flush_interval` seconds and off the event loop.
+    """
+    def __init__(self):
+        self.max_entries = int(getattr(config, "media_cache_max_entries", 50000))
+        self.flush_interval = float(getattr(config, "media_cache_flush_interval", 2))
+        self._data = None
+        self.dirty = False
+        self.task = None
+
+    @property
+    def data(self):
+        # Read on first use instead of at import, see preload()
+        if self._data is None:
+            self._data = self.load_data()
+        return self._data
+
+    async def preload(self):
+        """Read the file off the event loop, so the first lookup doesn't have to."""
+        await asyncio.to_thread(lambda: self.data)
+
+    def load_data(self):
+        if os.path.exists(DATA_FILE):
+            try:
+                with open(DATA_FILE, "r") as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"Error loading media cache: {e}")
+        return {}
+
+    def save_data(self, data):
+        try:
+            if not os.path.exists(os.path.dirname(DATA_FILE)):
+                os.makedirs(os.path.dirname(DATA_FILE))
+            tmp_file = f"{DATA_FILE}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_file, DATA_FILE)
+            return True
+        except Exception as e:
+            print(f"Error saving media cache: {e}")
+            return False
+
+    def mark_dirty(self):
+        self.dirty = True
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        # Changes made while a write is running go out in the next round
+        while self.dirty:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        # Entries are replaced, never changed in place, a shallow copy is a consistent snapshot
+        if not await asyncio.to_thread(self.save_data, dict(self.data)):
+            self.dirty = True
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    @staticmethod
+    def make_key(info, audio=False):
+        """Build the cache key from a yt-dlp info_dict with a resolved format."""
+        if not info:
+            return None
+        extractor = info.get('extractor_key') or info.get('extractor')
+        media_id = info.get('id')
+        format_id = info.get('format_id')
+        if not extractor or not media_id or not format_id:
+            return None
+        mode = "audio" if audio else "video"
+        return f"{extractor.lower()}:{media_id}:{format_id}:{mode}"
+
+    def get(self, key):
+        if not key:
+            return None
+        return self.data.get(key)
+
+    def set(self, key, file_id, media_type, **meta):
+        if not key or not file_id:
+            return
+        # Re-insert so the dict order doubles as an LRU-ish eviction order
+        self.data.pop(key, None)
+        self.data[key] = {"file_id": file_id, "type": media_type, "time": int(time.time()), **meta}
+        while len(self.data) > self.max_entries:
+            self.data.pop(next(iter(self.data)))
+        self.mark_dirty()
+
+    def delete(self, key):
+        if key and self.data.pop(key, None) is not None:
+            self.mark_dirty()
+
+# Create a singleton instance
+media_cache = MediaCache()
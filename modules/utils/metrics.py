@@ -0,0 +1,282 @@
+import time
+import asyncio
+from collections import deque
+
+import config
+
+'''
+Metrics in the Prometheus text format.
+Everything is plain counters, gauges and histograms in one registry, rendered on
+scrape by MetricsServer (GET /metrics, 127.0.0.1:9464 by default). The server only
+runs with `metrics_enabled = True`. Values that are cheap to read but live elsewhere
+(scheduler queue, disk usage, FloodWait pause) are filled in by collectors
+registered with `registry.add_collector()` right before rendering. Nothing here is locked, update metrics from the event loop only.
+
+Stages (histogram `ytdl_stage_seconds`, labels stage and provider):
+queue, extract, download, merge, postprocess, subtitles, upload.
+'''
+
+METRICS_ENABLED = getattr(config, "metrics_enabled", False)
+METRICS_HOST = getattr(config, "metrics_host", "127.0.0.1")
+METRICS_PORT = int(getattr(config, "metrics_port", 9464))
+
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# Seconds the bytes/s gauges average over
+RATE_WINDOW = 10
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values = {}  # label values -> value
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self):
+        for key, value in list(self.values.items()):
+            yield self.name, key, None, value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, key, extra, value in self.samples():
+            lines.append(f"{name}{format_labels(self.label_names, key, extra)} {format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        state = self.values.get(key)
+        if state is None:
+            # [per-bucket counts (not cumulative), sum, count]
+            state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][i] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def samples(self):
+        for key, (counts, total, count) in list(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield f"{self.name}_bucket", key, [("le", format_value(bound))], cumulative
+            yield f"{self.name}_sum", key, None, total
+            yield f"{self.name}_count", key, None, count
+
+class Timer:
+    """`with histogram.time(**labels):` observes how long the block took."""
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.start, **self.labels)
+
+class Rate:
+    """Bytes per second over the last RATE_WINDOW seconds, one bucket per second."""
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        self.buckets = deque()  # [second, bytes]
+
+    def add(self, amount):
+        now = int(time.monotonic())
+        if self.buckets and self.buckets[-1][0] == now:
+            self.buckets[-1][1] += amount
+        else:
+            self.buckets.append([now, amount])
+        self._trim(now)
+
+    def _trim(self, now):
+        while self.buckets and self.buckets[0][0] <= now - self.window:
+            self.buckets.popleft()
+
+    def value(self):
+        self._trim(int(time.monotonic()))
+        return sum(amount for _, amount in self.buckets) / self.window
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, collector):
+        """collector() runs before every scrape, sync or async."""
+        self.collectors.append(collector)
+
+    async def collect(self):
+        for collector in self.collectors:
+            try:
+                result = collector()
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+registry = Registry()
+
+jobs = registry.counter("ytdl_jobs_total", "Download jobs by provider and how they ended", ("provider", "outcome"))
+stage_seconds = registry.histogram("ytdl_stage_seconds", "Time spent per job stage", ("stage", "provider"))
+provider_requests = registry.counter("ytdl_provider_requests_total", "route() calls by provider and result status", ("provider", "status"))
+provider_seconds = registry.histogram("ytdl_provider_seconds", "Time spent in the provider per route() call", ("provider",))
+transferred = registry.counter("ytdl_transferred_bytes_total", "Bytes downloaded and uploaded", ("direction",))
+throughput = registry.gauge("ytdl_throughput_bytes_per_second", f"Bytes per second over the last {RATE_WINDOW}s", ("direction",))
+active_jobs = registry.gauge("ytdl_active_jobs", "Jobs holding a scheduler slot")
+queued_jobs = registry.gauge("ytdl_queued_jobs", "Jobs waiting for a scheduler slot")
+disk_usage = registry.gauge("ytdl_work_dir_bytes", "Disk used by job work directories")
+floodwait_total = registry.counter("ytdl_floodwait_seconds_total", "Seconds Telegram asked us to wait (FloodWait)")
+floodwait_pause = registry.gauge("ytdl_floodwait_pause_seconds", "Seconds left in the current FloodWait pause")
+
+rates = {"down": Rate(), "up": Rate()}
+
+def add_bytes(direction, amount):
+    if amount > 0:
+        transferred.inc(amount, direction=direction)
+        rates[direction].add(amount)
+
+def collect_rates():
+    for direction, rate in rates.items():
+        throughput.set(rate.value(), direction=direction)
+
+registry.add_collector(collect_rates)
+
+class StageTimer:
+    """Per-job stage clock, entering a stage closes the previous one."""
+    def __init__(self, provider):
+        self.provider = provider
+        self.stage = None
+        self.since = None
+        # Set by the job on success, cancel, ...; anything else ended in an error
+        self.outcome = "error"
+
+    def enter(self, stage):
+        if stage == self.stage:
+            return
+        now = time.monotonic()
+        if self.stage:
+            stage_seconds.observe(now - self.since, stage=self.stage, provider=self.provider)
+        self.stage = stage
+        self.since = now
+
+    def close(self):
+        self.enter(None)
+        jobs.inc(provider=self.provider, outcome=self.outcome)
+
+class TransferCounter:
+    """Turns running totals (progress callbacks) into byte increments."""
+    def __init__(self, direction):
+        self.direction = direction
+        self.last = 0
+
+    def update(self, current):
+        # Totals restart for every file (video, then audio)
+        add_bytes(self.direction, current - self.last if current >= self.last else current)
+        self.last = current
+
+class MetricsServer:
+    def __init__(self):
+        self.server = None
+
+    async def start(self, host=METRICS_HOST, port=METRICS_PORT):
+        try:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        except OSError as e:
+            print(f"Metrics endpoint could not start on {host}:{port}: {e}")
+            return None
+        print(f"Metrics on http://{host}:{port}/metrics")
+        return self.server
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+            parts = head.decode("latin-1").split("\r\n", 1)[0].split(" ")
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                await registry.collect()
+                status, body = "200 OK", registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+metrics_server = MetricsServer()
@@ -0,0 +1,63 @@
+import time
+import asyncio
+
+import config
+
+'''
+Shared per-domain request pacing.
+Each domain gets a token bucket: `burst` requests go out right away, after that
+requests are spaced to `rate` per second. An idle domain refills its bucket, so
+a lone request never waits; only bursts of concurrent jobs get slowed down.
+Waiters are served in arrival order.
+'''
+
+# domain -> (requests per second, burst)
+DEFAULT_PACING = {"instagram.com": (0.5, 3)}
+
+class DomainBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+class DomainPacer:
+    def __init__(self):
+        self.pacing = dict(getattr(config, "domain_pacing", DEFAULT_PACING))
+        self.buckets = {}
+        self.waits = 0  # requests that had to be delayed, for monitoring
+
+    def _bucket(self, domain):
+        bucket = self.buckets.get(domain)
+        if bucket is None:
+            rate, burst = self.pacing.get(domain, (None, None))
+            if not rate:
+                return None
+            bucket = self.buckets[domain] = DomainBucket(rate, burst)
+        return bucket
+
+    async def wait(self, domain):
+        """Wait until a request to domain may go out. Unconfigured domains never wait."""
+        bucket = self._bucket(domain)
+        if bucket is None:
+            return
+        started = time.monotonic()
+        await bucket.acquire()
+        if time.monotonic() - started > 0.01:
+            self.waits += 1
+
+pacer = DomainPacer()
@@ -0,0 +1,102 @@
+import os
+import fcntl
+import asyncio
+
+'''
+"Send Partial" support.
+The progress hook only records which file was being written and stops the download,
+everything else runs here, off yt-dlp's thread:
+1. snapshot the bytes downloaded so far without copying them when possible
+   (hardlink, then a reflink on CoW filesystems, then a copy bounded to the current size)
+2. remux the snapshot with ffmpeg (stream copy, moov moved to the front) so Telegram
+   gets a playable MP4, falling back to the raw snapshot if ffmpeg can't read it.
+'''
+
+# ioctl(FICLONE), clones a whole file on btrfs/xfs/... without copying data
+FICLONE = 0x40049409
+COPY_CHUNK = 8 * 1024 * 1024
+
+def find_source(d):
+    """File yt-dlp was writing when the progress dict d was reported."""
+    for path in (d.get('tmpfilename'), d.get('filename')):
+        if not path:
+            continue
+        if os.path.exists(path):
+            return path
+        # Sometimes the file on disk has a .part extension
+        if os.path.exists(path + ".part"):
+            return path + ".part"
+    return None
+
+def reflink(src, dst):
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+def bounded_copy(src, dst):
+    """Copy only the bytes present right now, even if the file is still growing."""
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        remaining = os.fstat(s.fileno()).st_size
+        offset = 0
+        while remaining > 0:
+            try:
+                copied = os.copy_file_range(s.fileno(), d.fileno(), min(COPY_CHUNK, remaining), offset, offset)
+            except (AttributeError, OSError):
+                copied = d.write(os.pread(s.fileno(), min(COPY_CHUNK, remaining), offset))
+            if not copied:
+                break
+            offset += copied
+            remaining -= copied
+
+def snapshot(src, dst):
+    """Freeze src at dst, returns how it was done."""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        pass
+    try:
+        reflink(src, dst)
+        return "reflink"
+    except OSError:
+        pass
+    bounded_copy(src, dst)
+    return "copy"
+
+async def remux(src, dst):
+    """Stream-copy src into a faststart MP4 at dst. True on success."""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-y", "-v", "error", "-i", src,
+            "-map", "0", "-c", "copy", "-movflags", "+faststart", dst,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+        )
+    except FileNotFoundError:
+        return False
+    _, stderr = await process.communicate()
+    if process.returncode != 0 or not os.path.exists(dst) or not os.path.getsize(dst):
+        print(f"Partial remux failed: {stderr.decode(errors='replace').strip()[-300:]}")
+        return False
+    return True
+
+async def prepare_partial(src, output_folder, video_id):
+    """
+    Turn what has been downloaded of src into a sendable file.
+    Returns its path, or None if there is nothing to send.
+    """
+    if not src or not os.path.exists(src):
+        return None
+    ext = os.path.splitext(src[:-5] if src.endswith(".part") else src)[1] or ".mp4"
+    raw_path = os.path.join(output_folder, f"{video_id}_partial_raw{ext}")
+    final_path = os.path.join(output_folder, f"{video_id}_partial.mp4")
+
+    method = await asyncio.to_thread(snapshot, src, raw_path)
+    print(f"Partial snapshot of {src} via {method}")
+
+    if await remux(raw_path, final_path):
+        os.remove(raw_path)
+        return final_path
+    if os.path.exists(final_path):
+        os.remove(final_path)
+    return raw_path
@@ -0,0 +1,28 @@
+import time
+
+'''
+Hands progress from yt-dlp's hook thread to the event loop.
+The hook asks `due(status)` first, so the common case (a chunk arrived, nothing
+to report yet) is one comparison and a clock read. Status changes
+(downloading -> merging -> postprocessing) are always due.
+'''
+
+class ProgressPublisher:
+    def __init__(self, loop, callback, interval=1.0):
+        self.loop = loop
+        self.callback = callback  # callback(status, fields), runs on the loop
+        self.interval = interval
+        self.last_status = None
+        self.last_time = 0
+
+    def due(self, status):
+        return status != self.last_status or time.monotonic() - self.last_time >= self.interval
+
+    def push(self, status, fields=None):
+        self.last_status = status
+        self.last_time = time.monotonic()
+        self.loop.call_soon_threadsafe(self.callback, status, fields or {})
+
+    def publish(self, status, fields=None):
+        if self.due(status):
+            self.push(status, fields)
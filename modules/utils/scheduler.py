@@ -0,0 +1,153 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+
+import config
+from modules.utils.exceptions import DownloadCancelled, QueueFull
+
+'''
+Admission control for download jobs.
+Caps how many jobs run at once globally, per user and per provider, and hands
+free slots out round-robin across users so one user pasting 40 links can't
+starve everyone else.
+'''
+
+DEFAULT_PROVIDER_LIMITS = {
+    "spotify": 2,
+    "instagram": 4,
+}
+
+class JobTicket:
+    def __init__(self, user_id, provider):
+        self.user_id = user_id
+        self.provider = provider
+        self.future = asyncio.get_running_loop().create_future()
+        self.granted = False
+        self.released = False
+        self.started = None
+        self.on_position = None
+        self.last_position = None
+
+class JobScheduler:
+    def __init__(self):
+        self.max_global = int(getattr(config, "max_concurrent_jobs", 8))
+        self.max_per_user = int(getattr(config, "max_jobs_per_user", 2))
+        self.max_queued_per_user = int(getattr(config, "max_queued_per_user", 20))
+        self.max_per_provider = {**DEFAULT_PROVIDER_LIMITS, **getattr(config, "max_jobs_per_provider", {})}
+
+        # user_id -> waiting tickets, dict order is the round-robin order
+        self.queues = OrderedDict()
+        self.running = 0
+        self.running_per_user = {}
+        self.running_per_provider = {}
+        # Moving average of how long a slot is held, used for the ETA
+        self.avg_duration = 60.0
+
+    @property
+    def queued(self):
+        return sum(len(q) for q in self.queues.values())
+
+    def submit(self, user_id, provider):
+        queue = self.queues.get(user_id)
+        if queue is not None and len(queue) >= self.max_queued_per_user:
+            raise QueueFull(f"You already have {len(queue)} links waiting, try again once some finish.")
+
+        ticket = JobTicket(user_id, provider)
+        self.queues.setdefault(user_id, deque()).append(ticket)
+        self._dispatch()
+        return ticket
+
+    async def wait(self, ticket, on_position=None):
+        """Wait for a slot. on_position(position, eta_seconds) is called whenever the place in line changes."""
+        ticket.on_position = on_position
+        if not ticket.granted:
+            self._notify_positions()
+        await ticket.future
+
+    def release(self, ticket):
+        if ticket.released:
+            return
+        ticket.released = True
+
+        if not ticket.granted:
+            self._remove_waiting(ticket)
+            if not ticket.future.done():
+                ticket.future.set_exception(DownloadCancelled("del"))
+                # Nobody may be awaiting it anymore
+                ticket.future.exception()
+        else:
+            self.running -= 1
+            self.running_per_user[ticket.user_id] -= 1
+            if not self.running_per_user[ticket.user_id]:
+                del self.running_per_user[ticket.user_id]
+            self.running_per_provider[ticket.provider] -= 1
+
+            duration = time.time() - ticket.started
+            self.avg_duration = self.avg_duration * 0.8 + duration * 0.2
+
+        self._dispatch()
+
+    # Cancelling a waiting ticket is the same as releasing it
+    cancel = release
+
+    def _provider_limit(self, provider):
+        return int(self.max_per_provider.get(provider, self.max_global))
+
+    def _can_run(self, ticket):
+        return (
+            self.running_per_user.get(ticket.user_id, 0) < self.max_per_user
+            and self.running_per_provider.get(ticket.provider, 0) < self._provider_limit(ticket.provider)
+        )
+
+    def _remove_waiting(self, ticket):
+        queue = self.queues.get(ticket.user_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self.queues[ticket.user_id]
+
+    def _grant(self, ticket):
+        self._remove_waiting(ticket)
+        ticket.granted = True
+        ticket.started = time.time()
+        self.running += 1
+        self.running_per_user[ticket.user_id] = self.running_per_user.get(ticket.user_id, 0) + 1
+        self.running_per_provider[ticket.provider] = self.running_per_provider.get(ticket.provider, 0) + 1
+        if not ticket.future.done():
+            ticket.future.set_result(True)
+
+    def _dispatch(self):
+        granted = True
+        while granted and self.running < self.max_global:
+            granted = False
+            for user_id in list(self.queues):
+                ticket = next((t for t in self.queues[user_id] if self._can_run(t)), None)
+                if ticket:
+                    self._grant(ticket)
+                    # Served, go to the back of the line
+                    if user_id in self.queues:
+                        self.queues.move_to_end(user_id)
+                    granted = True
+                    break
+        self._notify_positions()
+
+    def _notify_positions(self):
+        # Interleave the per-user queues the same way _dispatch serves them
+        queues = [list(q) for q in self.queues.values()]
+        position = 0
+        for depth in range(max((len(q) for q in queues), default=0)):
+            for queue in queues:
+                if depth >= len(queue):
+                    continue
+                position += 1
+                ticket = queue[depth]
+                if ticket.on_position and ticket.last_position != position:
+                    ticket.last_position = position
+                    eta = math.ceil(position / self.max_global) * self.avg_duration
+                    try:
+                        ticket.on_position(position, eta)
+                    except Exception as e:
+                        print(f"Error in queue position callback: {e}")
+
+scheduler = JobScheduler()
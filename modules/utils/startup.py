@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import builtins
+
+'''
+Startup profiling for `python main.py --profile-startup`.
+install() runs before main.py imports anything else and wraps __import__ to time
+every module imported for the first time. mark() records startup phases (no-op
+unless profiling), report() prints the slowest imports and the phase timeline, and
+the first incoming update is reported too, so restart-to-first-reply is measurable.
+Times count from process start when /proc is available, else from install().
+'''
+
+enabled = False
+started = None
+imports = []  # (seconds including nested imports, depth, module)
+phases = []   # (name, seconds since start)
+depth = 0
+first_update_seen = False
+
+def process_start():
+    """Wall-clock start of this process, from /proc, or None."""
+    try:
+        with open("/proc/self/stat") as f:
+            # The command name can contain spaces, fields are counted after it
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/stat") as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith("btime"))
+        return boot_time + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, StopIteration):
+        return None
+
+def install():
+    global enabled, started
+    enabled = True
+    started = process_start() or time.time()
+    phases.append(("interpreter ready", time.time() - started))
+    original = builtins.__import__
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        global depth
+        if level or name in sys.modules:
+            return original(name, globals, locals, fromlist, level)
+        depth += 1
+        t = time.perf_counter()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            depth -= 1
+            imports.append((time.perf_counter() - t, depth, name))
+
+    builtins.__import__ = timed_import
+
+def mark(phase):
+    if enabled:
+        phases.append((phase, time.time() - started))
+
+def first_update():
+    global first_update_seen
+    if enabled and not first_update_seen:
+        first_update_seen = True
+        print(f"[startup] first update {time.time() - started:.3f}s after process start")
+
+def report(limit=20):
+    if not enabled:
+        return
+    print("[startup] slowest imports from main.py (including what they import):")
+    for seconds, _, name in sorted((i for i in imports if i[1] == 0), reverse=True)[:limit]:
+        print(f"[startup]   {seconds * 1000:8.1f} ms  {name}")
+    print("[startup] slowest modules overall:")
+    for seconds, _, name in sorted(imports, reverse=True)[:limit]:
+        print(f"[startup]   {seconds * 1000:8.1f} ms  {name}")
+    print("[startup] phases (seconds since process start):")
+    for phase, seconds in phases:
+        print(f"[startup]   {seconds:8.3f}  {phase}")
@@ -0,0 +1,200 @@
+import os
+import math
+import asyncio
+
+from pyrogram import raw, types, utils
+from pyrogram.errors import FilePartMissing
+from pyrogram.session import Session
+
+from modules.utils.exceptions import SentWithoutMessage
+
+'''
+Upload a file to Telegram while yt-dlp is still writing it.
+
+Only used for single-file progressive downloads whose final size is known up front
+(Content-Length), since MTProto big-file uploads need the part count in every call.
+The file is opened once while it's still `.part`, the open descriptor survives
+yt-dlp renaming it at the end. If the finished file turns out to be a different
+file (a fixup rewrote it) or has another size, the caller falls back to a normal upload.
+'''
+
+PART_SIZE = 512 * 1024
+# Below this a normal upload is about as fast, and Telegram wants the md5 small-file path
+MIN_STREAM_SIZE = 10 * 1024 * 1024
+WORKERS = 4
+POLL_INTERVAL = 0.25
+
+def can_stream(d):
+    """Whether a yt-dlp progress dict describes a download we can upload while it runs."""
+    info = d.get('info_dict') or {}
+    total = d.get('total_bytes')
+    return bool(
+        d.get('status') == 'downloading'
+        and total and total >= MIN_STREAM_SIZE
+        # Merged formats are only complete after ffmpeg runs
+        and not info.get('requested_formats')
+        and info.get('protocol') in ('http', 'https')
+        and info.get('ext') == 'mp4'
+        and d.get('tmpfilename') and os.path.exists(d['tmpfilename'])
+    )
+
+class StreamingUpload:
+    def __init__(self, client, path, total_size, progress=None):
+        self.client = client
+        self.path = path
+        self.total_size = total_size
+        self.total_parts = math.ceil(total_size / PART_SIZE)
+        self.progress = progress
+        self.file_id = client.rnd_id()
+        self.fd = os.open(path, os.O_RDONLY)
+        self.download_finished = False
+        self.task = None
+        self.session = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def finish(self):
+        """Tell the uploader no more bytes are coming."""
+        self.download_finished = True
+
+    def matches(self, final_path):
+        """True if final_path is the exact file we have been uploading."""
+        try:
+            final = os.stat(final_path)
+            current = os.fstat(self.fd)
+        except OSError:
+            return False
+        return final.st_ino == current.st_ino and final.st_dev == current.st_dev and final.st_size == self.total_size
+
+    async def result(self):
+        return await self.task
+
+    def abort(self):
+        if self.task and not self.task.done():
+            # _run stops the session on its way out
+            self.task.cancel()
+        elif self.session:
+            asyncio.create_task(self._stop_session())
+        self._close()
+
+    async def _stop_session(self):
+        session, self.session = self.session, None
+        if session:
+            try:
+                await session.stop()
+            except Exception:
+                pass
+
+    def _close(self):
+        if self.fd is not None:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+            self.fd = None
+
+    async def _wait_for(self, size):
+        while os.fstat(self.fd).st_size < size:
+            if self.download_finished:
+                raise Exception("Download ended before the expected size was written")
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def _part(self, part):
+        return raw.functions.upload.SaveBigFilePart(
+            file_id=self.file_id,
+            file_part=part,
+            file_total_parts=self.total_parts,
+            bytes=os.pread(self.fd, PART_SIZE, part * PART_SIZE)
+        )
+
+    async def _run(self):
+        client = self.client
+        self.session = Session(
+            client, await client.storage.dc_id(), await client.storage.auth_key(),
+            await client.storage.test_mode(), is_media=True
+        )
+        queue = asyncio.Queue(WORKERS)
+
+        async def worker():
+            while True:
+                rpc = await queue.get()
+                if rpc is None:
+                    return
+                try:
+                    await self.session.invoke(rpc)
+                except Exception as e:
+                    # Telegram answers FilePartMissing on send, the part is retried there
+                    print(f"Streaming upload part {rpc.file_part} failed: {e}")
+
+        workers = [asyncio.create_task(worker()) for _ in range(WORKERS)]
+        try:
+            await self.session.start()
+            for part in range(self.total_parts):
+                await self._wait_for(min((part + 1) * PART_SIZE, self.total_size))
+                await queue.put(await asyncio.to_thread(self._part, part))
+                if self.progress:
+                    await self.progress(min((part + 1) * PART_SIZE, self.total_size), self.total_size)
+        except BaseException:
+            for w in workers:
+                w.cancel()
+            await self._stop_session()
+            raise
+        else:
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        return raw.types.InputFileBig(id=self.file_id, parts=self.total_parts, name=os.path.basename(self.path))
+
+    async def send_video(self, message, caption, file_name, width=0, height=0, duration=0):
+        """Send the uploaded parts as a reply video, same as Message.reply_video would."""
+        client = self.client
+        input_file = await self.result()
+        media = raw.types.InputMediaUploadedDocument(
+            mime_type="video/mp4",
+            file=input_file,
+            attributes=[
+                raw.types.DocumentAttributeVideo(supports_streaming=True, duration=duration, w=width, h=height),
+                raw.types.DocumentAttributeFilename(file_name=file_name)
+            ]
+        )
+
+        try:
+            # Only a part Telegram says is missing sends again, anything it accepted is final
+            while True:
+                try:
+                    r = await client.invoke(
+                        raw.functions.messages.SendMedia(
+                            peer=await client.resolve_peer(message.chat.id),
+                            media=media,
+                            reply_to_msg_id=message.id,
+                            random_id=client.rnd_id(),
+                            **await utils.parse_text_entities(client, caption, None, None)
+                        )
+                    )
+                except FilePartMissing as e:
+                    await self.session.invoke(self._part(e.value))
+                else:
+                    return await self._sent_message(message, r)
+        finally:
+            await self._stop_session()
+            self._close()
+
+    async def _sent_message(self, message, r):
+        """The Message a SendMedia answer describes, Telegram sometimes only gives its id."""
+        client = self.client
+        if isinstance(r, raw.types.UpdateShortSentMessage):
+            return await client.get_messages(message.chat.id, r.id)
+        updates = getattr(r, "updates", [])
+        for update in updates:
+            if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+                return await types.Message._parse(
+                    client, update.message,
+                    {u.id: u for u in r.users},
+                    {c.id: c for c in r.chats}
+                )
+        for update in updates:
+            if isinstance(update, raw.types.UpdateMessageID):
+                return await client.get_messages(message.chat.id, update.id)
+        raise SentWithoutMessage("Telegram accepted the video without returning the message")
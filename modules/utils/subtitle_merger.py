@@ -0,0 +1,64 @@
+import os
+import json
+import time
+import importlib
+
+from yt_dlp.postprocessor import FFmpegMergerPP
+from yt_dlp.postprocessor.ffmpeg import FFmpegPostProcessorError
+
+from modules.utils.subtitles import subtitle_args
+
+'''
+yt-dlp's merger with subtitles.
+SubtitleMergerPP waits for the manifest SubtitleFetch writes (ydl param
+`subtitle_manifest`) and adds the subtitles to the video+audio merge. Kept apart
+from subtitles.py because it subclasses yt-dlp, so only code already running
+yt-dlp (ytdlp_runner) imports it.
+'''
+
+# Seconds the merger waits for subtitles that are still downloading
+MANIFEST_WAIT = 20
+
+def load_manifest(path, wait=MANIFEST_WAIT):
+    deadline = time.time() + wait
+    while not os.path.exists(path):
+        if time.time() >= deadline:
+            print("Subtitles not ready in time, merging without them")
+            return []
+        time.sleep(0.2)
+    with open(path, "r") as f:
+        return json.load(f)
+
+class SubtitleMergerPP(FFmpegMergerPP):
+    """FFmpegMergerPP that also muxes the subtitles listed in the `subtitle_manifest` param."""
+    subs = None
+
+    def _merge(self, info):
+        # The unwrapped parent run, this run() already reports started/finished to the hooks
+        return FFmpegMergerPP.run.__wrapped__(self, info)
+
+    def run(self, info):
+        manifest = self._downloader.params.get('subtitle_manifest') if self._downloader else None
+        self.subs = load_manifest(manifest) if manifest else None
+        if not self.subs:
+            return self._merge(info)
+        try:
+            result = self._merge(info)
+        except FFmpegPostProcessorError as e:
+            # Leave the subtitles to embed_subtitles rather than losing the whole download
+            self.report_warning(f"Merging with subtitles failed, merging without them: {e}")
+            self.subs = None
+            return self._merge(info)
+        open(manifest + ".merged", "w").close()
+        return result
+
+    def run_ffmpeg_multiple_files(self, input_paths, out_path, opts, **kwargs):
+        if self.subs:
+            opts = list(opts) + subtitle_args(self.subs, len(input_paths), out_path)
+            input_paths = list(input_paths) + [sub['path'] for sub in self.subs]
+        return super().run_ffmpeg_multiple_files(input_paths, out_path, opts, **kwargs)
+
+def install_subtitle_merger():
+    """Make yt-dlp use SubtitleMergerPP for every merge. Without the param it behaves like the original."""
+    # process_info looks the merger up in the module, `yt_dlp.YoutubeDL` itself is the class
+    importlib.import_module("yt_dlp.YoutubeDL").FFmpegMergerPP = SubtitleMergerPP
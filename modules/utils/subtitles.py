@@ -1,12 +1,34 @@
 import os
+import json
 import asyncio
-import requests
 import shutil
-import uuid
+
+'''
+Subtitles for deep-link downloads.
+SubtitleFetch starts downloading the subtitle files (over one pooled session) as
+soon as the job starts and writes a manifest once they are on disk. yt-dlp's merger
+is replaced by SubtitleMergerPP (modules/utils/subtitle_merger.py), which reads that
+manifest (ydl param `subtitle_manifest`) and adds the subtitles to the video+audio
+merge, so the file is written only once. embed_subtitles() is the fallback for
+downloads that didn't go through a merge (single-file formats).
+requests is only imported once the first subtitle is fetched.
+'''
+
+session = None
+
+def get_session():
+    global session
+    if session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    return session
 
 def download_subtitle(url, path):
     try:
-        response = requests.get(url, timeout=10)
+        response = get_session().get(url, timeout=10)
         response.raise_for_status()
         with open(path, 'wb') as f:
             f.write(response.content)
@@ -15,49 +37,91 @@ def download_subtitle(url, path):
         print(f"Failed to download subtitle {url}: {e}")
         return False
 
-async def embed_subtitles(video_path, subtitles_data):
+def subtitle_args(subs, first_input, out_path):
+    """ffmpeg output options mapping subs (inputs first_input, first_input+1, ...) into out_path."""
+    ext = os.path.splitext(out_path)[1].lower()
+    # For MP4, mov_text is standard.
+    codec = {'.webm': 'webvtt', '.mkv': 'srt'}.get(ext, 'mov_text')
+    args = []
+    for i in range(len(subs)):
+        args.extend(['-map', f'{first_input + i}:0'])
+    args.extend(['-c:s', codec])
+    for i, sub in enumerate(subs):
+        # Try to generate a 3-letter code from the language name
+        lang_code = sub['lang'][:3].lower()
+        args.extend([f'-metadata:s:s:{i}', f'language={lang_code}'])
+        args.extend([f'-metadata:s:s:{i}', f'title={sub["lang"]}'])
+        # Set handler name as well for some players
+        args.extend([f'-metadata:s:s:{i}', f'handler_name={sub["lang"]}'])
+    return args
+
+class SubtitleFetch:
+    """
+    Background download of subtitles_data (list of {'url': str, 'lang': str}) into folder.
     """
-    Downloads and embeds subtitles into the video file.
-    subtitles_data: list of {'url': str, 'lang': str}
+    def __init__(self, subtitles_data, folder):
+        self.subtitles_data = subtitles_data
+        self.folder = folder
+        self.manifest_path = os.path.join(folder, "manifest.json")
+        self.task = None
+
+    def start(self):
+        os.makedirs(self.folder, exist_ok=True)
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        subs = []
+        for i, sub in enumerate(self.subtitles_data):
+            url = sub.get('url')
+            if not url: continue
+
+            ext = url.split('.')[-1].split('?')[0]
+            if len(ext) > 4 or '/' in ext:
+                ext = 'vtt' # Default to vtt
+
+            subs.append({'url': url, 'path': os.path.join(self.folder, f"sub_{i}.{ext}"), 'lang': sub.get('lang', 'und')})
+
+        results = await asyncio.gather(*(asyncio.to_thread(download_subtitle, sub['url'], sub['path']) for sub in subs))
+
+        # Filter out failed downloads
+        valid_subs = [{'path': sub['path'], 'lang': sub['lang']} for sub, success in zip(subs, results) if success]
+
+        # Written in one go, the merger only ever sees a complete manifest
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(valid_subs, f)
+        os.replace(tmp_path, self.manifest_path)
+        return valid_subs
+
+    async def result(self):
+        try:
+            return await self.task
+        except Exception as e:
+            print(f"Subtitle fetch failed: {e}")
+            return []
+
+    def merged(self):
+        """True if the subtitles already went into the file during the merge."""
+        return os.path.exists(self.manifest_path + ".merged")
+
+    def cleanup(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+async def embed_subtitles(video_path, fetch):
     """
-    if not subtitles_data or not os.path.exists(video_path):
+    Embeds the subtitles of a SubtitleFetch into the video file.
+    """
+    if not fetch or not os.path.exists(video_path):
         return video_path
 
-    print(f"Embedding {len(subtitles_data)} subtitles into {video_path}")
-
-    temp_dir = os.path.join(os.path.dirname(video_path), f"subs_{uuid.uuid4()}")
-    os.makedirs(temp_dir, exist_ok=True)
-
-    downloaded_subs = []
-
-    # Download subtitles in parallel using threads
-    loop = asyncio.get_running_loop()
-    tasks = []
-
-    for i, sub in enumerate(subtitles_data):
-        url = sub.get('url')
-        if not url: continue
-
-        ext = url.split('.')[-1].split('?')[0]
-        if len(ext) > 4 or '/' in ext:
-            ext = 'vtt' # Default to vtt
-
-        filename = f"sub_{i}.{ext}"
-        filepath = os.path.join(temp_dir, filename)
-        lang = sub.get('lang', 'und')
-
-        tasks.append(loop.run_in_executor(None, download_subtitle, url, filepath))
-        downloaded_subs.append({'path': filepath, 'lang': lang})
-
-    results = await asyncio.gather(*tasks)
-
-    # Filter out failed downloads
-    valid_subs = [sub for sub, success in zip(downloaded_subs, results) if success]
-
+    valid_subs = await fetch.result()
     if not valid_subs:
-        shutil.rmtree(temp_dir)
         return video_path
 
+    print(f"Embedding {len(valid_subs)} subtitles into {video_path}")
+
     # Construct ffmpeg command
     # We output to a temp file then rename
     output_path = f"{video_path}_embed.mp4"
@@ -68,26 +132,9 @@ async def embed_subtitles(video_path, subtitles_data):
     for sub in valid_subs:
         cmd.extend(['-i', sub['path']])
 
-    # Map streams
-    cmd.extend(['-map', '0']) # Map all streams from video
-
-    for i in range(len(valid_subs)):
-        cmd.extend(['-map', f'{i+1}']) # Map each subtitle stream
-
-    # Copy video and audio
-    cmd.extend(['-c:v', 'copy', '-c:a', 'copy'])
-
-    # Set subtitle codec and metadata
-    # For MP4, mov_text is standard.
-    cmd.extend(['-c:s', 'mov_text'])
-
-    for i, sub in enumerate(valid_subs):
-        # Try to generate a 3-letter code from the language name
-        lang_code = sub['lang'][:3].lower()
-        cmd.extend([f'-metadata:s:s:{i}', f'language={lang_code}'])
-        cmd.extend([f'-metadata:s:s:{i}', f'title={sub["lang"]}'])
-        # Set handler name as well for some players
-        cmd.extend([f'-metadata:s:s:{i}', f'handler_name={sub["lang"]}'])
+    # Map all streams from video, copy video and audio
+    cmd.extend(['-map', '0', '-c:v', 'copy', '-c:a', 'copy'])
+    cmd.extend(subtitle_args(valid_subs, 1, output_path))
 
     # Run ffmpeg
     try:
@@ -114,8 +161,4 @@ async def embed_subtitles(video_path, subtitles_data):
         if os.path.exists(output_path):
             os.remove(output_path)
 
-    finally:
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-
     return video_path
@@ -1,60 +1,193 @@
 import json
 import os
+import time
+import asyncio
+import sqlite3
+
+import config
+
+'''
+User preferences.
+Every user lives in an in-memory dict keyed by id, so lookups on the hot path
+(get_quality runs for every YouTube link) never touch the disk. Changes only mark
+the user dirty, a background task writes them out in batches off the event loop.
+
+Backends:
+- sqlite (default): data/users.db in WAL mode, the old data/userdata.json is imported once.
+- redis: a hash shared by several bot instances, re-read every `user_store_refresh` seconds.
+'''
 
 DATA_FILE = "data/userdata.json"
+DB_FILE = "data/users.db"
+REDIS_KEY = "ytdl:users"
+DEFAULT_QUALITY = "720"
+
+class SQLiteBackend:
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # Only ever used by one thread at a time (startup, then the flush task)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, quality TEXT NOT NULL)")
+        self.db.commit()
+
+    def _load(self):
+        return {user_id: {"id": user_id, "quality": quality} for user_id, quality in self.db.execute("SELECT id, quality FROM users")}
+
+    def _write(self, users):
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO users (id, quality) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET quality = excluded.quality",
+                [(user["id"], user["quality"]) for user in users]
+            )
+
+    async def load(self):
+        return await asyncio.to_thread(self._load)
+
+    async def write(self, users):
+        await asyncio.to_thread(self._write, list(users))
+
+    def close(self):
+        self.db.close()
+
+class RedisBackend:
+    def __init__(self, redis_client):
+        self.redis = redis_client
+
+    async def load(self):
+        return {int(user_id): {"id": int(user_id), "quality": quality} for user_id, quality in (await self.redis.hgetall(REDIS_KEY)).items()}
+
+    async def write(self, users):
+        await self.redis.hset(REDIS_KEY, {user["id"]: user["quality"] for user in users})
+
+    def close(self):
+        pass
 
 class UserManager:
     def __init__(self):
-        self.data = {"users": []}
-        self.load_data()
+        self.flush_interval = float(getattr(config, "user_store_flush_interval", 2))
+        self.refresh_interval = float(getattr(config, "user_store_refresh", 300))
+        self.users = {}     # user_id -> {"id", "quality"}
+        self.dirty = set()  # ids changed since the last flush
+        self.task = None
+        self.backend = None
+        self.loaded = False
 
-    def load_data(self):
-        if os.path.exists(DATA_FILE):
+    def open_backend(self):
+        if getattr(config, "user_store", "sqlite") == "redis":
             try:
-                with open(DATA_FILE, "r") as f:
-                    self.data = json.load(f)
+                # Connected by main() before the store starts
+                from modules.connectors.redis_client import r as redis_client
+                if redis_client.redis_enabled:
+                    return RedisBackend(redis_client)
+                print("⚠️ user_store is 'redis' but Redis is not available, using SQLite.")
             except Exception as e:
-                print(f"Error loading user data: {e}")
-                self.data = {"users": []}
-        else:
-            self.save_data()
+                print(f"⚠️ Redis user store could not be loaded, using SQLite: {e}")
+        return SQLiteBackend()
 
-    def save_data(self):
+    async def load_data(self):
         try:
-            if not os.path.exists(os.path.dirname(DATA_FILE)):
-                os.makedirs(os.path.dirname(DATA_FILE))
-            with open(DATA_FILE, "w") as f:
-                json.dump(self.data, f, indent=4)
+            stored = await self.backend.load()
+        except Exception as e:
+            print(f"Error loading user data: {e}")
+            stored = {}
+        # Users who changed a setting while this loaded keep the new one
+        for user_id, user in stored.items():
+            if user_id not in self.dirty:
+                self.users[user_id] = user
+        self.loaded = True
+        if not stored:
+            await self.migrate_json()
+
+    async def migrate_json(self):
+        """One-time import of the old userdata.json list."""
+        if not os.path.exists(DATA_FILE):
+            return
+        try:
+            with open(DATA_FILE, "r") as f:
+                data = json.load(f)
+            for user in data.get("users", []):
+                if user["id"] not in self.dirty:
+                    self.users[user["id"]] = {"id": user["id"], "quality": user.get("quality", DEFAULT_QUALITY)}
+            await self.backend.write(self.users.values())
+            os.replace(DATA_FILE, f"{DATA_FILE}.migrated")
+            print(f"Migrated {len(self.users)} users from {DATA_FILE}")
+        except Exception as e:
+            print(f"Error migrating user data: {e}")
+
+    async def start(self):
+        """Load everything into memory and start the flush task. Call before handling updates."""
+        if self.backend is None:
+            self.backend = self.open_backend()
+            await self.load_data()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.backend:
+            await self.flush()
+            self.backend.close()
+
+    async def flush(self):
+        if not self.dirty or not self.backend:
+            return
+        batch = [self.users[user_id] for user_id in self.dirty if user_id in self.users]
+        self.dirty = set()
+        try:
+            await self.backend.write(batch)
         except Exception as e:
             print(f"Error saving user data: {e}")
+            # Keep them for the next round
+            self.dirty.update(user["id"] for user in batch)
+
+    async def refresh(self):
+        """Pick up changes made by other instances sharing the backend."""
+        try:
+            users = await self.backend.load()
+        except Exception as e:
+            print(f"Error refreshing user data: {e}")
+            return
+        for user_id, user in users.items():
+            if user_id not in self.dirty:
+                self.users[user_id] = user
+
+    async def _run(self):
+        last_refresh = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if isinstance(self.backend, RedisBackend) and time.monotonic() - last_refresh >= self.refresh_interval:
+                last_refresh = time.monotonic()
+                await self.refresh()
 
     def get_user(self, user_id):
-        for user in self.data["users"]:
-            if user["id"] == user_id:
-                return user
-        return None
+        return self.users.get(user_id)
 
     def add_user(self, user_id):
-        if not self.get_user(user_id):
-            new_user = {"id": user_id, "quality": "720"}
-            self.data["users"].append(new_user)
-            self.save_data()
-            return new_user
-        return self.get_user(user_id)
+        user = self.users.get(user_id)
+        if not user:
+            user = {"id": user_id, "quality": DEFAULT_QUALITY}
+            # Before the store is loaded a default would hide the stored entry, only changes are kept
+            if self.loaded:
+                self.users[user_id] = user
+                self.dirty.add(user_id)
+        return user
 
     def set_quality(self, user_id, quality):
-        user = self.get_user(user_id)
-        if user:
-            user["quality"] = quality
-            self.save_data()
-        else:
-            self.add_user(user_id)
-            self.set_quality(user_id, quality)
+        user = self.add_user(user_id)
+        user["quality"] = quality
+        self.users[user_id] = user
+        self.dirty.add(user_id)
 
     def get_quality(self, user_id):
-        user = self.get_user(user_id)
-        if user:
-            return user.get("quality", "720")
-        else:
-            self.add_user(user_id)
-            return "720"
+        return self.add_user(user_id).get("quality", DEFAULT_QUALITY)
@@ -1,43 +1,96 @@
 import re
-# import urllib.parse
-
-class UrlValidator:
-    def __init__(self, url: str) -> bool:
-        self.url = url.strip()
-
-    def isUrl(self) -> bool:
-        # Updated regex to support optional port numbers
-        pattern = r'^(https?://)?([a-zA-Z0-9-]+\.)+[a-zA-Z]{2,}(:[0-9]+)?(/.*)?$'
-        result  = re.match(pattern, self.url) is not None
-        return result
-
-    def isSpotify(self) -> bool:
-        pattern = r'^(https?://)?(open\.)?spotify\.com/.*$'
-        result  = re.match(pattern, self.url) is not None
-        return result
-
-    def isInstagram(self) -> bool:
-        pattern = r'^(https?://)?(www\.)?instagram\.com/.*$'
-        result  = re.match(pattern, self.url) is not None
-        return result
-
-    # Match YouTube URLs ['www.youtube.com', 'youtu.be', 'youtube.com', 'youtu.be']
-    def isYouTube(self) -> bool:
-        pattern = r'^(https?://)?(www\.)?(youtube\.com|youtu\.be)/.*$'
-        result  = re.match(pattern, self.url) is not None
-        return result
-
-    #Auto detect music platforms such as spotify, soundcloud, apple music, tidal, youtube music
-    def isMusicPlatform(self) -> bool:
-        music_platforms = [
-            r'^(https?://)?(open\.)?spotify\.com/.*$',
-            r'^(https?://)?(www\.)?soundcloud\.com/.*$',
-            r'^(https?://)?(music\.)?apple\.com/.*$',
-            r'^(https?://)?(tidal\.com/).*$',
-            r'^(https?://)?(music\.)?youtube\.com/.*$',
-            r'^(https?://)?(youtu\.be)/.*$'
-        ]
-        for pattern in music_platforms:
-            if re.match(pattern, self.url):
-                return True
-        return False
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Query params that only track where a link was shared from, they never change the media
+TRACKING_PARAMS = {'si', 'feature', 'pp', 'fbclid', 'gclid', 'igshid', 'igsh', 'ref_src', 'ref_url'}
+
+SCHEME_PATTERN = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.-]*://')
+URL_PATTERN = re.compile(r'^(https?://)?([a-zA-Z0-9-]+\.)+[a-zA-Z]{2,}(:[0-9]+)?(/.*)?$')
+
+def split_url(url: str):
+    """
+    (scheme, host, port, path, query pairs) of url with tracking params dropped
+    and youtu.be/<id>, /shorts/<id> rewritten to youtube.com/watch?v=<id>.
+    """
+    url = url.strip()
+    if not SCHEME_PATTERN.match(url):
+        url = f"https://{url}"
+
+    parts = urlsplit(url)
+    host = (parts.hostname or '').lower()
+    path = parts.path
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k not in TRACKING_PARAMS and not k.startswith('utm_')]
+
+    # youtu.be/<id> and /shorts/<id> are the same video as /watch?v=<id>
+    bare = bare_host(host)
+    if bare == 'youtu.be' and path.strip('/'):
+        query.insert(0, ('v', path.strip('/')))
+        host, path = 'www.youtube.com', '/watch'
+    elif bare == 'youtube.com' and path.startswith('/shorts/'):
+        query.insert(0, ('v', path.split('/')[2]))
+        path = '/watch'
+    return parts.scheme.lower(), host, parts.port, path, query
+
+def bare_host(host):
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            return host[len(prefix):]
+    return host
+
+def url_key(host, port, path, query):
+    host = bare_host(host)
+    netloc = f"{host}:{port}" if port else host
+    return urlunsplit(('https', netloc, path.rstrip('/'), urlencode(sorted(query)), ''))
+
+def normalize_url(url: str) -> str:
+    """
+    Canonical form of a link, so the same media shared as
+    `youtu.be/x?si=...` and `https://www.youtube.com/watch?v=x` compares equal.
+    """
+    _, host, port, path, query = split_url(url)
+    return url_key(host, port, path, query)
+
+class Link:
+    """
+    A link from a user, parsed once.
+    url is what gets downloaded (canonical, scheme and query order kept), key is
+    normalize_url() for caches. provider and site are filled in by the provider registry.
+    """
+    __slots__ = ('original', 'url', 'host', 'key', 'provider', 'site')
+
+    def __init__(self, original, url, host, key):
+        self.original = original
+        self.url = url
+        self.host = host
+        self.key = key
+        self.provider = None
+        self.site = None
+
+    def __str__(self):
+        return self.url
+
+def parse_link(text: str):
+    """Link for text, or None if it isn't a URL."""
+    text = (text or '').strip()
+    if not URL_PATTERN.match(text):
+        return None
+    scheme, host, port, path, query = split_url(text)
+    netloc = f"{host}:{port}" if port else host
+    url = urlunsplit((scheme, netloc, path, urlencode(query), ''))
+    return Link(text, url, host, url_key(host, port, path, query))
+
+# yt-dlp's --playlist-items syntax: 5-20, 1,3,7-9, -5: ...
+PLAYLIST_ITEMS_PATTERN = re.compile(r'^-?\d*[-:]?-?\d*(:-?\d+)?(,-?\d*[-:]?-?\d*(:-?\d+)?)*$')
+
+def playlist_selection(text: str):
+    """
+    yt-dlp playlist_items for a /playlist selector, or None if text isn't one.
+    A bare number N means the first N items, anything else is passed on as is.
+    """
+    text = (text or '').strip()
+    if text.isdigit():
+        return f"1-{int(text)}" if int(text) else None
+    if text and any(c.isdigit() for c in text) and PLAYLIST_ITEMS_PATTERN.match(text):
+        return text
+    return None
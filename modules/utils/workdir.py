@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import shutil
+import asyncio
+
+import config
+from modules.utils.exceptions import NotEnoughSpace
+
+'''
+Per-job work directories.
+Every job downloads into output_folder/jobs/<job id>/ and keeps a manifest.json
+of the artifacts it produced, so finding and removing its files never scans the
+shared output folder. The janitor removes directories of jobs that are no longer
+running once they are older than `job_max_age`, and the oldest ones first while
+the jobs folder is above `output_disk_budget`. It also drops published files
+whose links have expired.
+'''
+
+JOBS_DIR = os.path.join(config.output_folder, "jobs")
+# Files handed out as links by the file server, in <expiry>-<id>/ folders
+PUBLIC_DIR = os.path.join(config.output_folder, "public")
+MANIFEST = "manifest.json"
+
+MIN_FREE_SPACE = int(getattr(config, "min_free_space", 1024 ** 3))
+
+class JobDir:
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.path = os.path.join(JOBS_DIR, job_id)
+        self.manifest_path = os.path.join(self.path, MANIFEST)
+        self.artifacts = []
+
+    def create(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.created = time.time()
+        self.save()
+        return self
+
+    def save(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"id": self.job_id, "created": self.created, "updated": time.time(), "artifacts": self.artifacts}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def path_for(self, name):
+        return os.path.join(self.path, name)
+
+    def add(self, path):
+        """Record a file this job produced, also outside its directory."""
+        if path and path not in self.artifacts:
+            self.artifacts.append(path)
+            try:
+                self.save()
+            except OSError as e:
+                print(f"Could not update job manifest: {e}")
+
+    def find(self, prefix):
+        """First file in the job directory starting with prefix."""
+        try:
+            for entry in os.scandir(self.path):
+                if entry.is_file() and entry.name.startswith(prefix) and entry.name != MANIFEST:
+                    return entry.path
+        except FileNotFoundError:
+            pass
+        return None
+
+    def cleanup(self):
+        for path in self.artifacts:
+            if not path.startswith(self.path + os.sep):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        shutil.rmtree(self.path, ignore_errors=True)
+
+def ensure_space(expected_size=0):
+    """Raise NotEnoughSpace unless expected_size fits with MIN_FREE_SPACE to spare."""
+    os.makedirs(config.output_folder, exist_ok=True)
+    free = shutil.disk_usage(config.output_folder).free
+    if free - (expected_size or 0) < MIN_FREE_SPACE:
+        raise NotEnoughSpace(f"Not enough free disk space right now ({free // 1024 ** 2} MB free), try again later.")
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+class Janitor:
+    def __init__(self):
+        self.interval = float(getattr(config, "janitor_interval", 600))
+        self.max_age = float(getattr(config, "job_max_age", 6 * 3600))
+        self.budget = getattr(config, "output_disk_budget", None)  # bytes, None for no limit
+        self.active_jobs = lambda: set()
+        self.task = None
+
+    def start(self, active_jobs):
+        """active_jobs() returns the ids of jobs whose directories must not be touched."""
+        self.active_jobs = active_jobs
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep, set(self.active_jobs()))
+                await asyncio.to_thread(self.sweep_public)
+            except Exception as e:
+                print(f"Janitor error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def sweep(self, active):
+        if not os.path.isdir(JOBS_DIR):
+            return
+        now = time.time()
+        candidates = []  # (last change, job), jobs the budget may remove
+        for entry in os.scandir(JOBS_DIR):
+            if not entry.is_dir() or entry.name in active:
+                continue
+            job = JobDir(entry.name)
+            try:
+                with open(job.manifest_path, "r") as f:
+                    manifest = json.load(f)
+                job.artifacts = manifest.get("artifacts", [])
+                changed = manifest.get("updated", 0)
+            except (OSError, ValueError):
+                changed = entry.stat().st_mtime
+
+            if now - changed > self.max_age:
+                print(f"Janitor: removing stale job {job.job_id}")
+                job.cleanup()
+            elif self.budget:
+                candidates.append((changed, job))
+
+        if not self.budget:
+            return
+        # Running jobs count against the budget too, they just can't be removed
+        used = dir_size(JOBS_DIR)
+        for _, job in sorted(candidates, key=lambda c: c[0]):
+            if used <= self.budget:
+                break
+            print(f"Janitor: over disk budget, removing job {job.job_id}")
+            used -= dir_size(job.path)
+            job.cleanup()
+
+    def sweep_public(self):
+        if not os.path.isdir(PUBLIC_DIR):
+            return
+        now = time.time()
+        for entry in os.scandir(PUBLIC_DIR):
+            expires = entry.name.split("-", 1)[0]
+            if entry.is_dir() and expires.isdigit() and int(expires) < now:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+janitor = Janitor()
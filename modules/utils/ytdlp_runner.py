@@ -0,0 +1,221 @@
+import os
+import sys
+import time
+import pickle
+import struct
+import asyncio
+
+'''
+Runs yt-dlp either in a thread (default) or, with `ytdlp_process_mode = True`,
+in a separate worker process per job.
+
+The worker keeps extraction regexes, JS challenge solving and JSON parsing off the
+bot's GIL, and can be killed outright on cancel, even in the middle of a merge.
+Parent and worker talk over stdin/stdout with length-prefixed pickles:
+
+    parent -> worker: request dict, then the answer to the "extracted" check
+    worker -> parent: ("progress", d) / ("extracted", info) / ("done", info) / ("error", (type, msg))
+
+Run as `python -m modules.utils.ytdlp_runner`, never import-time side effects here.
+'''
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+HEARTBEAT_INTERVAL = 0.5
+PROGRESS_INTERVAL = 0.25
+
+# Big lists the parent never looks at in the "extracted" check
+HEAVY_KEYS = {'formats', 'thumbnails', 'subtitles', 'automatic_captions', 'heatmap', 'chapters'}
+
+# What the progress hooks in the bot actually read
+PROGRESS_KEYS = ('status', 'filename', 'tmpfilename', 'downloaded_bytes', 'total_bytes',
+                 'total_bytes_estimate', 'speed', 'eta', 'elapsed', 'fragment_index', 'fragment_count')
+PROGRESS_INFO_KEYS = ('id', 'title', 'ext', 'format_id', 'protocol', 'filesize', 'filesize_approx',
+                      'requested_formats', 'width', 'height', 'duration')
+
+def compact_progress(d):
+    compact = {k: d[k] for k in PROGRESS_KEYS if k in d}
+    info = d.get('info_dict') or {}
+    compact['info_dict'] = {k: info[k] for k in PROGRESS_INFO_KEYS if k in info}
+    if 'requested_formats' in compact['info_dict']:
+        compact['info_dict']['requested_formats'] = True
+    return compact
+
+def light_info(info):
+    return {k: v for k, v in info.items() if k not in HEAVY_KEYS}
+
+def download_error():
+    """yt_dlp's DownloadError, for `except` clauses in modules that don't import yt_dlp at startup."""
+    import yt_dlp.utils
+    return yt_dlp.utils.DownloadError
+
+async def extract(url, ydl_opts, download=True, progress_callback=None, before_download=None, info=None):
+    """
+    Extract (and optionally download) url with yt-dlp.
+
+    before_download(info) is called after the format is resolved and before anything
+    is downloaded; a truthy return skips the download. Returns (info, before_download result).
+    Passing a previously extracted info skips the extraction and goes straight to
+    format selection and download.
+    """
+    import config
+    if getattr(config, "ytdlp_process_mode", False):
+        return await _extract_in_process(url, ydl_opts, download, progress_callback, before_download, info)
+    return await asyncio.to_thread(_extract_in_thread, url, ydl_opts, download, progress_callback, before_download, info)
+
+def _resolve(ydl, url, info):
+    if info is None:
+        return ydl.extract_info(url, download=False)
+    # Re-run format selection with this job's options, nothing is fetched
+    return ydl.process_ie_result(ydl.sanitize_info(info, remove_private_keys=True), download=False)
+
+def _extract_in_thread(url, ydl_opts, download, progress_callback, before_download, info):
+    import yt_dlp
+    from modules.utils.subtitle_merger import install_subtitle_merger
+    install_subtitle_merger()
+
+    opts = dict(ydl_opts)
+    if progress_callback:
+        # The hook tells postprocessor calls apart by their 'postprocessor' key
+        opts['progress_hooks'] = [progress_callback]
+        opts['postprocessor_hooks'] = [progress_callback]
+
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = _resolve(ydl, url, info)
+        if not download:
+            return info, None
+        hit = before_download(info) if before_download else None
+        if hit:
+            return info, hit
+        return ydl.process_ie_result(ydl.sanitize_info(info, remove_private_keys=True), download=True), None
+
+async def _read_frame(reader):
+    size, = struct.unpack(">I", await reader.readexactly(4))
+    return pickle.loads(await reader.readexactly(size))
+
+def _frame(obj):
+    data = pickle.dumps(obj)
+    return struct.pack(">I", len(data)) + data
+
+async def _extract_in_process(url, ydl_opts, download, progress_callback, before_download, info):
+    import yt_dlp
+
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "modules.utils.ytdlp_runner",
+        cwd=PROJECT_ROOT,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        limit=2 ** 26,
+    )
+
+    request = {
+        "url": url,
+        "opts": ydl_opts,
+        "download": download,
+        "check": before_download is not None,
+        "info": info,
+    }
+
+    read_task = None
+    try:
+        process.stdin.write(_frame(request))
+        await process.stdin.drain()
+
+        last = {}
+        read_task = asyncio.ensure_future(_read_frame(process.stdout))
+        while True:
+            done, _ = await asyncio.wait({read_task}, timeout=HEARTBEAT_INTERVAL)
+            if not done:
+                # Nothing new (merging, postprocessing, slow extractor), give the hook
+                # a chance to cancel anyway
+                if progress_callback:
+                    progress_callback({**last, 'status': 'heartbeat'})
+                continue
+
+            try:
+                kind, payload = read_task.result()
+            except asyncio.IncompleteReadError:
+                await process.wait()
+                raise Exception(f"yt-dlp worker exited unexpectedly (code {process.returncode})")
+
+            if kind == "progress":
+                last = payload
+                if progress_callback:
+                    progress_callback(payload)
+            elif kind == "extracted":
+                hit = before_download(payload)
+                if hit:
+                    return payload, hit
+                process.stdin.write(_frame(False))
+                await process.stdin.drain()
+            elif kind == "done":
+                return payload, None
+            elif kind == "error":
+                error_type, error_message = payload
+                if error_type == "DownloadError":
+                    raise yt_dlp.utils.DownloadError(error_message)
+                raise Exception(error_message)
+
+            read_task = asyncio.ensure_future(_read_frame(process.stdout))
+    finally:
+        if read_task:
+            read_task.cancel()
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+
+def _worker():
+    # Keep stdout for the protocol, everything yt-dlp prints goes to stderr
+    proto_out = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    proto_in = sys.stdin.buffer
+
+    def send(obj):
+        proto_out.write(_frame(obj))
+        proto_out.flush()
+
+    def receive():
+        size, = struct.unpack(">I", proto_in.read(4))
+        return pickle.loads(proto_in.read(size))
+
+    import yt_dlp
+    from modules.utils.subtitle_merger import install_subtitle_merger
+    install_subtitle_merger()
+
+    request = receive()
+    opts = dict(request["opts"])
+
+    last_sent = {'time': 0, 'status': None}
+    def hook(d):
+        now = time.time()
+        if d.get('status') == last_sent['status'] and now - last_sent['time'] < PROGRESS_INTERVAL:
+            return
+        last_sent.update(time=now, status=d.get('status'))
+        send(("progress", compact_progress(d)))
+
+    def postprocessor_hook(d):
+        send(("progress", {'status': d.get('status'), 'postprocessor': d.get('postprocessor')}))
+
+    opts['progress_hooks'] = [hook]
+    opts['postprocessor_hooks'] = [postprocessor_hook]
+
+    try:
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            info = _resolve(ydl, request["url"], request["info"])
+            if request["download"]:
+                if request["check"]:
+                    send(("extracted", light_info(ydl.sanitize_info(info))))
+                    if receive():
+                        return
+                info = ydl.process_ie_result(ydl.sanitize_info(info, remove_private_keys=True), download=True)
+            send(("done", ydl.sanitize_info(info)))
+    except yt_dlp.utils.DownloadError as e:
+        send(("error", ("DownloadError", str(e))))
+    except Exception as e:
+        send(("error", (type(e).__name__, str(e))))
+
+if __name__ == "__main__":
+    _worker()
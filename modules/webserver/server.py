@@ -1,27 +1,380 @@
 import os
 import sys
-from flask import Flask, send_from_directory # type: ignore
+import hmac
+import time
+import uuid
+import shutil
+import asyncio
+import hashlib
+import secrets
+import threading
+import mimetypes
+import email.utils
+from urllib.parse import quote, unquote, urlsplit, parse_qs
 
 # Add parent directory to path to import config
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 import config
+from modules.utils.workdir import PUBLIC_DIR
 
-app = Flask(__name__)
-PORT = 8000
+'''
+Asyncio file server for files too big to upload to Telegram.
+Only serves output_folder/public, where publish_file() moves finished files,
+and only through HMAC-signed links that expire (?exp=<unix time>&sig=<hex>).
+Bodies go out with sendfile, single HTTP ranges and conditional requests
+(ETag / Last-Modified) are supported so players and download managers can seek and resume.
+The janitor removes published files once their links have expired.
 
-# Ensure the output folder exists
-if not os.path.exists(config.output_folder):
-    os.makedirs(config.output_folder)
+Running jobs can also be watched while they download: register_live() exposes the
+file yt-dlp is writing under /live/<job id>, and clients get a tail-following
+stream that waits for new bytes until the job calls finish_live().
 
-@app.route('/<path:filename>')
-def serve_file(filename):
-    # Use os.path.abspath to ensure we are serving from the correct absolute path
-    directory = os.path.abspath(config.output_folder)
-    return send_from_directory(directory, filename)
+Run standalone with `python -m modules.webserver.server`, or let main.py start it
+with `file_server_enabled = True`.
+'''
 
-def run_server():
-    # Run threaded=True to handle multiple requests if needed, though for this use case simple is fine
-    app.run(host='0.0.0.0', port=PORT, threaded=True)
+PORT = int(getattr(config, "file_server_port", 8000))
+HOST = getattr(config, "file_server_host", "0.0.0.0")
+LINK_TTL = int(getattr(config, "file_link_ttl", 24 * 3600))
+MAX_HEADER_SIZE = 16 * 1024
+KEEPALIVE_TIMEOUT = 30
+LIVE_LINK_TTL = int(getattr(config, "live_link_ttl", 6 * 3600))
+LIVE_POLL_INTERVAL = 0.25
+# A live stream whose file stops growing for this long is ended
+LIVE_IDLE_TIMEOUT = 120
+# Containers a player can start on before the file is complete (progressive or fragmented)
+LIVE_TYPES = {"mp4": "video/mp4", "webm": "video/webm", "m4a": "audio/mp4", "mp3": "audio/mpeg"}
+
+# Without a configured secret links only survive as long as this process
+SECRET = getattr(config, "file_server_secret", None) or secrets.token_hex(32)
+SECRET = SECRET.encode() if isinstance(SECRET, str) else SECRET
+
+REASONS = {200: "OK", 206: "Partial Content", 304: "Not Modified", 400: "Bad Request", 403: "Forbidden",
+           404: "Not Found", 405: "Method Not Allowed", 416: "Range Not Satisfiable"}
+
+def sign(path, expires):
+    return hmac.new(SECRET, f"{path}:{expires}".encode(), hashlib.sha256).hexdigest()
+
+def signed_query(path, ttl=LINK_TTL):
+    expires = int(time.time() + ttl)
+    return f"exp={expires}&sig={sign(path, expires)}"
+
+def verify(path, query):
+    try:
+        expires = int(query["exp"][0])
+        signature = query["sig"][0]
+    except (KeyError, IndexError, ValueError):
+        return False
+    return expires >= time.time() and hmac.compare_digest(signature, sign(path, expires))
+
+def publish_file(filepath, ttl=LINK_TTL):
+    """Move a finished file into the served folder, returns its signed URL."""
+    expires = int(time.time() + ttl)
+    # The janitor reads the expiry back from the folder name
+    folder = f"{expires}-{uuid.uuid4().hex}"
+    os.makedirs(os.path.join(PUBLIC_DIR, folder))
+    name = os.path.basename(filepath)
+    shutil.move(filepath, os.path.join(PUBLIC_DIR, folder, name))
+
+    path = f"{folder}/{name}"
+    base_url = getattr(config, "file_server_url", f"http://localhost:{PORT}").rstrip("/")
+    return f"{base_url}/{quote(path)}?exp={expires}&sig={sign(path, expires)}"
+
+class LiveSource:
+    """A file that is still being written. The descriptor survives yt-dlp renaming the .part file."""
+    def __init__(self, path, total_size=None, content_type="video/mp4"):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.total_size = total_size
+        self.content_type = content_type
+        self.finished = False
+        self.lock = threading.Lock()
+
+    def open(self):
+        """A reader with its own file offset, so clients don't disturb each other. Raises OSError once the file is gone."""
+        with self.lock:
+            # Finished in between, the file is complete wherever it ended up
+            if self.fd is None:
+                return open(self.path, "rb")
+            return open(f"/proc/self/fd/{self.fd}", "rb") if os.path.exists("/proc/self/fd") else os.fdopen(os.dup(self.fd), "rb")
+
+    def finish(self):
+        with self.lock:
+            self.finished = True
+            if self.fd is not None:
+                # Follow the rename of the .part file for readers that open after this
+                try:
+                    self.path = os.readlink(f"/proc/self/fd/{self.fd}")
+                except OSError:
+                    pass
+                os.close(self.fd)
+                self.fd = None
+
+live_sources = {}  # job id -> LiveSource
+
+def can_live(d):
+    """Whether a yt-dlp progress dict describes a download that can be watched while it runs."""
+    info = d.get('info_dict') or {}
+    return bool(
+        d.get('status') == 'downloading'
+        and d.get('downloaded_bytes')
+        # Separate video and audio only become one file after the merge
+        and not info.get('requested_formats')
+        and info.get('ext') in LIVE_TYPES
+        and d.get('tmpfilename') and os.path.exists(d['tmpfilename'])
+    )
+
+def register_live(job_id, path, total_size=None, ext="mp4"):
+    live_sources[job_id] = LiveSource(path, total_size, LIVE_TYPES.get(ext, "application/octet-stream"))
+    path = f"live/{job_id}"
+    expires = int(time.time() + LIVE_LINK_TTL)
+    base_url = getattr(config, "file_server_url", f"http://localhost:{PORT}").rstrip("/")
+    return f"{base_url}/{path}?exp={expires}&sig={sign(path, expires)}"
+
+def finish_live(job_id):
+    """No more bytes are coming. Open streams send what's left and end, new ones get 404."""
+    source = live_sources.pop(job_id, None)
+    if source:
+        source.finish()
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single 'bytes=' range, None to send everything, False if unsatisfiable."""
+    if not header.startswith("bytes=") or "," in header:
+        # Multiple ranges are allowed to be answered with the full body
+        return None
+    start, _, end = header[6:].strip().partition("-")
+    try:
+        if not start:
+            length = int(end)
+            if length <= 0:
+                return False
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+class FileServer:
+    def __init__(self, root=PUBLIC_DIR):
+        self.root = os.path.realpath(root)
+        self.server = None
+        self.bytes_sent = 0
+
+    async def start(self, host=HOST, port=PORT):
+        os.makedirs(self.root, exist_ok=True)
+        if not getattr(config, "file_server_secret", None):
+            print("⚠️ file_server_secret is not set, links stop working when the bot restarts.")
+        self.server = await asyncio.start_server(self.handle, host, port)
+        print(f"File server listening on {host}:{port}")
+        return self.server
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        try:
+            while await self.handle_request(reader, writer):
+                pass
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        except Exception as e:
+            print(f"File server error: {e}")
+        finally:
+            writer.close()
+
+    async def handle_request(self, reader, writer):
+        """Serve one request, True if the connection stays open."""
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+        if len(head) > MAX_HEADER_SIZE:
+            await self.respond(writer, 400, close=True)
+            return False
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            await self.respond(writer, 400, close=True)
+            return False
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+
+        if method not in ("GET", "HEAD"):
+            await self.respond(writer, 405, {"Allow": "GET, HEAD"}, close=not keep_alive)
+            return keep_alive
+
+        url = urlsplit(target)
+        path = unquote(url.path).lstrip("/")
+        if not verify(path, parse_qs(url.query)):
+            await self.respond(writer, 403, close=not keep_alive)
+            return keep_alive
+
+        if path.startswith("live/"):
+            source = live_sources.get(path[5:])
+            if not source:
+                await self.respond(writer, 404, close=not keep_alive)
+                return keep_alive
+            return await self.send_live(writer, method, source, headers, keep_alive)
+
+        full_path = os.path.realpath(os.path.join(self.root, path))
+        if not full_path.startswith(self.root + os.sep) or not os.path.isfile(full_path):
+            await self.respond(writer, 404, close=not keep_alive)
+            return keep_alive
+
+        await self.send_file(writer, method, full_path, headers, keep_alive)
+        return keep_alive
+
+    async def respond(self, writer, status, headers=None, close=False, body=b""):
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+        headers = dict(headers or {})
+        if "Transfer-Encoding" not in headers:
+            headers.setdefault("Content-Length", str(len(body)))
+        headers["Connection"] = "close" if close else "keep-alive"
+        headers["Date"] = email.utils.formatdate(usegmt=True)
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def send_file(self, writer, method, full_path, headers, keep_alive):
+        with open(full_path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            size = stat.st_size
+            etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+            last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+            name = os.path.basename(full_path)
+            common = {
+                "ETag": etag,
+                "Last-Modified": last_modified,
+                "Accept-Ranges": "bytes",
+                "Cache-Control": "private, max-age=3600",
+            }
+
+            # Conditional GET: the client's copy is still current
+            if_none_match = headers.get("if-none-match")
+            if if_none_match:
+                tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+                if "*" in tags or etag in tags:
+                    await self.respond(writer, 304, common, close=not keep_alive)
+                    return
+            elif "if-modified-since" in headers:
+                try:
+                    since = email.utils.parsedate_to_datetime(headers["if-modified-since"]).timestamp()
+                except (TypeError, ValueError):
+                    since = None
+                if since and int(stat.st_mtime) <= since:
+                    await self.respond(writer, 304, common, close=not keep_alive)
+                    return
+
+            status = 200
+            start, end = 0, size - 1
+            byte_range = headers.get("range")
+            if_range = headers.get("if-range")
+            # A resumed download of a file that changed in between gets the whole new file
+            if byte_range and (not if_range or if_range in (etag, last_modified)):
+                parsed = parse_range(byte_range, size)
+                if parsed is False:
+                    await self.respond(writer, 416, {**common, "Content-Range": f"bytes */{size}"}, close=not keep_alive)
+                    return
+                if parsed:
+                    status = 206
+                    start, end = parsed
+                    common["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+            length = end - start + 1 if size else 0
+            await self.respond(writer, status, {
+                **common,
+                "Content-Type": mimetypes.guess_type(name)[0] or "application/octet-stream",
+                "Content-Length": str(length),
+                "Content-Disposition": f"attachment; filename*=UTF-8''{quote(name)}",
+            }, close=not keep_alive)
+
+            if method == "GET" and length:
+                # Zero-copy from the page cache where the transport allows it
+                await asyncio.get_running_loop().sendfile(writer.transport, f, start, length)
+                self.bytes_sent += length
+
+    async def send_live(self, writer, method, source, headers, keep_alive):
+        """Stream a growing file, True if the response was complete and the connection can be reused."""
+        total = source.total_size
+        status = 200
+        start, stop = 0, total
+        extra = {"Accept-Ranges": "bytes" if total else "none", "Cache-Control": "no-store"}
+        # Seeking only works when the final size is known up front
+        if total and headers.get("range"):
+            parsed = parse_range(headers["range"], total)
+            if parsed is False:
+                await self.respond(writer, 416, {"Content-Range": f"bytes */{total}"}, close=not keep_alive)
+                return keep_alive
+            if parsed:
+                status = 206
+                start, stop = parsed[0], parsed[1] + 1
+                extra["Content-Range"] = f"bytes {start}-{parsed[1]}/{total}"
+
+        try:
+            f = source.open()
+        except OSError:
+            # The job ended and its file was already moved or removed
+            await self.respond(writer, 404, close=not keep_alive)
+            return keep_alive
+
+        chunked = stop is None
+        if chunked:
+            extra["Transfer-Encoding"] = "chunked"
+        else:
+            extra["Content-Length"] = str(stop - start)
+        with f:
+            await self.respond(writer, status, {**extra, "Content-Type": source.content_type}, close=not keep_alive)
+            if method == "HEAD":
+                return keep_alive
+
+            loop = asyncio.get_running_loop()
+            offset = start
+            idle = 0
+            while stop is None or offset < stop:
+                # Read the flag first, bytes written before it was set are still sent
+                finished = source.finished
+                available = os.fstat(f.fileno()).st_size
+                if stop is not None:
+                    available = min(available, stop)
+                if available > offset:
+                    count = available - offset
+                    if chunked:
+                        writer.write(f"{count:x}\r\n".encode())
+                    await loop.sendfile(writer.transport, f, offset, count)
+                    if chunked:
+                        writer.write(b"\r\n")
+                    self.bytes_sent += count
+                    offset = available
+                    idle = 0
+                    continue
+                if finished or idle >= LIVE_IDLE_TIMEOUT:
+                    break
+                await asyncio.sleep(LIVE_POLL_INTERVAL)
+                idle += LIVE_POLL_INTERVAL
+
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+            return keep_alive
+        # The download ended short of its announced size, only closing tells the client
+        return keep_alive and offset >= stop
+
+file_server = FileServer()
+
+async def run_server():
+    server = await file_server.start()
+    async with server:
+        await server.serve_forever()
 
 if __name__ == "__main__":
-    run_server()
+    asyncio.run(run_server())